@@ -14,17 +14,13 @@ fileConfig(config.config_file_name)
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from models import DBBase
+from database import get_settings
 
 target_metadata = DBBase.metadata
 
 
 def get_url():
-    user = os.getenv('DB_USER', 'user')
-    pw = os.getenv('DB_PASSWORD', 'pass')
-    host = os.getenv('DB_HOST', 'localhost')
-    port = os.getenv('DB_PORT', '5432')
-    db = os.getenv('DB_NAME', 'db')
-    return f'postgresql+psycopg2://{user}:{pw}@{host}:{port}/{db}'
+    return get_settings().DATABASE_URL
 
 
 def run_migrations_offline():
@@ -1,11 +1,69 @@
 
-
 from alembic import op
-import sqlalchemy as sa
+
+
+revision = '0001_initial'
+down_revision = None
+branch_labels = None
+depends_on = None
 
 
 def upgrade():
-    pass
+    # These tables used to be created by metadata.create_all() at app import;
+    # existing databases already have them. IF NOT EXISTS instead of inspecting
+    # the live schema keeps `alembic upgrade --sql` (offline mode) working.
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR,
+            nombre VARCHAR,
+            rol VARCHAR,
+            password_hash VARCHAR,
+            microsoft_id VARCHAR
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_usuarios_id ON usuarios (id)")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_usuarios_email ON usuarios (email)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS clientes (
+            id SERIAL PRIMARY KEY,
+            nombre VARCHAR,
+            email VARCHAR,
+            telefono VARCHAR,
+            ubicacion VARCHAR,
+            estado VARCHAR,
+            fecha_registro TIMESTAMP WITHOUT TIME ZONE,
+            tasa_conversion FLOAT,
+            satisfaccion FLOAT
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_clientes_id ON clientes (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_clientes_nombre ON clientes (nombre)")
+    op.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_clientes_email ON clientes (email)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS conversaciones (
+            id SERIAL PRIMARY KEY,
+            cliente_id INTEGER REFERENCES clientes (id),
+            fecha_inicio TIMESTAMP WITHOUT TIME ZONE,
+            estado VARCHAR,
+            ultimo_mensaje TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_conversaciones_id ON conversaciones (id)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS mensajes (
+            id SERIAL PRIMARY KEY,
+            conversacion_id INTEGER REFERENCES conversaciones (id),
+            contenido VARCHAR,
+            es_del_cliente BOOLEAN,
+            fecha_envio TIMESTAMP WITHOUT TIME ZONE
+        )
+    """)
+    op.execute("CREATE INDEX IF NOT EXISTS ix_mensajes_id ON mensajes (id)")
+
 
 def downgrade():
     pass
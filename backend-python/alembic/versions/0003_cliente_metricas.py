@@ -0,0 +1,35 @@
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003_cliente_metricas'
+down_revision = '0002_whatsapp_ts_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'cliente_metricas',
+        sa.Column('cliente_id', sa.Integer(), sa.ForeignKey('clientes.id'), primary_key=True),
+        sa.Column('conversaciones_total', sa.Integer()),
+        sa.Column('conversaciones_resueltas', sa.Integer()),
+        sa.Column('mensajes_total', sa.Integer()),
+        sa.Column('mensajes_cliente', sa.Integer()),
+        sa.Column('mensajes_agente', sa.Integer()),
+        sa.Column('tiempo_respuesta_promedio', sa.Float(), nullable=True),
+        sa.Column('ultima_actividad', sa.DateTime(), nullable=True),
+        sa.Column('ultimo_mensaje_id', sa.Integer()),
+        sa.Column('actualizado', sa.DateTime()),
+    )
+    op.create_index('ix_cliente_metricas_ultimo_mensaje_id', 'cliente_metricas', ['ultimo_mensaje_id'])
+    # The metric aggregates join and window over these foreign keys.
+    op.create_index('ix_conversaciones_cliente_id', 'conversaciones', ['cliente_id'], if_not_exists=True)
+    op.create_index('ix_mensajes_conversacion_fecha', 'mensajes', ['conversacion_id', 'fecha_envio', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_mensajes_conversacion_fecha', table_name='mensajes')
+    op.drop_index('ix_conversaciones_cliente_id', table_name='conversaciones')
+    op.drop_table('cliente_metricas')
@@ -0,0 +1,218 @@
+"""Monthly range partitions for bot.whatsapp and public.n8n_chat_histories.
+
+Self-contained on purpose (no application imports), so later changes to
+partitions.py cannot alter what this revision does.
+
+Upgrade, per table, inside the migration transaction:
+
+1. n8n_chat_histories gains ``created_at`` as its partition key. Rows that
+   already exist have no timestamp: they get UNDATED (1970-01-01 UTC, a
+   constant default, so no table rewrite) and land in ``<name>_undated``,
+   which ``partitions.py archive`` leaves alone.
+   New rows default to now().
+2. The table is renamed to ``<name>_legacy``. A partitioned table with
+   PRIMARY KEY (id, key) takes its name, with one partition per month that
+   holds rows, the current month and MONTHS_AHEAD months after it, and a
+   DEFAULT partition. The rows are copied over and the legacy heap dropped.
+
+Both tables are locked from step 2 until the copy commits, so run it in a
+maintenance window. The secondary indexes are built afterwards, outside the
+transaction, one partition at a time with CREATE INDEX CONCURRENTLY, and
+attached to the parent index.
+
+Needs a live connection: ``alembic upgrade --sql`` is not supported here.
+"""
+from datetime import date, datetime, timezone
+
+from alembic import op
+
+
+revision = '0004_partition_messages'
+down_revision = '0003_cliente_metricas'
+branch_labels = None
+depends_on = None
+
+
+MONTHS_AHEAD = 3
+UNDATED = '1970-01-01 00:00:00+00'
+UNDATED_BEFORE = date(1970, 1, 2)  # upper bound of <name>_undated
+KEY_COMMENT = 'partition key added by 0004_partition_messages'
+
+# (schema, name, key column or None to discover it, secondary indexes,
+#  indexes the plain table had before this revision, restored on downgrade)
+TABLES = (
+    ('bot', 'whatsapp', None, (('{key}',),), (('ix_whatsapp_ts', ('{key}',)),)),
+    ('public', 'n8n_chat_histories', 'created_at', (('session_id', 'id'), ('id',), ('{key}',)), ()),
+)
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _bound(month: date, tz_aware: bool) -> str:
+    # Literals go through exec_driver_sql(): text() would read ':00' as bind parameters.
+    return f"'{month:%Y-%m-%d} 00:00:00{'+00' if tz_aware else ''}'"
+
+
+def _columns(bind, schema: str, name: str) -> dict:
+    rows = bind.exec_driver_sql(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+        (schema, name),
+    ).all()
+    return {column: data_type for column, data_type in rows}
+
+
+def _partitioned(bind, qualified: str) -> bool:
+    return bind.exec_driver_sql("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (qualified,)).scalar() or False
+
+
+def _partitions(bind, qualified: str) -> list:
+    return [r[0] for r in bind.exec_driver_sql(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+        (qualified,),
+    ).all()]
+
+
+def _convert(bind, schema: str, name: str, key: str | None) -> tuple | None:
+    """Swap ``schema.name`` for a partitioned copy; (key, qualified) or None if there was nothing to do."""
+    qualified = f'{schema}."{name}"'
+    columns = _columns(bind, schema, name)
+    if not columns or _partitioned(bind, qualified):
+        return None
+    if key is None:
+        key = next((c for c in ('timestamp', 'fecha_hora') if c in columns), None)
+        if key is None:
+            raise RuntimeError(f"{qualified}: no timestamp column to partition on")
+    if key not in columns:
+        bind.exec_driver_sql(f'ALTER TABLE {qualified} ADD COLUMN "{key}" timestamptz NOT NULL DEFAULT \'{UNDATED}\'')
+        bind.exec_driver_sql(f'ALTER TABLE {qualified} ALTER COLUMN "{key}" SET DEFAULT now()')
+        bind.exec_driver_sql(f"COMMENT ON COLUMN {qualified}.\"{key}\" IS '{KEY_COMMENT}'")
+        columns[key] = 'timestamp with time zone'
+    tz_aware = columns[key] == 'timestamp with time zone'
+    if bind.exec_driver_sql(f'SELECT EXISTS (SELECT 1 FROM {qualified} WHERE "{key}" IS NULL)').scalar():
+        raise RuntimeError(f"{qualified}: rows with NULL {key} cannot be range-partitioned")
+
+    legacy = f'{schema}."{name}_legacy"'
+    serial_seq = bind.exec_driver_sql("SELECT pg_get_serial_sequence(%s, 'id')", (qualified,)).scalar() if 'id' in columns else None
+    undated_before = _bound(UNDATED_BEFORE, tz_aware)
+    months = [m for (m,) in bind.exec_driver_sql(
+        f"""SELECT DISTINCT date_trunc('month', "{key}"{" AT TIME ZONE 'UTC'" if tz_aware else ''})::date FROM {qualified} WHERE "{key}" >= {undated_before}"""
+    ).all()]
+    undated = bind.exec_driver_sql(f'SELECT EXISTS (SELECT 1 FROM {qualified} WHERE "{key}" < {undated_before})').scalar()
+
+    bind.exec_driver_sql(f'ALTER TABLE {qualified} RENAME TO "{name}_legacy"')
+    # The legacy heap still owns "<name>_pkey" until it is dropped.
+    primary_key = f', CONSTRAINT "{name}_part_pkey" PRIMARY KEY (id, "{key}")' if 'id' in columns else ''
+    bind.exec_driver_sql(f"""
+        CREATE TABLE {qualified} (LIKE {legacy}
+            INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS
+            {primary_key})
+        PARTITION BY RANGE ("{key}")
+    """)
+    if serial_seq:
+        bind.exec_driver_sql(f"ALTER SEQUENCE {serial_seq} OWNED BY {qualified}.id")
+    elif 'id' in columns and bind.exec_driver_sql(
+        "SELECT attidentity <> '' FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'id'", (qualified,)
+    ).scalar():
+        # LIKE creates a fresh identity sequence; continue after the legacy ids.
+        next_id = bind.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {legacy}").scalar()
+        bind.exec_driver_sql(f"ALTER TABLE {qualified} ALTER COLUMN id RESTART WITH {int(next_id)}")
+
+    if undated:
+        bind.exec_driver_sql(f'CREATE TABLE {schema}."{name}_undated" PARTITION OF {qualified} FOR VALUES FROM (MINVALUE) TO ({undated_before})')
+    current = datetime.now(timezone.utc).date().replace(day=1)
+    wanted = set(months) | {_add_months(current, n) for n in range(MONTHS_AHEAD + 1)}
+    for month in sorted(wanted):
+        bind.exec_driver_sql(f"""
+            CREATE TABLE {schema}."{name}_p{month:%Y%m}" PARTITION OF {qualified}
+            FOR VALUES FROM ({_bound(month, tz_aware)}) TO ({_bound(_add_months(month, 1), tz_aware)})
+        """)
+    bind.exec_driver_sql(f'CREATE TABLE {schema}."{name}_default" PARTITION OF {qualified} DEFAULT')
+
+    bind.exec_driver_sql(f"INSERT INTO {qualified} SELECT * FROM {legacy}")
+    bind.exec_driver_sql(f"DROP TABLE {legacy}")
+    bind.exec_driver_sql(f"ANALYZE {qualified}")
+    return key, qualified
+
+
+def _build_indexes(bind, schema: str, name: str, key: str, indexes: tuple):
+    """CREATE INDEX CONCURRENTLY on every partition, then attach them under one parent index."""
+    qualified = f'{schema}."{name}"'
+    for spec in indexes:
+        columns = [c.format(key=key) for c in spec]
+        suffix = '_'.join(columns)
+        column_list = ', '.join(f'"{c}"' for c in columns)
+        parent_index = f"ix_{name}_part_{suffix}"
+        bind.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{parent_index}" ON ONLY {qualified} ({column_list})')
+        for partition in _partitions(bind, qualified):
+            child_index = f"ix_{partition}_{suffix}"[:63]
+            bind.exec_driver_sql(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child_index}" ON {schema}."{partition}" ({column_list})')
+            attached = bind.exec_driver_sql(
+                "SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s) AND inhparent = to_regclass(%s))",
+                (f'{schema}."{child_index}"', f'{schema}."{parent_index}"'),
+            ).scalar()
+            if not attached:
+                bind.exec_driver_sql(f'ALTER INDEX {schema}."{parent_index}" ATTACH PARTITION {schema}."{child_index}"')
+
+
+def upgrade():
+    bind = op.get_bind()
+    converted = []
+    for schema, name, key, indexes, _ in TABLES:
+        done = _convert(bind, schema, name, key)
+        if done:
+            print(f"0004_partition_messages: partitioned {done[1]}")
+            converted.append((schema, name, done[0], indexes))
+    if not converted:
+        return
+    with op.get_context().autocommit_block():
+        for schema, name, key, indexes in converted:
+            _build_indexes(bind, schema, name, key, indexes)
+
+
+def downgrade():
+    """Copy every attached partition back into one plain table per name.
+
+    Partitions moved to the archive schema by ``partitions.py archive`` are
+    not attached any more and are not copied back. ``created_at`` is dropped
+    only if this revision added it. Locks both tables for the copy.
+    """
+    bind = op.get_bind()
+    for schema, name, key, _, plain_indexes in TABLES:
+        qualified = f'{schema}."{name}"'
+        if not _partitioned(bind, qualified):
+            continue
+        key = bind.exec_driver_sql(
+            "SELECT a.attname FROM pg_partitioned_table p JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0] "
+            "WHERE p.partrelid = to_regclass(%s)", (qualified,),
+        ).scalar()
+        columns = _columns(bind, schema, name)
+        plain = f'{schema}."{name}_plain"'
+        bind.exec_driver_sql(f"""
+            CREATE TABLE {plain} (LIKE {qualified}
+                INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS)
+        """)
+        bind.exec_driver_sql(f"INSERT INTO {plain} SELECT * FROM {qualified}")
+        serial_seq = bind.exec_driver_sql("SELECT pg_get_serial_sequence(%s, 'id')", (qualified,)).scalar() if 'id' in columns else None
+        if serial_seq:
+            bind.exec_driver_sql(f"ALTER SEQUENCE {serial_seq} OWNED BY {plain}.id")
+        elif 'id' in columns and bind.exec_driver_sql(
+            "SELECT attidentity <> '' FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'id'", (plain,)
+        ).scalar():
+            next_id = bind.exec_driver_sql(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {plain}").scalar()
+            bind.exec_driver_sql(f"ALTER TABLE {plain} ALTER COLUMN id RESTART WITH {int(next_id)}")
+        bind.exec_driver_sql(f"DROP TABLE {qualified}")
+        bind.exec_driver_sql(f'ALTER TABLE {plain} RENAME TO "{name}"')
+        comment = bind.exec_driver_sql(
+            "SELECT col_description(to_regclass(%s), attnum) FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s",
+            (qualified, qualified, key),
+        ).scalar()
+        if comment == KEY_COMMENT:
+            bind.exec_driver_sql(f'ALTER TABLE {qualified} DROP COLUMN "{key}"')
+        if 'id' in columns:
+            bind.exec_driver_sql(f'ALTER TABLE {qualified} ADD CONSTRAINT "{name}_pkey" PRIMARY KEY (id)')
+        for index_name, spec in plain_indexes:
+            column_list = ', '.join(f'"{c.format(key=key)}"' for c in spec)
+            bind.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON {qualified} ({column_list})')
@@ -0,0 +1,40 @@
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+revision = '0005_jobs'
+down_revision = '0004_partition_messages'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # No inspection in offline (--sql) mode; the generated script creates the table.
+    if not context.is_offline_mode() and sa.inspect(op.get_bind()).has_table('jobs'):
+        return
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(), nullable=False, unique=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('params', JSONB(), nullable=False, server_default='{}'),
+        sa.Column('status', sa.String(), nullable=False, server_default='pending'),
+        sa.Column('run_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column('interval_seconds', sa.Integer(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='5'),
+        sa.Column('locked_by', sa.String(), nullable=True),
+        sa.Column('locked_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('result', JSONB(), nullable=True),
+        sa.Column('result_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    # Workers poll for due pending jobs.
+    op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_table('jobs')
@@ -0,0 +1,196 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from database import get_settings, whatsapp_ts_column
+
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 5000
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def truncate(dt: datetime, granularity: str) -> datetime:
+    """Python twin of date_trunc() for naive local timestamps."""
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_bucket(dt: datetime, granularity: str) -> datetime:
+    if granularity == 'hour':
+        return dt + timedelta(hours=1)
+    if granularity == 'day':
+        return dt + timedelta(days=1)
+    if granularity == 'week':
+        return dt + timedelta(weeks=1)
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def bucket_starts(start: datetime, end: datetime, granularity: str) -> list:
+    """Bucket starts covering [start, end): start is rounded down, end up."""
+    buckets = []
+    b = truncate(start, granularity)
+    while b < end:
+        buckets.append(b)
+        if len(buckets) > MAX_BUCKETS:
+            raise AnalyticsError(f"El rango solicitado excede {MAX_BUCKETS} intervalos")
+        b = next_bucket(b, granularity)
+    return buckets
+
+
+class ClosedBucketCache:
+    """Counts of settled buckets; they never change, so no TTL.
+
+    A bucket is settled once it ended more than the replica lag bound plus a
+    grace period ago (see conversation_buckets). Bounded LRU over buckets.
+    """
+
+    def __init__(self, max_entries: int = 200_000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, prefix: tuple, buckets: list) -> dict:
+        found = {}
+        with self._lock:
+            for b in buckets:
+                key = prefix + (b,)
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[b] = self._data[key]
+        return found
+
+    def put_many(self, prefix: tuple, counts: dict):
+        with self._lock:
+            for b, count in counts.items():
+                self._data[prefix + (b,)] = count
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+closed_buckets = ClosedBucketCache()
+
+_ts_is_naive = None
+
+
+def _whatsapp_ts_is_naive(cur, ts_col: str) -> bool:
+    global _ts_is_naive
+    if _ts_is_naive is None:
+        cur.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_schema = 'bot' AND table_name = 'whatsapp' AND column_name = %s",
+            (ts_col,),
+        )
+        row = cur.fetchone()
+        data_type = (row[0] if row else '') or ''
+        _ts_is_naive = data_type == 'timestamp without time zone'
+    return _ts_is_naive
+
+
+def _to_column_domain(local: datetime, tz: ZoneInfo, naive: bool, column_tz: ZoneInfo) -> datetime:
+    aware = local.replace(tzinfo=tz)
+    if naive:
+        # timestamp without time zone values are wall-clock times in column_tz.
+        return aware.astimezone(column_tz).replace(tzinfo=None)
+    return aware
+
+
+def _query_buckets(cur, ts_col: str, naive: bool, tz_name: str, tz: ZoneInfo, granularity: str, first: datetime, end: datetime, column_tz: ZoneInfo) -> dict:
+    """One range scan over bot.whatsapp; generate_series fills empty buckets with 0."""
+    local_expr = f"(({ts_col} AT TIME ZONE %(column_tz)s) AT TIME ZONE %(tz)s)" if naive else f"({ts_col} AT TIME ZONE %(tz)s)"
+    cur.execute(f"""
+        SELECT b.bucket, COALESCE(c.count, 0) AS count
+        FROM generate_series(%(first)s::timestamp, %(last)s::timestamp, %(step)s::interval) AS b(bucket)
+        LEFT JOIN (
+            SELECT date_trunc(%(granularity)s, {local_expr}) AS bucket, COUNT(*) AS count
+            FROM bot.whatsapp
+            WHERE {ts_col} >= %(lo)s AND {ts_col} < %(hi)s
+            GROUP BY 1
+        ) c ON c.bucket = b.bucket
+        ORDER BY b.bucket
+    """, {
+        'tz': tz_name,
+        'column_tz': column_tz.key,
+        'granularity': granularity,
+        'first': first,
+        'last': end - timedelta(microseconds=1),
+        'step': f'1 {granularity}',
+        'lo': _to_column_domain(first, tz, naive, column_tz),
+        'hi': _to_column_domain(end, tz, naive, column_tz),
+    })
+    return {r[0]: int(r[1]) for r in cur.fetchall()}
+
+
+def conversation_buckets(cur, start: datetime, end: datetime, granularity: str = 'day', tz_name: str = 'UTC', now: datetime | None = None,
+                         settle_seconds: float | None = None, column_tz_name: str | None = None) -> dict:
+    """Message counts per bucket of bot.whatsapp between ``start`` and ``end``.
+
+    Buckets are aligned in ``tz_name`` local time. Only buckets that are not in
+    the closed-bucket cache, plus the open bucket and later ones, are queried.
+    ``cur`` may be on a lagging replica, so a bucket is cached only once it
+    ended ``settle_seconds`` ago (default: DB_REPLICA_MAX_LAG_SECONDS +
+    ANALYTICS_SETTLE_GRACE_SECONDS). A naive timestamp column is read as
+    wall-clock time in ``column_tz_name`` (default WHATSAPP_TIMESTAMP_TZ, UTC).
+    """
+    if granularity not in GRANULARITIES:
+        raise AnalyticsError(f"granularity debe ser uno de: {', '.join(GRANULARITIES)}")
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise AnalyticsError(f"Zona horaria desconocida: {tz_name}")
+    if settle_seconds is None or column_tz_name is None:
+        settings = get_settings()
+        if settle_seconds is None:
+            settle_seconds = settings.DB_REPLICA_MAX_LAG_SECONDS + settings.ANALYTICS_SETTLE_GRACE_SECONDS
+        if column_tz_name is None:
+            column_tz_name = settings.WHATSAPP_TIMESTAMP_TZ
+    column_tz = ZoneInfo(column_tz_name)
+
+    def local(dt):
+        if dt.tzinfo is None:
+            return dt
+        return dt.astimezone(tz).replace(tzinfo=None)
+
+    local_start, local_end = local(start), local(end)
+    if local_end <= local_start:
+        raise AnalyticsError("'to' debe ser posterior a 'from'")
+    buckets = bucket_starts(local_start, local_end, granularity)
+    range_end = next_bucket(buckets[-1], granularity)
+
+    now = now or datetime.now(timezone.utc)
+    open_start = truncate(local(now), granularity)
+    settled_before = local(now - timedelta(seconds=settle_seconds))
+    settled = [b for b in buckets if next_bucket(b, granularity) <= settled_before]
+
+    ts_col = whatsapp_ts_column(cur)
+    prefix = (ts_col, column_tz_name, tz_name, granularity)
+    counts = closed_buckets.get_many(prefix, settled)
+
+    missing = [b for b in buckets if b not in counts]
+    query_from = missing[0] if missing else range_end
+    if query_from < range_end:
+        naive = _whatsapp_ts_is_naive(cur, ts_col)
+        fresh = _query_buckets(cur, ts_col, naive, tz_name, tz, granularity, query_from, range_end, column_tz)
+        closed_buckets.put_many(prefix, {b: c for b, c in fresh.items() if next_bucket(b, granularity) <= settled_before})
+        counts.update(fresh)
+
+    series = [{'bucket': b.isoformat(), 'count': counts.get(b, 0), 'closed': b < open_start} for b in buckets]
+    return {
+        'from': buckets[0].isoformat(),
+        'to': range_end.isoformat(),
+        'granularity': granularity,
+        'tz': tz_name,
+        'total': sum(s['count'] for s in series),
+        'buckets': series,
+    }
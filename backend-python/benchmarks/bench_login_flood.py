@@ -0,0 +1,83 @@
+"""Dashboard latency during a simulated credential-stuffing flood on /api/auth/login.
+
+Run against a live server (uvicorn main:app). DASHBOARD_TOKEN must be a valid
+access token for a user allowed to see the dashboard.
+
+    DASHBOARD_TOKEN=... python benchmarks/bench_login_flood.py --base-url http://127.0.0.1:8000
+
+Measures /api/dashboard/charts latency at rest, then again while
+--flood-threads threads hammer the login endpoint with random correos, and
+reports how many login attempts were shed with 429.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import string
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def _request(url, data=None, headers=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json", **(headers or {})})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_dashboard(base_url, token, samples):
+    latencies = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        _request(f"{base_url}/api/dashboard/charts?period=day&days=30", headers={"Authorization": f"Bearer {token}"})
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def flood(base_url, stop, counters, lock):
+    while not stop.is_set():
+        correo = ''.join(random.choices(string.ascii_lowercase, k=10)) + "@correo.com"
+        status = _request(f"{base_url}/api/auth/login", data={"correo": correo, "contrasena": "x"})
+        with lock:
+            counters[status] = counters.get(status, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--samples', type=int, default=50)
+    parser.add_argument('--flood-threads', type=int, default=32)
+    args = parser.parse_args()
+    token = os.environ["DASHBOARD_TOKEN"]
+
+    p50, p95 = measure_dashboard(args.base_url, token, args.samples)
+    print(f"dashboard at rest:      p50 {p50:7.1f} ms | p95 {p95:7.1f} ms")
+
+    stop = threading.Event()
+    counters, lock = {}, threading.Lock()
+    threads = [threading.Thread(target=flood, args=(args.base_url, stop, counters, lock), daemon=True) for _ in range(args.flood_threads)]
+    for t in threads:
+        t.start()
+    time.sleep(2)
+    t0 = time.perf_counter()
+    p50, p95 = measure_dashboard(args.base_url, token, args.samples)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for t in threads:
+        t.join()
+
+    total = sum(counters.values())
+    print(f"dashboard during flood: p50 {p50:7.1f} ms | p95 {p95:7.1f} ms")
+    print(f"login attempts: {total} ({total / max(elapsed, 1e-9):.0f}/s) by status: {dict(sorted(counters.items()))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Bytes on the wire for n8n chat history: full message JSON vs. projected fields.
+
+Synthetic mode builds LangChain-style n8n messages (tool calls, metadata) and
+compares the JSON body of /api/chats and /api/n8n_chats with and without
+``fields=type,content`` / ``preview_chars``. With --database-url it measures
+what Postgres actually sends for a real session instead.
+
+    python benchmarks/bench_message_payload.py [--messages 1000] [--preview-chars 120]
+    python benchmarks/bench_message_payload.py --database-url postgresql://... --session-id 5491100123456
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORDS = "hola gracias precio cotizacion envio pedido factura cliente ayuda horario disponible producto".split()
+
+
+def _text(n):
+    return ' '.join(random.choice(WORDS) for _ in range(n))
+
+
+def n8n_message(i):
+    if i % 2 == 0:
+        return {"type": "human", "content": _text(random.randint(5, 40)), "additional_kwargs": {}, "response_metadata": {}}
+    return {
+        "type": "ai",
+        "content": _text(random.randint(40, 250)),
+        "tool_calls": [{"name": "buscar_producto", "args": {"query": _text(3)}, "id": f"call_{i:08d}", "type": "tool_call"}] if i % 3 == 0 else [],
+        "invalid_tool_calls": [],
+        "additional_kwargs": {"refusal": None},
+        "response_metadata": {"model_name": "gpt-4o-mini", "finish_reason": "stop", "token_usage": {"prompt_tokens": random.randint(500, 4000), "completion_tokens": random.randint(20, 300)}},
+        "usage_metadata": {"input_tokens": random.randint(500, 4000), "output_tokens": random.randint(20, 300)},
+    }
+
+
+def project(message, fields=("type", "content"), preview_chars=None):
+    out = {f: message.get(f) for f in fields}
+    if preview_chars is not None and isinstance(out.get("content"), str):
+        out["content_truncated"] = len(out["content"]) > preview_chars
+        out["content"] = out["content"][:preview_chars]
+    return out
+
+
+def size(payload) -> int:
+    return len(json.dumps(payload, ensure_ascii=False).encode())
+
+
+def synthetic(messages, preview_chars):
+    history = [{"id": i, "session_id": "5491100123456", "message": n8n_message(i)} for i in range(messages)]
+    sessions = [{"session_id": f"54911{i:08d}", "last_id": i, "count": 20, "last_message": n8n_message(2 * i + 1)} for i in range(messages)]
+    rows = [
+        ("/api/chats (full)", size(history)),
+        ("/api/chats?fields=type,content", size([{**r, "message": project(r["message"])} for r in history])),
+        ("/api/n8n_chats (full)", size(sessions)),
+        (f"/api/n8n_chats?fields=type,content&preview_chars={preview_chars}", size([{**s, "last_message": project(s["last_message"], preview_chars=preview_chars)} for s in sessions])),
+    ]
+    for label, n in rows:
+        print(f"{label:60s} {n / 1024:10.1f} KiB")
+
+
+def live(database_url, session_id, preview_chars):
+    import psycopg2
+    from database import message_projection
+    conn = psycopg2.connect(database_url)
+    cur = conn.cursor()
+    for label, fields, preview in (("full", None, None), ("fields=type,content", ("type", "content"), None), (f"preview_chars={preview_chars}", ("type", "content"), preview_chars)):
+        select_list, _ = message_projection("message", fields, preview)
+        cur.execute(f"SELECT sum(octet_length(row_to_json(p)::text)) FROM (SELECT id, session_id, {select_list} FROM public.n8n_chat_histories WHERE session_id = %s) p", (session_id,))
+        print(f"{label:60s} {(cur.fetchone()[0] or 0) / 1024:10.1f} KiB")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--preview-chars', type=int, default=120)
+    parser.add_argument('--database-url')
+    parser.add_argument('--session-id')
+    args = parser.parse_args()
+    random.seed(7)
+    if args.database_url:
+        live(args.database_url, args.session_id, args.preview_chars)
+    else:
+        synthetic(args.messages, args.preview_chars)
+
+
+if __name__ == '__main__':
+    main()
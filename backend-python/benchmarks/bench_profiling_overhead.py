@@ -0,0 +1,69 @@
+"""Per-request cost of ProfilingMiddleware and traced cursors when no capture is taken.
+
+Drives a trivial ASGI app that runs a few (no-op) statements per request, with
+and without the middleware, and reports the added microseconds per request.
+
+    python benchmarks/bench_profiling_overhead.py [--requests 20000] [--statements 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from profiling import ProfileStore, ProfilingMiddleware, trace_connection
+
+
+class NullCursor:
+    def execute(self, sql, params=None):
+        pass
+
+
+class NullConnection:
+    def cursor(self, *args, **kwargs):
+        return NullCursor()
+
+
+def make_app(statements):
+    async def app(scope, receive, send):
+        cur = trace_connection(NullConnection()).cursor()
+        for _ in range(statements):
+            cur.execute("SELECT 1")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+    return app
+
+
+async def drive(app, requests):
+    scope = {"type": "http", "method": "GET", "path": "/api/n8n_chats", "query_string": b"", "headers": []}
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--statements', type=int, default=5)
+    args = parser.parse_args()
+
+    app = make_app(args.statements)
+    baseline = asyncio.run(drive(app, args.requests))
+    profiled = asyncio.run(drive(ProfilingMiddleware(app, ProfileStore(slow_ms=60_000)), args.requests))
+    per_request = (profiled - baseline) / args.requests * 1e6
+    print(f"baseline   {baseline / args.requests * 1e6:8.2f} us/request")
+    print(f"middleware {profiled / args.requests * 1e6:8.2f} us/request  (+{per_request:.2f} us, {args.statements} statements)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Serialization time and bytes-on-the-wire for the large JSON endpoints.
+
+Compares FastAPI's default path (jsonable_encoder + stdlib json) with the
+orjson-based FastJSONResponse, and the size of the body raw / gzip / brotli.
+
+    python benchmarks/bench_serialization.py [--rows 1000] [--repeat 20]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi.encoders import jsonable_encoder
+
+from responses import dumps
+from compression import BROTLI_AVAILABLE
+
+if BROTLI_AVAILABLE:
+    import brotli
+
+WORDS = "hola gracias precio cotizacion envio pedido factura cliente ayuda horario disponible producto".split()
+
+
+def _text(n):
+    return ' '.join(random.choice(WORDS) for _ in range(n))
+
+
+def whatsapp_rows(n):
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    return [
+        {
+            "id": i,
+            "telefono": f"+5491100{i:06d}",
+            "nombre": f"Cliente {i % 250}",
+            "message": _text(random.randint(5, 40)),
+            "timestamp": base + timedelta(minutes=i * 7),
+            "monto": Decimal(f"{random.randint(0, 99999)}.{random.randint(0, 99):02d}"),
+            "estado": random.choice(["Nuevo", "En gestión", "Cliente"]),
+        }
+        for i in range(n)
+    ]
+
+
+def n8n_history_rows(n):
+    rows = []
+    for i in range(n):
+        kind = "human" if i % 2 == 0 else "ai"
+        rows.append({
+            "id": i,
+            "session_id": "5491100123456",
+            "message": {
+                "type": kind,
+                "content": _text(random.randint(10, 80)),
+                "additional_kwargs": {},
+                "response_metadata": {},
+                "tool_calls": [] if kind == "human" else [{"name": "buscar_producto", "args": {"q": _text(3)}, "id": f"call_{i}"}],
+                "invalid_tool_calls": [],
+            },
+        })
+    return rows
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+
+def bench(name, payload, repeat):
+    stdlib = lambda: json.dumps(jsonable_encoder(payload), ensure_ascii=False).encode('utf-8')
+    fast = lambda: dumps(payload)
+    t_std = _time(stdlib, repeat)
+    t_fast = _time(fast, repeat)
+    body = fast()
+    sizes = {"raw": len(body), "gzip": len(gzip.compress(body, 6))}
+    if BROTLI_AVAILABLE:
+        sizes["br"] = len(brotli.compress(body, quality=4))
+    print(f"{name}: jsonable_encoder+json {t_std:8.2f} ms | orjson {t_fast:8.2f} ms | x{t_std / max(t_fast, 1e-9):.1f}")
+    print(f"{'':{len(name)}}  bytes " + ' | '.join(f"{k} {v:,}" for k, v in sizes.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    random.seed(1)
+    bench('/api/whatsapp', whatsapp_rows(args.rows), args.repeat)
+    bench('/api/chats/{session_id}', n8n_history_rows(args.rows), args.repeat)
+    sessions = [{"session_id": f"54911{i:08d}", "last_id": i, "last_message": r["message"], "count": random.randint(1, 400)} for i, r in enumerate(n8n_history_rows(args.rows))]
+    bench('/api/n8n_chats', sessions, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+
+import psycopg2
+import psycopg2.errors
+from starlette.concurrency import run_in_threadpool
+
+
+# Wall-clock DB time per endpoint, overridable with DB_BUDGET_<NAME>_MS.
+DEFAULT_BUDGETS_MS = {
+    "dashboard_charts": 5000,
+    "chat_history": 3000,
+    "n8n_chats": 3000,
+    "analytics": 5000,
+    "dashboard_job": 60000,
+}
+
+DISCONNECT_POLL_SECONDS = 0.25
+
+
+def budget_ms(name: str) -> int:
+    value = os.getenv(f"DB_BUDGET_{name.upper()}_MS")
+    return int(value) if value else DEFAULT_BUDGETS_MS.get(name, 5000)
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class DBBudget:
+    """Time budget for the queries of one request.
+
+    Every statement runs with ``SET LOCAL statement_timeout`` equal to what is
+    left of the budget, so the connection and threadpool slot are released on
+    time. ``cancel()`` may be called from another thread (client disconnect).
+    """
+
+    def __init__(self, name: str, ms: int | None = None):
+        self.name = name
+        self.ms = budget_ms(name) if ms is None else ms
+        self.deadline = time.monotonic() + self.ms / 1000.0
+        self.degraded_sections = []
+        self.cancelled = False
+        self.conn = None
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.degraded_sections)
+
+    def remaining_ms(self) -> int:
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+    def attach(self, conn):
+        """Bind the (non-autocommit) connection whose queries this budget governs."""
+        self.conn = conn
+
+    def apply(self, cur):
+        remaining = self.remaining_ms()
+        if remaining <= 0 or self.cancelled:
+            raise BudgetExceeded(self.name)
+        cur.execute("SET LOCAL statement_timeout = %s", (remaining,))
+
+    def cancel(self):
+        self.cancelled = True
+        conn = self.conn
+        if conn is not None:
+            try:
+                conn.cancel()
+            except Exception as e:
+                print(f"DBBudget[{self.name}]: cancel failed: {e}")
+
+    def section(self, cur, name: str, fn, default=None):
+        """Run ``fn(cur)`` in a savepoint; on timeout or error return ``default``.
+
+        A timed-out, cancelled or failed section is recorded in
+        ``degraded_sections`` and later sections keep running on the same
+        transaction.
+        """
+        try:
+            self.apply(cur)
+        except BudgetExceeded:
+            self.degraded_sections.append(name)
+            return default
+        cur.execute("SAVEPOINT budget_section")
+        try:
+            result = fn(cur)
+        except psycopg2.errors.QueryCanceled:
+            cur.execute("ROLLBACK TO SAVEPOINT budget_section")
+            self.degraded_sections.append(name)
+            return default
+        except psycopg2.OperationalError:
+            raise
+        except Exception as e:
+            print(f"DBBudget[{self.name}]: section {name} failed: {e}")
+            cur.execute("ROLLBACK TO SAVEPOINT budget_section")
+            self.degraded_sections.append(name)
+            return default
+        cur.execute("RELEASE SAVEPOINT budget_section")
+        return result
+
+
+async def run_cancellable(request, budget: DBBudget, fn, *args):
+    """Run blocking ``fn(*args)`` in the threadpool; cancel its query if the client goes away."""
+    task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if task in done:
+            return task.result()
+        if await request.is_disconnected():
+            print(f"run_cancellable: client disconnected, cancelling {budget.name}")
+            budget.cancel()
+            return await task
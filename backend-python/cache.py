@@ -0,0 +1,312 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional, only needed for CACHE_BACKEND=redis
+    redis = None
+
+
+class MemoryCacheBackend:
+    """Byte values with TTL for a single worker process, LRU-evicted past ``max_entries``."""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _store(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if absent (or expired); True if this call stored the value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+
+def default_sqlite_path() -> str:
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'dashboard_cache.sqlite3')
+
+
+class SQLiteCacheBackend:
+    """Cache shared by every uvicorn worker on the host.
+
+    Same interface as MemoryCacheBackend, stored in a WAL-mode SQLite file (on
+    tmpfs by default). Expired rows are purged and the soonest-expiring rows
+    evicted down to ``max_entries`` every ``purge_every`` writes.
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = 10_000, purge_every: int = 100):
+        self.path = path or default_sqlite_path()
+        self.max_entries = max_entries
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_entries_expires_at ON entries (expires_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+            self._local.conn = conn
+        return conn
+
+    def _maybe_purge(self, conn, now: float):
+        self._writes += 1
+        if self._writes % self.purge_every:
+            return
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at LIMIT ?)", (excess,))
+
+    def get(self, key: str) -> bytes | None:
+        row = self._conn().execute("SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: float):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl))
+        self._maybe_purge(conn, now)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+            added = conn.execute("INSERT OR IGNORE INTO entries (key, value, expires_at) VALUES (?, ?, ?)", (key, value, now + ttl)).rowcount == 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO counters (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1", (key,))
+            value = conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def counter(self, key: str) -> int:
+        row = self._conn().execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+        return 0 if row is None else row[0]
+
+
+class RedisCacheBackend:
+    """Cache shared across hosts through any Redis-protocol server.
+
+    Every entry carries a TTL; size bounds are the server's ``maxmemory`` with
+    an LRU ``maxmemory-policy`` (e.g. ``allkeys-lru``).
+    """
+
+    def __init__(self, url: str, prefix: str = 'dashboard:'):
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(self.prefix + key)
+
+    def counter(self, key: str) -> int:
+        value = self.client.get(self.prefix + key)
+        return int(value) if value else 0
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    """Namespaced JSON cache over one of the backends above.
+
+    Keys live under a per-namespace generation counter, so ``invalidate(ns)``
+    is one increment and stale entries simply age out. ``get_or_set`` is
+    single-flight: one thread per process, and one process per backend (via a
+    short ``add`` lock), runs the loader while the others wait for its result.
+    """
+
+    def __init__(self, backend, lock_timeout: float = 10.0, poll_interval: float = 0.05):
+        self.backend = backend
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{namespace}:{self.backend.counter(f'ns:{namespace}')}:{key}"
+
+    def get(self, namespace: str, key: str):
+        raw = self.backend.get(self._key(namespace, key))
+        return None if raw is None else json.loads(raw)
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        self.backend.set(self._key(namespace, key), json.dumps(value, default=str).encode(), ttl)
+
+    def delete(self, namespace: str, key: str):
+        self.backend.delete(self._key(namespace, key))
+
+    def invalidate(self, namespace: str):
+        self.backend.incr(f'ns:{namespace}')
+
+    def get_or_set(self, namespace: str, key: str, loader, ttl: float, cacheable=None):
+        """Cached value, or ``loader()`` stored for ``ttl`` seconds when ``cacheable(value)`` allows it.
+
+        ``None`` results are never stored.
+        """
+        full_key = self._key(namespace, key)
+        raw = self.backend.get(full_key)
+        if raw is not None:
+            return json.loads(raw)
+
+        with self._flights_lock:
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._load_shared(full_key, loader, ttl, cacheable)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(full_key, None)
+            flight.done.set()
+
+    def _load_shared(self, full_key: str, loader, ttl: float, cacheable):
+        lock_key = f"lock:{full_key}"
+        token = uuid.uuid4().bytes
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.backend.add(lock_key, token, self.lock_timeout):
+            # Another process is loading; take its result or, past the deadline, load anyway.
+            if time.monotonic() >= deadline:
+                return self._load(full_key, loader, ttl, cacheable)
+            time.sleep(self.poll_interval)
+            raw = self.backend.get(full_key)
+            if raw is not None:
+                return json.loads(raw)
+        try:
+            raw = self.backend.get(full_key)
+            if raw is not None:
+                return json.loads(raw)
+            return self._load(full_key, loader, ttl, cacheable)
+        finally:
+            if self.backend.get(lock_key) == token:
+                self.backend.delete(lock_key)
+
+    def _load(self, full_key: str, loader, ttl: float, cacheable):
+        value = loader()
+        if value is not None and (cacheable is None or cacheable(value)):
+            self.backend.set(full_key, json.dumps(value, default=str).encode(), ttl)
+        return value
+
+
+def cache_from_env() -> Cache:
+    backend_name = (os.getenv("CACHE_BACKEND") or "memory").lower()
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES") or "10000")
+    if backend_name == "sqlite":
+        backend = SQLiteCacheBackend(os.getenv("CACHE_SQLITE_PATH") or None, max_entries=max_entries)
+    elif backend_name == "redis":
+        backend = RedisCacheBackend(os.getenv("CACHE_REDIS_URL") or "redis://localhost:6379/0")
+    else:
+        backend = MemoryCacheBackend(max_entries)
+    return Cache(backend, lock_timeout=float(os.getenv("CACHE_LOCK_TIMEOUT_SECONDS") or "10"))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Cache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = cache_from_env()
+    return _cache
@@ -0,0 +1,159 @@
+"""Per-client conversation metrics computed with set-based SQL.
+
+    python client_metrics.py          # clients with new Mensaje rows since the last run
+    python client_metrics.py --full   # every client
+"""
+import argparse
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import DBSessionLocal
+from models import Cliente, ClienteMetricas, Conversacion, Mensaje
+
+
+METRIC_COLUMNS = (
+    'conversaciones_total',
+    'conversaciones_resueltas',
+    'mensajes_total',
+    'mensajes_cliente',
+    'mensajes_agente',
+    'tiempo_respuesta_promedio',
+    'ultima_actividad',
+    'ultimo_mensaje_id',
+)
+
+
+def aggregate_select(cliente_ids: list | None = None):
+    """One row per client with every metric, from two grouped subqueries (no per-client queries)."""
+    conv = select(
+        Conversacion.cliente_id.label('cliente_id'),
+        func.count().label('conversaciones_total'),
+        func.count().filter(func.lower(Conversacion.estado) == 'resuelto').label('conversaciones_resueltas'),
+    ).group_by(Conversacion.cliente_id)
+
+    window = dict(partition_by=Mensaje.conversacion_id, order_by=(Mensaje.fecha_envio, Mensaje.id))
+    msgs = select(
+        Conversacion.cliente_id.label('cliente_id'),
+        Mensaje.id.label('id'),
+        Mensaje.es_del_cliente.label('es_del_cliente'),
+        Mensaje.fecha_envio.label('fecha_envio'),
+        func.lag(Mensaje.es_del_cliente).over(**window).label('prev_del_cliente'),
+        func.lag(Mensaje.fecha_envio).over(**window).label('prev_fecha'),
+    ).join(Conversacion, Mensaje.conversacion_id == Conversacion.id)
+
+    if cliente_ids is not None:
+        conv = conv.where(Conversacion.cliente_id.in_(cliente_ids))
+        msgs = msgs.where(Conversacion.cliente_id.in_(cliente_ids))
+    conv = conv.subquery()
+    msgs = msgs.subquery()
+
+    # Response time: an agent message directly answering a client message.
+    is_reply = and_(msgs.c.es_del_cliente.is_(False), msgs.c.prev_del_cliente.is_(True))
+    msg_stats = select(
+        msgs.c.cliente_id,
+        func.count().label('mensajes_total'),
+        func.count().filter(msgs.c.es_del_cliente.is_(True)).label('mensajes_cliente'),
+        func.count().filter(msgs.c.es_del_cliente.is_(False)).label('mensajes_agente'),
+        func.avg(case((is_reply, func.extract('epoch', msgs.c.fecha_envio - msgs.c.prev_fecha)))).label('tiempo_respuesta_promedio'),
+        func.max(msgs.c.fecha_envio).label('ultima_actividad'),
+        func.max(msgs.c.id).label('ultimo_mensaje_id'),
+    ).group_by(msgs.c.cliente_id).subquery()
+
+    query = select(
+        Cliente.id.label('cliente_id'),
+        func.coalesce(conv.c.conversaciones_total, 0).label('conversaciones_total'),
+        func.coalesce(conv.c.conversaciones_resueltas, 0).label('conversaciones_resueltas'),
+        func.coalesce(msg_stats.c.mensajes_total, 0).label('mensajes_total'),
+        func.coalesce(msg_stats.c.mensajes_cliente, 0).label('mensajes_cliente'),
+        func.coalesce(msg_stats.c.mensajes_agente, 0).label('mensajes_agente'),
+        msg_stats.c.tiempo_respuesta_promedio,
+        msg_stats.c.ultima_actividad,
+        func.coalesce(msg_stats.c.ultimo_mensaje_id, 0).label('ultimo_mensaje_id'),
+    ).outerjoin(conv, conv.c.cliente_id == Cliente.id).outerjoin(msg_stats, msg_stats.c.cliente_id == Cliente.id)
+    if cliente_ids is not None:
+        query = query.where(Cliente.id.in_(cliente_ids))
+    return query
+
+
+# Message ids are assigned before commit, so a transaction holding a lower id
+# can become visible after a refresh already saw higher ones. Incremental runs
+# re-read this many ids below the watermark (CLIENT_METRICS_WATERMARK_LAG).
+DEFAULT_WATERMARK_LAG_IDS = 1000
+
+
+def changed_cliente_ids(db: Session, lag_ids: int | None = None) -> list:
+    """Clients with Mensaje rows newer than the last processed message id minus ``lag_ids``."""
+    if lag_ids is None:
+        lag_ids = int(os.getenv("CLIENT_METRICS_WATERMARK_LAG") or DEFAULT_WATERMARK_LAG_IDS)
+    watermark = db.scalar(select(func.coalesce(func.max(ClienteMetricas.ultimo_mensaje_id), 0)))
+    return list(db.scalars(
+        select(Conversacion.cliente_id)
+        .join(Mensaje, Mensaje.conversacion_id == Conversacion.id)
+        .where(Mensaje.id > watermark - lag_ids, Conversacion.cliente_id.is_not(None))
+        .distinct()
+    ))
+
+
+def refresh_client_metrics(db: Session, full: bool = False) -> int:
+    """Upsert cliente_metricas and clientes.tasa_conversion; returns the number of clients updated.
+
+    Incremental runs only recompute clients that received messages since the
+    last run (see changed_cliente_ids); conversation state changes without new
+    messages need ``full``.
+    """
+    cliente_ids = None if full else changed_cliente_ids(db)
+    if cliente_ids is not None and not cliente_ids:
+        return 0
+
+    source = aggregate_select(cliente_ids).add_columns(func.now().label('actualizado'))
+    stmt = insert(ClienteMetricas).from_select(['cliente_id', *METRIC_COLUMNS, 'actualizado'], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ClienteMetricas.cliente_id],
+        set_={c: stmt.excluded[c] for c in (*METRIC_COLUMNS, 'actualizado')},
+    )
+    result = db.execute(stmt)
+
+    rate = ClienteMetricas.conversaciones_resueltas * 1.0 / func.nullif(ClienteMetricas.conversaciones_total, 0)
+    sync = update(Cliente).where(Cliente.id == ClienteMetricas.cliente_id).values(tasa_conversion=func.coalesce(rate, 0.0))
+    if cliente_ids is not None:
+        sync = sync.where(Cliente.id.in_(cliente_ids))
+    db.execute(sync)
+    db.commit()
+    return result.rowcount
+
+
+def client_metrics(db: Session, cliente_id: int) -> dict | None:
+    """Stored metrics for one client, computed on the fly if it was never refreshed."""
+    row = db.get(ClienteMetricas, cliente_id)
+    if row is not None:
+        data = {c: getattr(row, c) for c in ('cliente_id', *METRIC_COLUMNS, 'actualizado')}
+    else:
+        computed = db.execute(aggregate_select([cliente_id])).mappings().first()
+        if computed is None:
+            return None
+        data = dict(computed)
+        data['actualizado'] = None
+    total = data['conversaciones_total'] or 0
+    data['tasa_conversion'] = (data['conversaciones_resueltas'] or 0) / total if total else 0.0
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--full', action='store_true', help='recompute every client')
+    args = parser.parse_args()
+    db = DBSessionLocal()
+    try:
+        t0 = datetime.utcnow()
+        count = refresh_client_metrics(db, full=args.full)
+        print(f"client_metrics: updated {count} clients in {(datetime.utcnow() - t0).total_seconds():.2f}s")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
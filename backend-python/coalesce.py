@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+from budgets import DBBudget, DISCONNECT_POLL_SECONDS
+
+
+class _Flight:
+    def __init__(self, task, budget: DBBudget):
+        self.task = task
+        self.budget = budget
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """Share one in-flight load among concurrent identical requests.
+
+    The first request for a key runs ``fn(budget, *args)`` in the threadpool;
+    requests arriving before it finishes await the same result (typically the
+    serialized body) instead of opening their own connection. The entry is
+    dropped as soon as the load finishes, so nothing outlives the flight. The
+    shared query is cancelled only once every waiting client has disconnected.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._counts = {"leaders": 0, "coalesced": 0, "cancelled": 0}
+        self._by_name = {}
+        self._counts_lock = threading.Lock()
+
+    def _count(self, name: str, counter: str):
+        with self._counts_lock:
+            self._counts[counter] += 1
+            per_name = self._by_name.setdefault(name, {"leaders": 0, "coalesced": 0, "cancelled": 0})
+            per_name[counter] += 1
+
+    def stats(self) -> dict:
+        with self._counts_lock:
+            return {**self._counts, "in_flight": len(self._flights), "by_endpoint": {k: dict(v) for k, v in self._by_name.items()}}
+
+    def _start(self, key, budget_name: str, fn, args) -> _Flight:
+        budget = DBBudget(budget_name)
+        flight = _Flight(asyncio.ensure_future(run_in_threadpool(fn, budget, *args)), budget)
+        self._flights[key] = flight
+
+        def finished(_task):
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        flight.task.add_done_callback(finished)
+        return flight
+
+    async def run(self, key, request, budget_name: str, fn, *args):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, budget_name, fn, args)
+            self._count(budget_name, "leaders")
+        else:
+            self._count(budget_name, "coalesced")
+
+        flight.waiters += 1
+        waiting = True
+        try:
+            while True:
+                done, _ = await asyncio.wait({flight.task}, timeout=DISCONNECT_POLL_SECONDS)
+                if flight.task in done:
+                    return flight.task.result()
+                if await request.is_disconnected():
+                    flight.waiters -= 1
+                    waiting = False
+                    if flight.waiters == 0:
+                        print(f"RequestCoalescer: all clients disconnected, cancelling {budget_name}")
+                        self._count(budget_name, "cancelled")
+                        if self._flights.get(key) is flight:
+                            del self._flights[key]
+                        flight.budget.cancel()
+                    return await asyncio.shield(flight.task)
+        finally:
+            if waiting:
+                flight.waiters -= 1
+
+
+def coalesce_key(request, scope: str) -> tuple:
+    """Path, normalized query string and authorization scope of a request."""
+    return (request.url.path, tuple(sorted(request.query_params.multi_items())), scope)
+
+
+coalescer = RequestCoalescer()
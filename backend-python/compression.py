@@ -0,0 +1,162 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+BROTLI_AVAILABLE = False
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+
+
+# Payloads that are already compressed gain nothing from another pass.
+SKIP_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/vnd.apache.parquet",
+    "application/vnd.apache.arrow",
+)
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, honouring q-values."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        weights[token] = q
+    star = weights.get('*', 0.0)
+    candidates = ['br', 'gzip'] if BROTLI_AVAILABLE else ['gzip']
+    best = None
+    best_q = 0.0
+    for enc in candidates:
+        q = weights.get(enc, star)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        self._z = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._b = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._b.process(data)
+
+    def finish(self) -> bytes:
+        return self._b.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with brotli or gzip.
+
+    Bodies smaller than ``minimum_size`` (single-chunk responses only) are sent
+    as-is; streamed responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def make_compressor(self, encoding: str):
+        if encoding == 'br':
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _compressible(self, headers: MutableHeaders, status: int) -> bool:
+        if status < 200 or status in (204, 206, 304):
+            return False
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return not content_type.startswith(SKIP_CONTENT_TYPES)
+
+    async def send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            start = self.start_message
+            headers = MutableHeaders(raw=start["headers"])
+            if not self._compressible(headers, start["status"]) or (not more_body and len(body) < self.middleware.minimum_size):
+                self.passthrough = True
+                await self.downstream(start)
+                await self.downstream(message)
+                return
+
+            self.compressor = self.middleware.make_compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            data = self.compressor.compress(body)
+            if more_body:
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+            else:
+                data += self.compressor.finish()
+                headers["Content-Length"] = str(len(data))
+            await self.downstream(start)
+            await self.downstream({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.finish()
+        await self.downstream({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -0,0 +1,60 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag from cheap validator values (ids, counts, timestamps)."""
+    raw = '|'.join('' if p is None else str(p) for p in parts)
+    return 'W/"' + hashlib.blake2b(raw.encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def naive_utc(dt: datetime | None) -> datetime | None:
+    """Attach UTC to a value read from a naive ``DateTime`` column (the models store utcnow())."""
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return dt.replace(tzinfo=timezone.utc)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    if dt.tzinfo is None:
+        raise ValueError("Last-Modified necesita una fecha con zona horaria")
+    return dt.astimezone(timezone.utc)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime | None = None) -> bool:
+    """Evaluate If-None-Match (weak comparison), falling back to If-Modified-Since."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        if if_none_match.strip() == '*':
+            return True
+        wanted = _opaque(etag)
+        return any(_opaque(t) == wanted for t in if_none_match.split(','))
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates are GMT; "-0000" or a missing zone parses as naive.
+        return _as_utc(last_modified).replace(microsecond=0) <= naive_utc(since).astimezone(timezone.utc)
+    return False
+
+
+def validator_headers(etag: str, last_modified: datetime | None = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_as_utc(last_modified), usegmt=True)
+    return headers
+
+
+def not_modified(etag: str, last_modified: datetime | None = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
@@ -0,0 +1,206 @@
+import json
+from datetime import date
+
+import psycopg2.errors
+import psycopg2.extras
+
+from budgets import DBBudget
+from database import read_connection, whatsapp_ts_column
+
+
+POSITIVE_KEYWORDS = ['gracias', 'excelente', 'bien', 'perfecto', 'genial', 'feliz', 'bueno', 'ok', 'okey']
+NEGATIVE_KEYWORDS = ['malo', 'problema', 'error', 'no funciona', 'mal', 'falla', 'reclamo', 'insatisfecho']
+
+
+def _percentages(counts: dict) -> list:
+    total = max(1, sum(counts.values()))
+    return [{'name': k, 'value': round(v * 100.0 / total, 1)} for k, v in counts.items()]
+
+
+def _clientes_kpis(cur):
+    cur.execute("""
+        SELECT COUNT(*) AS total_clients,
+               COUNT(*) FILTER (WHERE LOWER(estado) <> 'cerrado') AS active_clients,
+               COUNT(*) FILTER (WHERE fecha_registro >= current_date) AS new_today
+        FROM public.clientes
+    """)
+    row = cur.fetchone()
+    return int(row.get('total_clients') or 0), int(row.get('active_clients') or 0), int(row.get('new_today') or 0)
+
+
+def _ingresos_30d(cur):
+    cur.execute("SELECT COALESCE(SUM(monto),0) AS ingresos_30d FROM public.pagos WHERE fecha_pago >= now() - interval '30 days'")
+    return float(cur.fetchone().get('ingresos_30d') or 0)
+
+
+def _ofertas_abiertas(cur):
+    cur.execute("SELECT COUNT(*) AS ofertas_abiertas FROM public.ofertas WHERE estado = 'ABIERTA'")
+    return int(cur.fetchone().get('ofertas_abiertas') or 0)
+
+
+def _estado_counts(cur):
+    cur.execute("SELECT estado, COUNT(*) AS cnt FROM public.clientes GROUP BY estado")
+    return [(r.get('estado'), int(r.get('cnt') or 0)) for r in cur.fetchall()]
+
+
+def _conversations_total(cur):
+    try:
+        cur.execute("SAVEPOINT conversations_total")
+        cur.execute("SELECT COUNT(*) AS total_convs FROM public.n8n_chat_histories")
+        total = int(cur.fetchone().get('total_convs') or 0)
+        cur.execute("RELEASE SAVEPOINT conversations_total")
+        return total
+    except psycopg2.errors.UndefinedTable:
+        cur.execute("ROLLBACK TO SAVEPOINT conversations_total")
+        cur.execute("SELECT COUNT(*) AS total_convs FROM bot.whatsapp")
+        return int(cur.fetchone().get('total_convs') or 0)
+
+
+def _message_sentiment(msgs: list) -> dict:
+    counts = {'Positivo': 0, 'Negativo': 0, 'Neutral': 0}
+    for m in msgs:
+        text = ''
+        if isinstance(m, str):
+            text = m.lower()
+        else:
+            try:
+                text = json.dumps(m).lower()
+            except Exception:
+                text = str(m).lower()
+        if any(k in text for k in POSITIVE_KEYWORDS):
+            counts['Positivo'] += 1
+        elif any(k in text for k in NEGATIVE_KEYWORDS):
+            counts['Negativo'] += 1
+        else:
+            counts['Neutral'] += 1
+    return counts
+
+
+def _estado_sentiment(estado_rows: list) -> dict:
+    cliente_counts = {'Positivo': 0, 'Negativo': 0, 'Neutral': 0}
+    for estado, cnt in estado_rows:
+        estado = estado.lower() if isinstance(estado, str) else ''
+        if any(k in estado for k in ['cerrado', 'perdido', 'rechazado', 'cancelado']):
+            cliente_counts['Negativo'] += cnt
+        elif any(k in estado for k in ['activo', 'abierto', 'abierta', 'contactado', 'prospecto', 'interesado']):
+            cliente_counts['Positivo'] += cnt
+        else:
+            cliente_counts['Neutral'] += cnt
+    return cliente_counts
+
+
+def _estado_groups(estado_rows: list) -> dict:
+    estado_counts = {'Nuevo': 0, 'En gestión': 0, 'Cliente': 0, 'Otros': 0}
+    for estado, cnt in estado_rows:
+        est_l = (estado or '').strip().lower()
+        if 'nuevo' in est_l:
+            estado_counts['Nuevo'] += cnt
+        elif 'gest' in est_l or 'gestion' in est_l or 'gestión' in est_l:
+            estado_counts['En gestión'] += cnt
+        elif 'cliente' in est_l:
+            estado_counts['Cliente'] += cnt
+        else:
+            estado_counts['Otros'] += cnt
+    return estado_counts
+
+
+def compute_dashboard_charts(cur, budget: DBBudget, period: str = 'day', days: int = 7, month: int | None = None, year: int | None = None) -> dict:
+    """Dashboard KPIs and series; sections that run out of budget fall back to empty values."""
+    total_clients, active_clients, new_today = budget.section(cur, 'clientes', _clientes_kpis, (0, 0, 0))
+    ingresos_30d = budget.section(cur, 'ingresos_30d', _ingresos_30d, 0.0)
+    ofertas_abiertas = budget.section(cur, 'ofertas_abiertas', _ofertas_abiertas, 0)
+
+    conversations_by_day = []
+    conversations_by_month = []
+
+    ts_col = whatsapp_ts_column(cur)
+
+    if period == 'day':
+        days_int = int(days) if isinstance(days, int) else 7
+        if days_int < 1:
+            days_int = 7
+
+        def by_day(cur):
+            cur.execute(f"""
+                SELECT to_char({ts_col}::date, 'YYYY-MM-DD') AS day, COUNT(*) AS count
+                FROM bot.whatsapp
+                WHERE {ts_col} >= now() - interval '{days_int} days'
+                GROUP BY day ORDER BY day
+            """)
+            return [{'day': r['day'], 'count': int(r['count'])} for r in cur.fetchall()]
+
+        conversations_by_day = budget.section(cur, 'conversations_by_day', by_day, [])
+    else:
+        if isinstance(month, int) and isinstance(year, int) and 1 <= month <= 12:
+            start = date(year, month, 1)
+            if month == 12:
+                end = date(year + 1, 1, 1)
+            else:
+                end = date(year, month + 1, 1)
+
+            def by_month(cur):
+                cur.execute(f"""
+                    SELECT to_char({ts_col}::date, 'YYYY-MM') AS month, COUNT(*) AS count
+                    FROM bot.whatsapp
+                    WHERE {ts_col} >= %s AND {ts_col} < %s
+                    GROUP BY month ORDER BY month
+                """, (start, end))
+                return [{'month': r['month'], 'count': int(r['count'])} for r in cur.fetchall()]
+        else:
+            def by_month(cur):
+                cur.execute(f"""
+                    SELECT to_char({ts_col}::date, 'YYYY-MM') AS month, COUNT(*) AS count
+                    FROM bot.whatsapp
+                    WHERE {ts_col} >= (date_trunc('month', current_date) - interval '11 months')
+                    GROUP BY month ORDER BY month
+                """)
+                return [{'month': r['month'], 'count': int(r['count'])} for r in cur.fetchall()]
+
+        conversations_by_month = budget.section(cur, 'conversations_by_month', by_month, [])
+
+    def recent_messages(cur):
+        cur.execute(f"SELECT message FROM bot.whatsapp ORDER BY {ts_col} DESC LIMIT 1000")
+        return [r.get('message') for r in cur.fetchall()]
+
+    msgs = budget.section(cur, 'sentiment', recent_messages, [])
+    sentiment_breakdown = _percentages(_message_sentiment(msgs))
+
+    estado_rows = budget.section(cur, 'estado', _estado_counts, None)
+
+    if sum(s['value'] for s in sentiment_breakdown) <= 0.1:
+        sentiment_breakdown = _percentages(_estado_sentiment(estado_rows or []))
+
+    conversations_total = budget.section(cur, 'conversations_total', _conversations_total, 0)
+
+    resp = {
+        'total_clients': total_clients,
+        'active_clients': active_clients,
+        'new_today': new_today,
+        'ingresos_30d': ingresos_30d,
+        'ofertas_abiertas': ofertas_abiertas,
+        'conversations_total': conversations_total,
+        'conversations_by_day': conversations_by_day,
+        'conversations_by_month': conversations_by_month,
+        'sentiment_breakdown': sentiment_breakdown,
+    }
+
+    if estado_rows is not None:
+        estado_counts = _estado_groups(estado_rows)
+        resp['status_breakdown'] = _percentages(estado_counts)
+        resp['status_counts'] = estado_counts
+
+    resp['degraded'] = budget.degraded
+    if budget.degraded:
+        resp['degraded_sections'] = list(budget.degraded_sections)
+    return resp
+
+
+def load_dashboard_charts(budget: DBBudget, period: str = 'day', days: int = 7, month: int | None = None, year: int | None = None) -> dict:
+    with read_connection(autocommit=False) as conn:
+        budget.attach(conn)
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            return compute_dashboard_charts(cur, budget, period, days, month, year)
+        finally:
+            budget.attach(None)
+            cur.close()
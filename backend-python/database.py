@@ -1,6 +1,10 @@
 import os
 from urllib.parse import quote_plus
 import json
+import itertools
+import threading
+import time
+from contextlib import contextmanager
 
 from dotenv import load_dotenv
 import psycopg2
@@ -10,8 +14,8 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine import make_url
 
+from profiling import instrument_engine, trace_connection
 
-load_dotenv()
 
 def normalize_database_url(url: str) -> str:
     if not url:
@@ -23,57 +27,264 @@ def normalize_database_url(url: str) -> str:
         return url.replace("postgresql://", "postgresql+psycopg2://", 1)
     return url
 
-raw_database_url = os.getenv("DATABASE_URL")
-DATABASE_URL = normalize_database_url(raw_database_url)
-
-if not DATABASE_URL:
-    user = os.getenv("DB_USER") or os.getenv("user") or "postgres"
-    password = os.getenv("DB_PASSWORD") or os.getenv("password") or ""
-    host = os.getenv("DB_HOST") or os.getenv("host") or "localhost"
-    port = os.getenv("DB_PORT") or os.getenv("port") or "5432"
-    db = os.getenv("DB_NAME") or os.getenv("database") or "postgres"
-    driver = os.getenv("DB_DRIVER") or "psycopg2"
-    password_quoted = quote_plus(password)
-    DATABASE_URL = f"postgresql+{driver}://{user}:{password_quoted}@{host}:{port}/{db}?sslmode=disable"
-
-db_engine = create_engine(DATABASE_URL)
-DBSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+class Settings:
+    """Application configuration, resolved from the environment (and .env) on first use."""
+
+    def __init__(self):
+        load_dotenv()
+        database_url = normalize_database_url(os.getenv("DATABASE_URL"))
+        if not database_url:
+            user = os.getenv("DB_USER") or os.getenv("user") or "postgres"
+            password = os.getenv("DB_PASSWORD") or os.getenv("password") or ""
+            host = os.getenv("DB_HOST") or os.getenv("host") or "localhost"
+            port = os.getenv("DB_PORT") or os.getenv("port") or "5432"
+            db = os.getenv("DB_NAME") or os.getenv("database") or "postgres"
+            driver = os.getenv("DB_DRIVER") or "psycopg2"
+            password_quoted = quote_plus(password)
+            database_url = f"postgresql+{driver}://{user}:{password_quoted}@{host}:{port}/{db}?sslmode=disable"
+        self.DATABASE_URL = database_url
+
+        try:
+            db_url_obj = make_url(database_url)
+            self.db_username = db_url_obj.username or os.getenv("DB_USER") or os.getenv("user")
+            self.db_password = db_url_obj.password or os.getenv("DB_PASSWORD") or os.getenv("password")
+            self.db_host = db_url_obj.host or os.getenv("DB_HOST") or os.getenv("host")
+            self.db_port = db_url_obj.port or os.getenv("DB_PORT") or os.getenv("port")
+            self.db_name = db_url_obj.database or os.getenv("DB_NAME") or os.getenv("database")
+        except Exception:
+            self.db_username = os.getenv("DB_USER") or os.getenv("user")
+            self.db_password = os.getenv("DB_PASSWORD") or os.getenv("password")
+            self.db_host = os.getenv("DB_HOST") or os.getenv("host")
+            self.db_port = os.getenv("DB_PORT") or os.getenv("port")
+            self.db_name = os.getenv("DB_NAME") or os.getenv("database")
+
+        # Every threadpool worker (plus each job worker) can hold one pooled
+        # connection; pool_size connections stay open, the rest is overflow.
+        self.THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE") or "40")
+        self.DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE") or "10")
+        default_overflow = max(0, self.THREADPOOL_SIZE + int(os.getenv("JOBS_WORKERS") or "2") - self.DB_POOL_SIZE)
+        self.DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW") or str(default_overflow))
+        self.DB_REPLICA_URLS = [normalize_database_url(u) for u in (os.getenv("DB_REPLICA_URLS") or "").split(",") if u.strip()]
+        self.DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS") or "10")
+        self.DB_REPLICA_EJECT_SECONDS = float(os.getenv("DB_REPLICA_EJECT_SECONDS") or "30")
+        self.DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS") or "5")
+        self.DASHBOARD_SNAPSHOT_SECONDS = int(os.getenv("DASHBOARD_SNAPSHOT_SECONDS") or "300")
+        self.ANALYTICS_SETTLE_GRACE_SECONDS = float(os.getenv("ANALYTICS_SETTLE_GRACE_SECONDS") or "60")
+        # Time zone of the wall-clock values in a naive bot.whatsapp timestamp column.
+        self.WHATSAPP_TIMESTAMP_TZ = os.getenv("WHATSAPP_TIMESTAMP_TZ") or "UTC"
+
+        self.SECRET_KEY = os.getenv("SECRET_KEY") or "change-me-to-a-random-secret"
+        self.JWT_ALGORITHM = os.getenv("JWT_ALGORITHM") or "HS256"
+        self.ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "60")
+        self.USER_CACHE_SECONDS = float(os.getenv("USER_CACHE_SECONDS") or "60")
+
+
+_settings = None
+_engine = None
+_init_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        with _init_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
+
+
+def get_engine():
+    """Primary engine, created on first use instead of at import time."""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        with _init_lock:
+            if _engine is None:
+                _engine = create_engine(settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW, pool_recycle=1800)
+                instrument_engine(_engine)
+    return _engine
+
+
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+
+
+def DBSessionLocal():
+    return _session_factory(bind=get_engine())
+
+
 DBBase = declarative_base()
 
-try:
-    db_url_obj = make_url(DATABASE_URL)
-    db_username = db_url_obj.username or os.getenv("DB_USER") or os.getenv("user")
-    db_password = db_url_obj.password or os.getenv("DB_PASSWORD") or os.getenv("password")
-    db_host = db_url_obj.host or os.getenv("DB_HOST") or os.getenv("host")
-    db_port = db_url_obj.port or os.getenv("DB_PORT") or os.getenv("port")
-    db_name = db_url_obj.database or os.getenv("DB_NAME") or os.getenv("database")
-except Exception:
-    db_username = os.getenv("DB_USER") or os.getenv("user")
-    db_password = os.getenv("DB_PASSWORD") or os.getenv("password")
-    db_host = os.getenv("DB_HOST") or os.getenv("host")
-    db_port = os.getenv("DB_PORT") or os.getenv("port")
-    db_name = os.getenv("DB_NAME") or os.getenv("database")
+
+def __getattr__(name):
+    # Backwards-compatible module attributes (database.db_engine, database.db_host, ...)
+    # resolved lazily so importing this module has no side effects.
+    if name == "db_engine":
+        return get_engine()
+    if name in ("DATABASE_URL", "db_username", "db_password", "db_host", "db_port", "db_name"):
+        return getattr(get_settings(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def connect_postgres():
+    """Unpooled autocommit connection to the primary, traced when opened inside a request."""
+    settings = get_settings()
     conn = psycopg2.connect(
-        host=db_host,
-        database=db_name,
-        user=db_username,
-        password=db_password,
-        port=db_port,
+        host=settings.db_host,
+        database=settings.db_name,
+        user=settings.db_username,
+        password=settings.db_password,
+        port=settings.db_port,
     )
     try:
         conn.autocommit = True
     except Exception:
         pass
-    return conn
+    return trace_connection(conn)
 
 
-def load_whatsapp_messages(limit: int | None = None) -> list:
-    conn = None
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Replica:
+    def __init__(self, url: str, engine):
+        self.url = url
+        self.engine = engine
+        self.skip_until = 0.0
+        self.lag_checked_at = 0.0
+        self.lag = 0.0
+
+
+class ReplicaRouter:
+    """Round-robin over pooled replica engines with health-based ejection.
+
+    A replica that fails to connect (or errors mid-query) is skipped for
+    ``eject_seconds``; one whose replay lag exceeds ``max_lag`` is skipped until
+    its next lag check. When no replica is usable, ``checkout`` returns None and
+    the caller falls back to the primary.
+    """
+
+    def __init__(self, replicas: list, max_lag: float, eject_seconds: float, lag_check_seconds: float):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.eject_seconds = eject_seconds
+        self.lag_check_seconds = lag_check_seconds
+        self._rr = itertools.count()
+        self._lock = threading.Lock()
+
+    def _ordered(self, now: float) -> list:
+        with self._lock:
+            start = next(self._rr)
+        n = len(self.replicas)
+        ordered = [self.replicas[(start + i) % n] for i in range(n)]
+        return [r for r in ordered if r.skip_until <= now]
+
+    def eject(self, replica: Replica, seconds: float, reason: str):
+        replica.skip_until = time.monotonic() + seconds
+        print(f"ReplicaRouter: skipping replica {make_url(replica.url).host} for {seconds:.0f}s ({reason})")
+
+    def _check_lag(self, replica: Replica, conn, now: float) -> bool:
+        if now - replica.lag_checked_at < self.lag_check_seconds:
+            return replica.lag <= self.max_lag
+        cur = conn.cursor()
+        cur.execute(REPLICA_LAG_SQL)
+        replica.lag = float(cur.fetchone()[0] or 0)
+        cur.close()
+        conn.rollback()
+        replica.lag_checked_at = now
+        return replica.lag <= self.max_lag
+
+    def checkout(self):
+        """Return ``(replica, pooled DBAPI connection)`` or ``(None, None)``."""
+        now = time.monotonic()
+        for replica in self._ordered(now):
+            conn = None
+            try:
+                conn = replica.engine.raw_connection()
+                if self._check_lag(replica, conn, now):
+                    return replica, conn
+                conn.close()
+                self.eject(replica, self.lag_check_seconds, f"lag {replica.lag:.1f}s")
+            except Exception as e:
+                if conn is not None:
+                    try:
+                        conn.invalidate()
+                    except Exception:
+                        pass
+                self.eject(replica, self.eject_seconds, f"error: {e}")
+        return None, None
+
+
+_replica_router = None
+_replica_router_lock = threading.Lock()
+
+
+def get_replica_router():
+    global _replica_router
+    settings = get_settings()
+    if _replica_router is None and settings.DB_REPLICA_URLS:
+        with _replica_router_lock:
+            if _replica_router is None:
+                replicas = [Replica(url, create_engine(url, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW, pool_recycle=1800)) for url in settings.DB_REPLICA_URLS]
+                _replica_router = ReplicaRouter(replicas, settings.DB_REPLICA_MAX_LAG_SECONDS, settings.DB_REPLICA_EJECT_SECONDS, settings.DB_REPLICA_LAG_CHECK_SECONDS)
+    return _replica_router
+
+
+def dispose_engines():
+    """Close pooled connections (primary and replicas); engines are rebuilt on next use."""
+    global _engine, _replica_router
+    with _init_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+    with _replica_router_lock:
+        if _replica_router is not None:
+            for replica in _replica_router.replicas:
+                replica.engine.dispose()
+            _replica_router = None
+
+
+@contextmanager
+def read_connection(autocommit: bool = True):
+    """Pooled connection for read-only queries: a healthy replica, else the primary.
+
+    Like ``connect_postgres`` the connection is in autocommit mode unless
+    ``autocommit=False`` is requested (needed for SET LOCAL or named cursors).
+    It is returned to its pool on exit. Writes must keep using the primary.
+    """
+    router = get_replica_router()
+    replica, conn = router.checkout() if router else (None, None)
+    if conn is None:
+        conn = get_engine().raw_connection()
+    traced = trace_connection(conn)
     try:
-        conn = connect_postgres()
+        if autocommit:
+            conn.dbapi_connection.autocommit = True
+        yield traced
+    except psycopg2.OperationalError:
+        if replica is not None:
+            router.eject(replica, router.eject_seconds, "operational error during query")
+            try:
+                conn.invalidate()
+            except Exception:
+                pass
+        raise
+    finally:
+        try:
+            if autocommit and conn.dbapi_connection is not None:
+                conn.dbapi_connection.autocommit = False
+        except Exception:
+            pass
+        traced.close()
+
+
+def load_whatsapp_messages(limit: int | None = None) -> list:
+    with read_connection() as conn:
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         sql = "SELECT * FROM bot.whatsapp"
         if limit is not None:
@@ -84,39 +295,213 @@ def load_whatsapp_messages(limit: int | None = None) -> list:
         rows = cur.fetchall()
         cur.close()
         return [dict(r) for r in rows]
-    finally:
-        if conn:
-            conn.close()
 
 
-def load_chat_history_by_session(session_id: str, limit: int | None = None) -> list:
-   
-    conn = None
-    try:
-        conn = connect_postgres()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        sql = "SELECT id, session_id, message FROM public.n8n_chat_histories WHERE session_id = %s ORDER BY id ASC"
-        if limit is not None:
-            sql = sql.replace("ORDER BY id ASC", "ORDER BY id ASC LIMIT %s")
-            cur.execute(sql, (session_id, limit))
+# n8n message keys that can be projected: ->> (text) for scalars, -> (jsonb) for nested values.
+MESSAGE_FIELDS = {
+    "type": "->>",
+    "content": "->>",
+    "tool_calls": "->",
+    "additional_kwargs": "->",
+    "response_metadata": "->",
+}
+
+
+def parse_message_fields(fields: str | None) -> tuple | None:
+    """'type,content' -> ('type', 'content'); None means the whole message."""
+    if not fields:
+        return None
+    names = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+    unknown = [f for f in names if f not in MESSAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"fields debe contener solo: {', '.join(MESSAGE_FIELDS)}")
+    return names
+
+
+def message_projection(column: str, fields: tuple | None, preview_chars: int | None) -> tuple:
+    """(select list, column names) extracting ``fields`` of the JSON ``column`` inside Postgres.
+
+    ``content`` is cut to ``preview_chars`` characters with ``left()`` and a
+    ``content_truncated`` flag is added, so long texts never leave the server.
+    """
+    if fields is None and preview_chars is None:
+        return column, ("message",)
+    fields = fields or ("type", "content")
+    exprs, names = [], []
+    for name in fields:
+        expr = f"({column}::jsonb){MESSAGE_FIELDS[name]}'{name}'"
+        if name == "content" and preview_chars is not None:
+            exprs.append(f"left({expr}, {int(preview_chars)})")
+            names.append(name)
+            exprs.append(f"coalesce(length({expr}) > {int(preview_chars)}, false)")
+            names.append("content_truncated")
         else:
-            cur.execute(sql, (session_id,))
-        rows = cur.fetchall()
-        result = []
-        for r in rows:
-            row = dict(r)
-            msg = row.get("message")
-            if isinstance(msg, str):
-                try:
-                    row["message"] = json.loads(msg)
-                except Exception:
-                    row["message"] = msg
-            result.append(row)
+            exprs.append(expr)
+            names.append(name)
+    return ", ".join(exprs), tuple(names)
+
+
+def _message_value(names: tuple, values) -> object:
+    if names == ("message",):
+        msg = values[0]
+        if isinstance(msg, str):
+            try:
+                return json.loads(msg)
+            except Exception:
+                return msg
+        return msg
+    return dict(zip(names, values))
+
+
+def load_chat_history_by_session(session_id: str, limit: int | None = None, budget=None, fields: tuple | None = None, preview_chars: int | None = None) -> list:
+    """Rows of one n8n session; ``budget`` (a budgets.DBBudget) bounds the query time.
+
+    ``fields``/``preview_chars`` project the message JSON in the database (see message_projection).
+    """
+    with read_connection(autocommit=budget is None) as conn:
+        cur = conn.cursor()
+        try:
+            if budget is not None:
+                budget.attach(conn)
+                budget.apply(cur)
+            select_list, names = message_projection("message", fields, preview_chars)
+            sql = f"SELECT id, session_id, {select_list} FROM public.n8n_chat_histories WHERE session_id = %s ORDER BY id ASC"
+            if limit is not None:
+                cur.execute(sql + " LIMIT %s", (session_id, limit))
+            else:
+                cur.execute(sql, (session_id,))
+            return [{"id": r[0], "session_id": r[1], "message": _message_value(names, r[2:])} for r in cur.fetchall()]
+        finally:
+            # Never leave the budget pointing at a connection returned to the pool.
+            if budget is not None:
+                budget.attach(None)
+            cur.close()
+
+
+# Window scanned first for the most recent sessions; only the latest monthly
+# partitions of a partitioned n8n_chat_histories are read when it is enough.
+N8N_RECENT_WINDOW_DAYS = 31
+
+
+def n8n_sessions_sql(window: bool, message_select: str = "t.message") -> str:
+    recent_filter = "WHERE created_at >= now() - make_interval(days => %(days)s)" if window else ""
+    join_filter = "AND t.created_at >= now() - make_interval(days => %(days)s)" if window else ""
+    return f"""
+        WITH recent AS (
+            SELECT session_id, MAX(id) AS last_id
+            FROM public.n8n_chat_histories
+            {recent_filter}
+            GROUP BY session_id
+            ORDER BY last_id DESC
+            LIMIT %(limit)s
+        )
+        SELECT r.session_id, r.last_id,
+               (SELECT COUNT(*) FROM public.n8n_chat_histories c WHERE c.session_id = r.session_id) AS count,
+               {message_select}
+        FROM recent r
+        JOIN public.n8n_chat_histories t ON t.id = r.last_id {join_filter}
+        ORDER BY r.last_id DESC
+    """
+
+
+def load_n8n_sessions(limit: int = 200, budget=None, fields: tuple | None = None, preview_chars: int | None = None) -> list:
+    """Latest message and message count of the most recent n8n sessions.
+
+    ``fields``/``preview_chars`` project the last message in the database (see message_projection).
+    """
+    with read_connection(autocommit=budget is None) as conn:
+        cur = conn.cursor()
+        try:
+            if budget is not None:
+                budget.attach(conn)
+                budget.apply(cur)
+            params = {"limit": limit, "days": N8N_RECENT_WINDOW_DAYS}
+            message_select, names = message_projection("t.message", fields, preview_chars)
+            rows = []
+            if n8n_has_created_at(cur):
+                cur.execute(n8n_sessions_sql(True, message_select), params)
+                rows = cur.fetchall()
+            if len(rows) < limit:
+                # Ids grow with time, so the window's top sessions are the global ones
+                # whenever it holds enough of them; otherwise scan everything.
+                if budget is not None:
+                    budget.apply(cur)
+                cur.execute(n8n_sessions_sql(False, message_select), params)
+                rows = cur.fetchall()
+            return [
+                {"session_id": r[0], "last_id": r[1], "last_message": _message_value(names, r[3:]), "count": r[2]}
+                for r in rows
+            ]
+        finally:
+            if budget is not None:
+                budget.attach(None)
+            cur.close()
+
+
+_n8n_has_created_at = None
+
+
+def n8n_has_created_at(cur) -> bool:
+    """Whether n8n_chat_histories has the created_at partition key (probed once per process)."""
+    global _n8n_has_created_at
+    if _n8n_has_created_at is not None:
+        return _n8n_has_created_at
+    try:
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'n8n_chat_histories' AND column_name = 'created_at'
+        """)
+        _n8n_has_created_at = cur.fetchone() is not None
+    except Exception as e:
+        print(f"n8n_has_created_at: catalog probe failed: {e}")
+        return False
+    return _n8n_has_created_at
+
+
+_whatsapp_ts_column = None
+
+
+def whatsapp_ts_column(cur) -> str:
+    """Name of the timestamp column in bot.whatsapp ('timestamp' or 'fecha_hora').
+
+    The schema does not change at runtime, so the catalog is probed once per process.
+    """
+    global _whatsapp_ts_column
+    if _whatsapp_ts_column is not None:
+        return _whatsapp_ts_column
+    ts_col = 'timestamp'
+    try:
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'bot' AND table_name = 'whatsapp' AND column_name IN ('timestamp','fecha_hora')
+        """)
+        found = [r[0] if isinstance(r, tuple) else r.get('column_name') for r in cur.fetchall()]
+        if 'timestamp' not in found and 'fecha_hora' in found:
+            ts_col = 'fecha_hora'
+        _whatsapp_ts_column = ts_col
+    except Exception as e:
+        print(f"whatsapp_ts_column: catalog probe failed: {e}")
+    return ts_col
+
+
+def chat_history_version(session_id: str) -> tuple:
+    """(max id, row count) for a session: changes whenever a message is appended."""
+    with read_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(id), COUNT(*) FROM public.n8n_chat_histories WHERE session_id = %s", (session_id,))
+        row = cur.fetchone()
         cur.close()
-        return result
-    finally:
-        if conn:
-            conn.close()
+        return (row[0], row[1])
+
+
+def clientes_version() -> tuple:
+    """(row count, max fecha_registro) for public.clientes."""
+    with read_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*), MAX(fecha_registro) FROM public.clientes")
+        row = cur.fetchone()
+        cur.close()
+        return (row[0], row[1])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,292 @@
+"""Columnar export of bot.whatsapp, n8n_chat_histories and clientes (Arrow IPC stream or Parquet).
+
+Rows are read from a server-side cursor in batches of ``batch_size`` and
+written batch by batch, so memory stays bounded whatever the table size.
+
+    python export.py whatsapp --format parquet --from 2025-01-01 --to 2025-02-01 -o whatsapp.parquet
+    python export.py n8n_chat_histories --since 123456 -o nuevos.arrow   # incremental, from a previous watermark
+
+Incremental exports are keyed on ``id``. Ids are assigned before commit, so a
+row can become visible after an export already returned higher ids; ``since``
+therefore re-reads EXPORT_WATERMARK_LAG ids (default 1000) below the
+watermark. Consecutive exports overlap and consumers must dedupe on ``id``.
+A row committed more than that many ids late is still missed.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import uuid
+from contextlib import ExitStack
+from datetime import datetime
+
+from psycopg2 import sql
+
+from database import n8n_has_created_at, read_connection, whatsapp_ts_column
+
+# pyarrow is imported on the first export, not when main.py imports this module.
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pa
+
+
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+DEFAULT_BATCH_SIZE = 10_000
+DEFAULT_WATERMARK_LAG_IDS = 1000
+WATERMARK_COLUMN = "id"
+
+
+class ExportError(ValueError):
+    pass
+
+
+class ExportSource:
+    """A table to export and its time column (for from/to); ``since`` always uses ``id``."""
+
+    def __init__(self, schema: str, table: str, time_column):
+        self.schema = schema
+        self.table = table
+        self.time_column = time_column
+
+    def resolve(self, cur) -> str | None:
+        """Time column or None; a callable probes the catalog."""
+        return self.time_column(cur) if callable(self.time_column) else self.time_column
+
+
+SOURCES = {
+    "whatsapp": ExportSource("bot", "whatsapp", whatsapp_ts_column),
+    "n8n_chat_histories": ExportSource("public", "n8n_chat_histories", lambda cur: "created_at" if n8n_has_created_at(cur) else None),
+    "clientes": ExportSource("public", "clientes", "fecha_registro"),
+}
+
+
+# PostgreSQL type OIDs -> Arrow types; anything else is exported as a string.
+def _arrow_type(type_code: int):
+    pa = _pyarrow()
+    return {
+        16: pa.bool_(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1700: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp("us"),
+        1184: pa.timestamp("us", tz="UTC"),
+    }.get(type_code, pa.string())
+
+
+def _to_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).decode("utf-8", errors="replace")
+    return str(value)
+
+
+def _batch(schema, rows) -> "pyarrow.RecordBatch":
+    pa = _pyarrow()
+    columns = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_string(field.type):
+            values = [_to_string(v) for v in values]
+        elif pa.types.is_floating(field.type):
+            values = [None if v is None else float(v) for v in values]
+        columns.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class _ChunkSink:
+    """Write-only file object collecting what the Arrow writer produces between batches."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parse_watermark(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ExportError("since debe ser un id numérico")
+
+
+def watermark_lag_ids() -> int:
+    return int(os.getenv("EXPORT_WATERMARK_LAG") or DEFAULT_WATERMARK_LAG_IDS)
+
+
+class Export:
+    """One export: the snapshot is opened (and the watermark known) before any byte is streamed.
+
+    Call ``chunks()`` at most once; it releases the connection when exhausted.
+    An export that is never streamed must be closed (``close()`` or ``with``).
+    """
+
+    def __init__(self, source_name: str, fmt: str = "parquet", start: datetime | None = None, end: datetime | None = None,
+                 since: str | None = None, batch_size: int = DEFAULT_BATCH_SIZE, lag_ids: int | None = None):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("La exportación requiere el paquete 'pyarrow'")
+        source = SOURCES.get(source_name)
+        if source is None:
+            raise ExportError(f"source debe ser uno de: {', '.join(SOURCES)}")
+        if fmt not in FORMATS:
+            raise ExportError(f"format debe ser uno de: {', '.join(FORMATS)}")
+        self.source = source
+        self.format = fmt
+        self.media_type = FORMATS[fmt]
+        self.batch_size = batch_size
+        self.rows = 0
+        self.lag_ids = watermark_lag_ids() if lag_ids is None else lag_ids
+        self._cursor = None
+
+        self._stack = ExitStack()
+        try:
+            self._open(start, end, since)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the cursor and return the connection; safe to call more than once."""
+        try:
+            if self._cursor is not None:
+                self._cursor.close()
+        except Exception:
+            pass
+        finally:
+            self._cursor = None
+            self._stack.close()
+
+    def _open(self, start, end, since):
+        conn = self._stack.enter_context(read_connection(autocommit=False))
+        cur = conn.cursor()
+        # One snapshot for the watermark and the rows: every exported row has id <= watermark.
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        time_column = self.source.resolve(cur)
+        watermark_column = WATERMARK_COLUMN
+        table = sql.Identifier(self.source.schema, self.source.table)
+
+        filters, params = [], []
+        if start is not None or end is not None:
+            if time_column is None:
+                raise ExportError(f"{self.source.table} no tiene columna de fecha para filtrar")
+            if start is not None:
+                filters.append(sql.SQL("{} >= %s").format(sql.Identifier(time_column)))
+                params.append(start)
+            if end is not None:
+                filters.append(sql.SQL("{} < %s").format(sql.Identifier(time_column)))
+                params.append(end)
+        if since is not None:
+            # Re-read lag_ids below the previous watermark for rows that committed late.
+            filters.append(sql.SQL("{} > %s").format(sql.Identifier(watermark_column)))
+            params.append(_parse_watermark(since) - self.lag_ids)
+        where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(filters) if filters else sql.SQL("")
+
+        cur.execute(sql.SQL("SELECT MAX({}) FROM {}{}").format(sql.Identifier(watermark_column), table, where), params)
+        self.watermark = cur.fetchone()[0]
+        cur.close()
+        if self.watermark is not None:
+            filters.append(sql.SQL("{} <= %s").format(sql.Identifier(watermark_column)))
+            params.append(self.watermark)
+            where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(filters)
+
+        self._cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}")
+        self._cursor.itersize = self.batch_size
+        query = sql.SQL("SELECT * FROM {}{} ORDER BY {}").format(table, where, sql.Identifier(watermark_column))
+        self._cursor.execute(query, params)
+
+    def _writer(self, sink, schema):
+        pa = _pyarrow()
+        if self.format == "parquet":
+            return pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+        return pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def chunks(self):
+        sink = _ChunkSink()
+        writer = None
+        try:
+            while True:
+                rows = self._cursor.fetchmany(self.batch_size)
+                if writer is None:
+                    schema = _pyarrow().schema([(d.name, _arrow_type(d.type_code)) for d in self._cursor.description])
+                    writer = self._writer(sink, schema)
+                if not rows:
+                    break
+                writer.write_batch(_batch(schema, rows))
+                self.rows += len(rows)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+            writer.close()
+            yield sink.drain()
+        finally:
+            self.close()
+
+
+def _parse_cli_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", choices=list(SOURCES))
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--from", dest="start", help="ISO date/time, inclusive")
+    parser.add_argument("--to", dest="end", help="ISO date/time, exclusive")
+    parser.add_argument("--since", help="watermark (id) printed by a previous export; overlaps it, dedupe on id")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    try:
+        export = Export(args.source, args.format, _parse_cli_datetime(args.start), _parse_cli_datetime(args.end), args.since, args.batch_size)
+    except ExportError as e:
+        parser.error(str(e))
+    with export, open(args.output, "wb") as out:
+        for chunk in export.chunks():
+            out.write(chunk)
+    print(f"export: {export.rows} rows of {args.source} -> {args.output}; watermark={export.watermark}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Background jobs persisted in the ``jobs`` table.
+
+Each row is one job key (name + params) holding its schedule and latest
+result. Worker threads in every app process claim due rows with
+``FOR UPDATE SKIP LOCKED``, so any number of processes share the queue.
+Periodic jobs re-arm themselves after each run; failures retry with
+exponential backoff. Request handlers read stored results from a replica and
+compute inline only when there is no usable result yet.
+
+    python jobs.py            # run a standalone worker process
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from budgets import DBBudget
+from client_metrics import refresh_client_metrics
+from dashboard import load_dashboard_charts
+from database import DBSessionLocal, get_engine, get_settings, read_connection
+from models import Job
+
+
+HANDLERS = {}
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 600
+# A process records demand for a job key (jobs.updated_at, read by
+# purge_finished) at most this often.
+DEMAND_TOUCH_SECONDS = 3600
+# Without a fresher result after this many max_age periods no worker is
+# running the job (JOBS_WORKERS=0 everywhere); precomputed() computes inline.
+INLINE_AFTER_PERIODS = 10
+INLINE_POLL_SECONDS = 0.05
+
+DASHBOARD_DAYS = (7, 14, 30, 60, 90, 180, 365)
+
+
+def job(name: str):
+    """Register ``fn(params) -> JSON-serializable result`` as the handler of jobs called ``name``."""
+    def register(fn):
+        HANDLERS[name] = fn
+        return fn
+    return register
+
+
+def job_key(name: str, params: dict) -> str:
+    return f"{name}:{json.dumps(params, sort_keys=True, separators=(',', ':'))}"
+
+
+def backoff_seconds(attempts: int) -> int:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def ensure_job(conn, name: str, params: dict, interval_seconds: int | None = None, max_attempts: int = 5) -> str:
+    """Create the job for (name, params) due now unless it already exists; returns its key."""
+    key = job_key(name, params)
+    conn.execute(insert(Job).values(
+        key=key, name=name, params=params, status='pending', run_at=func.now(),
+        interval_seconds=interval_seconds, attempts=0, max_attempts=max_attempts, updated_at=func.now(),
+    ).on_conflict_do_update(
+        index_elements=[Job.key],
+        set_={"interval_seconds": interval_seconds, "max_attempts": max_attempts},
+    ))
+    return key
+
+
+def request_run(conn, key: str | None = None, name: str | None = None) -> int:
+    """Make finished or waiting jobs (by key, or every job called ``name``) due now."""
+    stmt = update(Job).where(Job.status.in_(('pending', 'done', 'failed')))
+    stmt = stmt.where(Job.key == key) if key is not None else stmt.where(Job.name == name)
+    return conn.execute(stmt.values(status='pending', run_at=func.now(), attempts=0, updated_at=func.now())).rowcount
+
+
+def is_degraded(result) -> bool:
+    """Partial payloads (some budget sections failed) are served but never stored."""
+    return isinstance(result, dict) and bool(result.get('degraded'))
+
+
+def store_result(conn, key: str, result) -> datetime:
+    """Save a result computed outside the workers; returns its result_at. A waiting one-off job is marked done."""
+    one_off_waiting = and_(Job.status == 'pending', Job.interval_seconds.is_(None))
+    return conn.execute(update(Job).where(Job.key == key).values(
+        result=result, result_at=func.now(), error=None, updated_at=func.now(),
+        status=case((one_off_waiting, 'done'), else_=Job.status),
+    ).returning(Job.result_at)).scalar()
+
+
+def claim(conn, worker_id: str):
+    """Lock the most overdue pending job for ``worker_id``; None when nothing is due."""
+    due = (
+        select(Job.id)
+        .where(Job.status == 'pending', Job.run_at <= func.now())
+        .order_by(Job.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return conn.execute(
+        update(Job)
+        .where(Job.id == due)
+        .values(status='running', locked_by=worker_id, locked_at=func.now(), attempts=Job.attempts + 1, updated_at=func.now())
+        .returning(Job.id, Job.name, Job.params, Job.attempts, Job.max_attempts, Job.interval_seconds)
+    ).first()
+
+
+def complete(conn, claimed, result):
+    values = dict(result=result, result_at=func.now(), error=None, locked_by=None, locked_at=None, updated_at=func.now())
+    if claimed.interval_seconds:
+        values.update(status='pending', attempts=0, run_at=func.now() + timedelta(seconds=claimed.interval_seconds))
+    else:
+        values.update(status='done')
+    conn.execute(update(Job).where(Job.id == claimed.id).values(**values))
+
+
+def fail(conn, claimed, error: str):
+    """Retry with backoff; past max_attempts a periodic job waits for its next run, a one-off fails."""
+    values = dict(error=error[:2000], locked_by=None, locked_at=None, updated_at=func.now())
+    if claimed.attempts < claimed.max_attempts:
+        values.update(status='pending', run_at=func.now() + timedelta(seconds=backoff_seconds(claimed.attempts)))
+    elif claimed.interval_seconds:
+        values.update(status='pending', attempts=0, run_at=func.now() + timedelta(seconds=claimed.interval_seconds))
+    else:
+        values.update(status='failed')
+    conn.execute(update(Job).where(Job.id == claimed.id).values(**values))
+
+
+def reap_stale(conn, lease_seconds: int) -> int:
+    """Return jobs whose worker died mid-run to the queue."""
+    return conn.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < func.now() - timedelta(seconds=lease_seconds))
+        .values(status='pending', locked_by=None, locked_at=None, run_at=func.now(), updated_at=func.now())
+    ).rowcount
+
+
+def purge_finished(conn, older_than_seconds: int) -> int:
+    """Delete one-off jobs nobody has asked for since ``older_than_seconds``."""
+    return conn.execute(
+        delete(Job).where(
+            Job.interval_seconds.is_(None),
+            Job.status.in_(('done', 'failed')),
+            Job.updated_at < func.now() - timedelta(seconds=older_than_seconds),
+        )
+    ).rowcount
+
+
+_demand_touched = {}
+_demand_lock = threading.Lock()
+
+
+def _demand_due(key: str) -> bool:
+    """Whether this process should record demand for ``key`` now."""
+    now = time.monotonic()
+    with _demand_lock:
+        last = _demand_touched.get(key)
+        if last is not None and now - last < DEMAND_TOUCH_SECONDS:
+            return False
+        if len(_demand_touched) >= 10_000:
+            _demand_touched.clear()
+        _demand_touched[key] = now
+        return True
+
+
+def _compute_inline(name: str, params: dict, key: str, seen, compute, wait_seconds: float) -> tuple:
+    """Single-flight inline run: the holder of the key's advisory lock computes.
+
+    Other callers serve the result ``seen`` on the replica if there is one,
+    else wait (up to ``wait_seconds``) for the holder's result. A degraded
+    result is returned but not stored; the job is re-queued instead.
+    """
+    seen_at = seen[1] if seen is not None else None
+    deadline = time.monotonic() + wait_seconds
+    with get_engine().begin() as conn:
+        while True:
+            locked = conn.execute(select(func.pg_try_advisory_xact_lock(func.hashtextextended(key, 0)))).scalar()
+            current = conn.execute(select(Job.result, Job.result_at).where(Job.key == key)).first()
+            if current is not None and current.result is not None and current.result_at is not None \
+                    and (seen_at is None or current.result_at > seen_at):
+                return current.result, current.result_at
+            if locked:
+                break
+            if seen is not None and seen[0] is not None:
+                return seen[0], seen_at
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(INLINE_POLL_SECONDS)
+
+        result = compute(params)
+        if current is None:
+            ensure_job(conn, name, params)
+        if is_degraded(result):
+            request_run(conn, key=key)
+            return result, None
+        return result, store_result(conn, key, result)
+
+
+def precomputed(name: str, params: dict, max_age_seconds: float, compute=None, wait_seconds: float = 10.0) -> tuple:
+    """(result, result_at) of a job; result_at is None for a degraded inline result.
+
+    The row is read from a replica. A stale result is re-queued and still
+    returned meanwhile (stale-while-revalidate). With no result yet, or one
+    older than INLINE_AFTER_PERIODS periods, ``compute(params)`` (default: the
+    job handler) runs inline, once per key across processes. The primary is
+    written only for these cases and a demand touch at most every
+    DEMAND_TOUCH_SECONDS per key and process.
+    """
+    key = job_key(name, params)
+    with read_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT result, result_at, status FROM jobs WHERE key = %s", (key,))
+        row = cur.fetchone()
+        cur.close()
+    result, result_at, status = row if row is not None else (None, None, None)
+    age = (datetime.now(timezone.utc) - result_at).total_seconds() if result_at is not None else None
+
+    if result is None or age is None or age > max_age_seconds * INLINE_AFTER_PERIODS:
+        return _compute_inline(name, params, key, row, compute or HANDLERS[name], wait_seconds)
+
+    requeue = age > max_age_seconds and status in ('done', 'failed')
+    if requeue or _demand_due(key):
+        with get_engine().begin() as conn:
+            if requeue:
+                request_run(conn, key=key)
+            else:
+                conn.execute(update(Job).where(Job.key == key).values(updated_at=func.now()))
+    return result, result_at
+
+
+class JobRunner:
+    """Worker threads executing due jobs, plus a housekeeping thread."""
+
+    def __init__(self, workers: int = 2, poll_seconds: float = 1.0, lease_seconds: int = 600, schedules: tuple = ()):
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.schedules = schedules
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        threads = [threading.Thread(target=self._housekeeping, name='jobs-housekeeping', daemon=True)]
+        threads += [threading.Thread(target=self._work, args=(f"{self.worker_prefix}:{i}",), name=f'jobs-worker-{i}', daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        self._threads = threads
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self, worker_id: str) -> bool:
+        """Claim and run one due job; False when the queue had nothing due."""
+        with get_engine().begin() as conn:
+            claimed = claim(conn, worker_id)
+        if claimed is None:
+            return False
+        handler = HANDLERS.get(claimed.name)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler for job {claimed.name}")
+            result = handler(claimed.params or {})
+            if is_degraded(result):
+                # Keep the previous result; retry with backoff.
+                raise RuntimeError(f"degraded result: {', '.join(result.get('degraded_sections') or ()) or 'partial'}")
+        except Exception as e:
+            print(f"JobRunner: {claimed.name} #{claimed.id} failed (attempt {claimed.attempts}/{claimed.max_attempts}): {e}")
+            with get_engine().begin() as conn:
+                fail(conn, claimed, f"{type(e).__name__}: {e}")
+            return True
+        with get_engine().begin() as conn:
+            complete(conn, claimed, result)
+        print(f"JobRunner: {claimed.name} #{claimed.id} done in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _work(self, worker_id: str):
+        while not self._stop.is_set():
+            try:
+                if self.run_once(worker_id):
+                    continue
+            except Exception as e:
+                print(f"JobRunner[{worker_id}]: queue unavailable: {e}")
+                self._stop.wait(self.poll_seconds * 10)
+                continue
+            self._stop.wait(self.poll_seconds)
+
+    def _housekeeping(self):
+        scheduled = False
+        while not self._stop.is_set():
+            try:
+                with get_engine().begin() as conn:
+                    if not scheduled:
+                        for name, params, interval in self.schedules:
+                            ensure_job(conn, name, params, interval_seconds=interval)
+                        scheduled = True
+                    reap_stale(conn, self.lease_seconds)
+                    purge_finished(conn, 86400)
+            except Exception as e:
+                print(f"JobRunner: housekeeping failed: {e}")
+            self._stop.wait(60)
+
+
+def dashboard_params(period: str = 'day', days: int = 7, month: int | None = None, year: int | None = None) -> dict:
+    """Canonical job params for /api/dashboard/charts.
+
+    Every query string maps onto a small set of keys (each one a jobs row):
+    any period other than 'day' is 'month', ``days`` is rounded up to the
+    next DASHBOARD_DAYS value, and month/year are kept only when valid.
+    """
+    if period == 'day':
+        days = days if isinstance(days, int) and days >= 1 else 7
+        return {"period": "day", "days": next((d for d in DASHBOARD_DAYS if d >= days), DASHBOARD_DAYS[-1]), "month": None, "year": None}
+    this_year = datetime.now(timezone.utc).year
+    if isinstance(month, int) and isinstance(year, int) and 1 <= month <= 12 and 2000 <= year <= this_year:
+        return {"period": "month", "days": None, "month": month, "year": year}
+    return {"period": "month", "days": None, "month": None, "year": None}
+
+
+def compute_dashboard_charts_job(budget: DBBudget, params: dict) -> dict:
+    return load_dashboard_charts(budget, params.get('period', 'day'), params.get('days') or 7, params.get('month'), params.get('year'))
+
+
+@job('dashboard_charts')
+def run_dashboard_charts(params: dict) -> dict:
+    # Workers get the long budget; requests computing inline pass their own.
+    return compute_dashboard_charts_job(DBBudget('dashboard_job'), params)
+
+
+@job('client_metrics')
+def run_client_metrics(params: dict) -> dict:
+    db = DBSessionLocal()
+    try:
+        return {"updated": refresh_client_metrics(db, full=bool(params.get('full')))}
+    finally:
+        db.close()
+
+
+def default_schedules() -> tuple:
+    """Periodic jobs: the dashboard views in DASHBOARD_SCHEDULES and the client metrics refresh."""
+    snapshot = max(1, get_settings().DASHBOARD_SNAPSHOT_SECONDS)
+    schedules = []
+    for spec in (os.getenv("DASHBOARD_SCHEDULES") or "day:7,day:30,month").split(','):
+        period, _, days = spec.strip().partition(':')
+        if period:
+            params = dashboard_params(period, int(days) if days else 7)
+            schedules.append(('dashboard_charts', params, snapshot))
+    schedules.append(('client_metrics', {"full": False}, int(os.getenv("CLIENT_METRICS_REFRESH_SECONDS") or "600")))
+    return tuple(schedules)
+
+
+def runner_from_env() -> JobRunner:
+    return JobRunner(
+        workers=int(os.getenv("JOBS_WORKERS") or "2"),
+        poll_seconds=float(os.getenv("JOBS_POLL_SECONDS") or "1"),
+        lease_seconds=int(os.getenv("JOBS_LEASE_SECONDS") or "600"),
+        schedules=default_schedules(),
+    )
+
+
+def main():
+    runner = runner_from_env()
+    runner.start()
+    print(f"jobs: {runner.workers} workers running, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        runner.stop()
+
+
+if __name__ == '__main__':
+    main()
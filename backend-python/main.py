@@ -1,22 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, status, Response
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, status, Response
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Dict
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from datetime import datetime
-from database import DBSessionLocal, db_engine, load_whatsapp_messages, load_chat_history_by_session
+import psycopg2.errors
+from psycopg2 import sql
+from database import DBSessionLocal, connect_postgres, read_connection, dispose_engines, get_settings, load_whatsapp_messages, load_chat_history_by_session, load_n8n_sessions
+from database import chat_history_version, clientes_version, parse_message_fields
 import models
 from fastapi.middleware.cors import CORSMiddleware
+from responses import FastJSONResponse, dumps
+from compression import CompressionMiddleware
+from cache import get_cache
+from coalesce import coalescer, coalesce_key
+from profiling import ProfilingMiddleware, collapsed_stacks, get_profile_store
+from export import Export, ExportError, PYARROW_AVAILABLE
+from conditional import make_etag, is_not_modified, naive_utc, not_modified, validator_headers
+from budgets import DBBudget, BudgetExceeded, run_cancellable
+from jobs import compute_dashboard_charts_job, dashboard_params, job_key, precomputed, request_run, runner_from_env
+from analytics import AnalyticsError, conversation_buckets
+from client_metrics import client_metrics, refresh_client_metrics
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from ratelimit import get_login_limiter, client_ip
+import functools
 import os
 
+import anyio.to_thread
+
 PASSLIB_AVAILABLE = False
 pwd_context = None
 from jose import JWTError, jwt
 from datetime import timedelta
 
-models.DBBase.metadata.create_all(bind=db_engine)
+# Schema is managed by Alembic (`alembic upgrade head`); nothing touches the
+# database or reads .env at import time: settings, engines/pools and the app
+# itself are created on first use.
 
-app = FastAPI()
+router = APIRouter()
 
 
 class LoginRequest(BaseModel):
@@ -29,11 +52,6 @@ class UserResponse(BaseModel):
     area: str
 
 
-SECRET_KEY = os.getenv("SECRET_KEY") or "change-me-to-a-random-secret"
-ALGORITHM = os.getenv("JWT_ALGORITHM") or "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "60")
-
-
 def verify_password(plain_password, stored_value):
     if not stored_value:
         return False
@@ -56,9 +74,9 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + timedelta(minutes=get_settings().ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_settings().SECRET_KEY, algorithm=get_settings().JWT_ALGORITHM)
     return encoded_jwt
 
 
@@ -69,13 +87,36 @@ def create_refresh_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.utcnow() + timedelta(days=7)
     to_encode.update({"exp": expire, "type": "refresh"})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_settings().SECRET_KEY, algorithm=get_settings().JWT_ALGORITHM)
     return encoded_jwt
 
 
-def get_user_by_correo(correo: str):
-    from database import connect_postgres
-    from psycopg2 import sql
+# Only these fields go to the shared cache; credentials never leave the request.
+CACHED_USER_FIELDS = ("id", "nombre", "correo", "area")
+
+
+def _cacheable_user(user):
+    if user is None:
+        return None
+    return {k: user.get(k) for k in CACHED_USER_FIELDS}
+
+
+def get_user_by_correo(correo: str, fresh: bool = False):
+    """User by correo, shared across workers for USER_CACHE_SECONDS.
+
+    Cached users carry only CACHED_USER_FIELDS; ``fresh`` reads the full row
+    (with credentials) from the database.
+    """
+    key = (correo or '').strip().lower()
+    if not fresh:
+        return get_cache().get_or_set('users', key, lambda: _cacheable_user(_load_user_by_correo(correo)), get_settings().USER_CACHE_SECONDS)
+    user = _load_user_by_correo(correo)
+    if user is not None:
+        get_cache().set('users', key, _cacheable_user(user), get_settings().USER_CACHE_SECONDS)
+    return user
+
+
+def _load_user_by_correo(correo: str):
     conn = connect_postgres()
     cur = conn.cursor()
     print(f"connect_postgres: connection ok to {conn.dsn}")
@@ -168,7 +209,7 @@ def get_current_user(token: str = Depends(_extract_bearer_token)):
     if not token:
         raise credentials_exception
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, get_settings().SECRET_KEY, algorithms=[get_settings().JWT_ALGORITHM])
         correo: str = payload.get("sub")
         if correo is None:
             raise credentials_exception
@@ -179,17 +220,25 @@ def get_current_user(token: str = Depends(_extract_bearer_token)):
         raise credentials_exception
     return user
 
-@app.post("/api/auth/login")
-def login(request_data: LoginRequest, response: Response):
+@router.post("/api/auth/login")
+def login(request_data: LoginRequest, request: Request, response: Response):
     """Validate credentials, return access token and set refresh_token HttpOnly cookie."""
 
     debug_mode = os.getenv('DEBUG', '0') in ('1', 'true', 'True')
 
 
     correo_in = (request_data.correo or '').strip()
+    ip = client_ip(request)
+    limiter = get_login_limiter()
+    retry_after = limiter.check(ip, correo_in)
+    if retry_after:
+        # Rejected before any database work.
+        return JSONResponse(status_code=429, content={"detail": "Demasiados intentos de inicio de sesión, intente más tarde"}, headers={"Retry-After": str(retry_after)})
     print(f"login attempt for correo: {correo_in}")
-    user = get_user_by_correo(correo_in)
+    # Credentials are always checked against the database, never a cached row.
+    user = get_user_by_correo(correo_in, fresh=True)
     if not user:
+        limiter.record_failure(ip, correo_in)
         if debug_mode:
             return JSONResponse(status_code=401, content={"detail": "Correo o contraseña inválidos", "debug": "user_not_found"})
         raise HTTPException(status_code=401, detail="Correo o contraseña inválidos")
@@ -212,12 +261,14 @@ def login(request_data: LoginRequest, response: Response):
             ok = True
 
     if not ok:
+        limiter.record_failure(ip, correo_in)
 
         if debug_mode:
             return JSONResponse(status_code=401, content={"detail": "Correo o contraseña inválidos", "debug": {"provided": provided_pw, "stored_plain": stored_plain}})
         raise HTTPException(status_code=401, detail="Correo o contraseña inválidos")
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    limiter.record_success(ip, correo_in)
+    access_token_expires = timedelta(minutes=get_settings().ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.get("correo"), "area": user.get("area"), "user_id": user.get("id")},
         expires_delta=access_token_expires,
@@ -246,14 +297,6 @@ def login(request_data: LoginRequest, response: Response):
     resp = {"access_token": access_token, "token_type": "bearer", "user": {"nombre": user.get("nombre"), "correo": user.get("correo"), "area": user.get("area")}, "refresh_token": refresh_token}
     return resp
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"], 
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 def get_db():
     db = DBSessionLocal()
     try:
@@ -278,6 +321,22 @@ class ClienteResponse(ClienteBase):
     tasa_conversion: float
     satisfaccion: float
     fecha_registro: datetime
+    mensajes_total: Optional[int] = None
+    conversaciones_total: Optional[int] = None
+    tiempo_respuesta_promedio: Optional[float] = None
+    ultima_actividad: Optional[datetime] = None
+
+class ClienteMetricsResponse(BaseModel):
+    cliente_id: int
+    conversaciones_total: int
+    conversaciones_resueltas: int
+    tasa_conversion: float
+    mensajes_total: int
+    mensajes_cliente: int
+    mensajes_agente: int
+    tiempo_respuesta_promedio: Optional[float] = None
+    ultima_actividad: Optional[datetime] = None
+    actualizado: Optional[datetime] = None
 
 class DashboardStats(BaseModel):
     conversaciones_total: int
@@ -286,12 +345,22 @@ class DashboardStats(BaseModel):
     satisfaccion_avg: float
 
 
-@app.get("/api/dashboard/stats")
-def get_dashboard_stats(limit: int = 10, current_user: dict = Depends(get_current_user)):
+@router.get("/api/dashboard/stats")
+def get_dashboard_stats(request: Request, limit: int = 10, current_user: dict = Depends(get_current_user)):
     user_area = (current_user.get("area") or "").upper()
     if user_area not in ("TI", "ADMIN", "COMERCIAL"):
         raise HTTPException(status_code=403, detail="No autorizado para ver el dashboard")
 
+    try:
+        total_version, last_registro = clientes_version()
+        last_registro = naive_utc(last_registro)
+        etag = make_etag('stats', limit, total_version, last_registro)
+    except Exception as e:
+        print(f"get_dashboard_stats: validator query failed: {e}")
+        etag, last_registro = None, None
+    if etag and is_not_modified(request, etag, last_registro):
+        return not_modified(etag, last_registro)
+
     session = DBSessionLocal()
     try:
         try:
@@ -307,254 +376,156 @@ def get_dashboard_stats(limit: int = 10, current_user: dict = Depends(get_curren
         except Exception:
             recent = []
 
-        return {"total_clients": total_clients, "recent_clients": recent}
+        resp = FastJSONResponse({"total_clients": total_clients, "recent_clients": recent})
+        if etag:
+            resp.headers.update(validator_headers(etag, last_registro))
+        return resp
     finally:
         session.close()
 
 
-@app.get("/api/dashboard/charts")
-def get_dashboard_charts(period: str = 'day', days: int = 7, month: int | None = None, year: int | None = None, current_user: dict = Depends(get_current_user)):
+def _cached_dashboard_charts(params: dict, max_age: int, compute, wait_seconds: float) -> tuple:
+    """precomputed() behind the shared cache: one replica read per key and max_age/10, single-flight across workers."""
+    def load():
+        resp, computed_at = precomputed('dashboard_charts', params, max_age, compute, wait_seconds)
+        return {"resp": resp, "computed_at": computed_at.isoformat() if computed_at is not None else None}
+    # Degraded inline results (no computed_at) are not cached.
+    entry = get_cache().get_or_set('dashboard', job_key('dashboard_charts', params), load, max(1, max_age // 10),
+                                   cacheable=lambda value: value["computed_at"] is not None)
+    computed_at = entry["computed_at"]
+    return entry["resp"], datetime.fromisoformat(computed_at) if computed_at is not None else None
+
+
+@router.get("/api/dashboard/charts")
+async def get_dashboard_charts(request: Request, period: str = 'day', days: int = 7, month: int | None = None, year: int | None = None, current_user: dict = Depends(get_current_user)):
+    """Latest precomputed charts payload; the aggregation runs as a background job (inline the first time)."""
     user_area = (current_user.get("area") or "").upper()
     if user_area not in ("TI", "ADMIN", "COMERCIAL"):
         raise HTTPException(status_code=403, detail="No autorizado para ver el dashboard")
 
-    from database import connect_postgres
-    import psycopg2.extras
-    import json
-
-    conn = None
-    try:
-        conn = connect_postgres()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        cur.execute("SELECT COUNT(*) AS total_clients FROM public.clientes")
-        total_clients = int(cur.fetchone().get('total_clients') or 0)
-
-        cur.execute("SELECT COUNT(*) AS active_clients FROM public.clientes WHERE LOWER(estado) <> 'cerrado'")
-        active_clients = int(cur.fetchone().get('active_clients') or 0)
-
-        cur.execute("SELECT COUNT(*) AS new_today FROM public.clientes WHERE fecha_registro >= current_date")
-        new_today = int(cur.fetchone().get('new_today') or 0)
-
-        cur.execute("SELECT COALESCE(SUM(monto),0) AS ingresos_30d FROM public.pagos WHERE fecha_pago >= now() - interval '30 days'")
-        ingresos_30d = float(cur.fetchone().get('ingresos_30d') or 0)
-
-        cur.execute("SELECT COUNT(*) AS ofertas_abiertas FROM public.ofertas WHERE estado = 'ABIERTA'")
-        ofertas_abiertas = int(cur.fetchone().get('ofertas_abiertas') or 0)
-
-        conversations_by_day = []
-        conversations_by_month = []
-
-        ts_col = 'timestamp'
+    params = dashboard_params(period, days, month, year)
+    max_age = max(1, get_settings().DASHBOARD_SNAPSHOT_SECONDS)
+    budget = DBBudget('dashboard_charts')
+    compute = functools.partial(compute_dashboard_charts_job, budget)
+    resp, computed_at = await run_cancellable(request, budget, _cached_dashboard_charts, params, max_age, compute, budget.ms / 1000.0)
+
+    etag = make_etag('charts', job_key('dashboard_charts', params), computed_at)
+    # computed_at is None for a degraded inline result, which has no validators.
+    if computed_at is not None and is_not_modified(request, etag, computed_at):
+        return not_modified(etag, computed_at)
+    response = FastJSONResponse(resp)
+    # Partial (degraded) payloads must not be revalidated as if they were complete.
+    if computed_at is not None and not resp.get('degraded'):
+        response.headers.update(validator_headers(etag, computed_at))
+    return response
+
+def _load_conversation_analytics(budget: DBBudget, start: datetime, end: datetime, granularity: str, tz: str) -> dict:
+    with read_connection(autocommit=False) as conn:
+        budget.attach(conn)
+        cur = conn.cursor()
         try:
-            cur.execute("""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_schema = 'bot' AND table_name = 'whatsapp' AND column_name IN ('timestamp','fecha_hora')
-            """)
-            found = [r.get('column_name') for r in cur.fetchall()]
-            if 'timestamp' in found:
-                ts_col = 'timestamp'
-            elif 'fecha_hora' in found:
-                ts_col = 'fecha_hora'
-        except Exception:
-            ts_col = 'timestamp'
-
-        if period == 'day':
-            try:
-                days_int = int(days) if isinstance(days, int) else 7
-                if days_int < 1:
-                    days_int = 7
-                sql = f"""
-                    SELECT to_char({ts_col}::date, 'YYYY-MM-DD') AS day, COUNT(*) AS count
-                    FROM bot.whatsapp
-                    WHERE {ts_col} >= now() - interval '{days_int} days'
-                    GROUP BY day ORDER BY day
-                """
-                cur.execute(sql)
-                conv_rows = cur.fetchall()
-                conversations_by_day = [{ 'day': r['day'], 'count': int(r['count']) } for r in conv_rows]
-            except Exception:
-                conversations_by_day = []
-        else:
-            try:
-                if isinstance(month, int) and isinstance(year, int) and 1 <= month <= 12:
-                    from datetime import date
-                    start = date(year, month, 1)
-                    if month == 12:
-                        end = date(year + 1, 1, 1)
-                    else:
-                        end = date(year, month + 1, 1)
-
-                    sql = f"""
-                        SELECT to_char({ts_col}::date, 'YYYY-MM') AS month, COUNT(*) AS count
-                        FROM bot.whatsapp
-                        WHERE {ts_col} >= %s AND {ts_col} < %s
-                        GROUP BY month ORDER BY month
-                    """
-                    cur.execute(sql, (start, end))
-                    conv_rows = cur.fetchall()
-                    conversations_by_month = [{ 'month': r['month'], 'count': int(r['count']) } for r in conv_rows]
-
-                    try:
-                        cur.execute(f"SELECT COUNT(*) AS cnt FROM bot.whatsapp WHERE {ts_col} >= %s AND {ts_col} < %s", (start, end))
-                        conversations_by_month_total = int(cur.fetchone().get('cnt') or 0)
-                        conversations_total = conversations_by_month_total
-                    except Exception:
-                        pass
-                else:
-                    sql = f"""
-                        SELECT to_char({ts_col}::date, 'YYYY-MM') AS month, COUNT(*) AS count
-                        FROM bot.whatsapp
-                        WHERE {ts_col} >= (date_trunc('month', current_date) - interval '11 months')
-                        GROUP BY month ORDER BY month
-                    """
-                    cur.execute(sql)
-                    conv_rows = cur.fetchall()
-                    conversations_by_month = [{ 'month': r['month'], 'count': int(r['count']) } for r in conv_rows]
-            except Exception:
-                conversations_by_month = []
+            budget.apply(cur)
+            return conversation_buckets(cur, start, end, granularity, tz)
+        finally:
+            budget.attach(None)
+            cur.close()
 
-        try:
-            order_col = ts_col if ts_col else 'timestamp'
-            cur.execute(f"SELECT message FROM bot.whatsapp ORDER BY {order_col} DESC LIMIT 1000")
-            msgs = [r.get('message') for r in cur.fetchall()]
-        except Exception:
-            msgs = []
-
-        pos_k = ['gracias', 'excelente', 'bien', 'perfecto', 'genial', 'feliz', 'bueno', 'ok', 'okey']
-        neg_k = ['malo', 'problema', 'error', 'no funciona', 'mal', 'falla', 'reclamo', 'insatisfecho']
-        counts = {'Positivo': 0, 'Negativo': 0, 'Neutral': 0}
-        for m in msgs:
-            text = ''
-            if isinstance(m, str):
-                text = m.lower()
-            else:
-                try:
-                    text = json.dumps(m).lower()
-                except Exception:
-                    text = str(m).lower()
-            if any(k in text for k in pos_k):
-                counts['Positivo'] += 1
-            elif any(k in text for k in neg_k):
-                counts['Negativo'] += 1
-            else:
-                counts['Neutral'] += 1
-
-        total_msgs = max(1, counts['Positivo'] + counts['Negativo'] + counts['Neutral'])
-        sentiment_breakdown = [
-            { 'name': 'Positivo', 'value': round(counts['Positivo'] * 100.0 / total_msgs, 1) },
-            { 'name': 'Negativo', 'value': round(counts['Negativo'] * 100.0 / total_msgs, 1) },
-            { 'name': 'Neutral',  'value': round(counts['Neutral']  * 100.0 / total_msgs, 1) },
-        ]
 
-        try:
-            sum_vals = sum([s.get('value', 0) for s in sentiment_breakdown])
-            if sum_vals <= 0.1:
-                cliente_counts = {'Positivo': 0, 'Negativo': 0, 'Neutral': 0}
-                try:
-                    cur.execute("SELECT estado, COUNT(*) AS cnt FROM public.clientes GROUP BY estado")
-                    rows = cur.fetchall()
-                    for r in rows:
-                        estado = (r.get('estado') or '').lower() if isinstance(r.get('estado'), str) else ''
-                        cnt = int(r.get('cnt') or 0)
-                        if any(k in estado for k in ['cerrado', 'perdido', 'rechazado', 'cancelado']):
-                            cliente_counts['Negativo'] += cnt
-                        elif any(k in estado for k in ['activo', 'abierto', 'abierta', 'contactado', 'prospecto', 'interesado']):
-                            cliente_counts['Positivo'] += cnt
-                        else:
-                            cliente_counts['Neutral'] += cnt
-                except Exception:
-                    cliente_counts = cliente_counts
-
-                total_c = max(1, cliente_counts['Positivo'] + cliente_counts['Negativo'] + cliente_counts['Neutral'])
-                sentiment_breakdown = [
-                    { 'name': 'Positivo', 'value': round(cliente_counts['Positivo'] * 100.0 / total_c, 1) },
-                    { 'name': 'Negativo', 'value': round(cliente_counts['Negativo'] * 100.0 / total_c, 1) },
-                    { 'name': 'Neutral',  'value': round(cliente_counts['Neutral']  * 100.0 / total_c, 1) },
-                ]
-                try:
-                    resp_counts = cliente_counts
-                except Exception:
-                    resp_counts = None
-            else:
-                resp_counts = None
-        except Exception:
-            resp_counts = None
+@router.get("/api/analytics/conversations")
+async def get_conversation_analytics(request: Request, start: datetime = Query(alias="from"), end: datetime = Query(alias="to"), granularity: str = 'day', tz: str = 'UTC', current_user: dict = Depends(get_current_user)):
+    """Message counts per hour/day/week/month bucket (zero-filled) in the given time zone.
 
-        try:
-            cur.execute("SELECT COUNT(*) AS total_convs FROM public.n8n_chat_histories")
-            conversations_total = int(cur.fetchone().get('total_convs') or 0)
-        except Exception:
-            try:
-                cur.execute("SELECT COUNT(*) AS total_convs FROM bot.whatsapp")
-                conversations_total = int(cur.fetchone().get('total_convs') or 0)
-            except Exception:
-                conversations_total = 0
-
-        resp = {
-            'total_clients': total_clients,
-            'active_clients': active_clients,
-            'new_today': new_today,
-            'ingresos_30d': ingresos_30d,
-            'ofertas_abiertas': ofertas_abiertas,
-            'conversations_total': conversations_total,
-            'conversations_by_day': conversations_by_day,
-            'conversations_by_month': conversations_by_month,
-            'sentiment_breakdown': sentiment_breakdown,
-        }
-
-        try:
-            cur.execute("SELECT estado, COUNT(*) as cnt FROM public.clientes GROUP BY estado")
-            rows = cur.fetchall()
-            estado_counts = {'Nuevo': 0, 'En gestión': 0, 'Cliente': 0, 'Otros': 0}
-            for r in rows:
-                est = (r.get('estado') or '').strip()
-                est_l = est.lower()
-                cnt = int(r.get('cnt') or 0)
-                if 'nuevo' in est_l:
-                    estado_counts['Nuevo'] += cnt
-                elif 'gest' in est_l or 'gestion' in est_l or 'gestión' in est_l:
-                    estado_counts['En gestión'] += cnt
-                elif 'cliente' in est_l or 'cliente' == est_l:
-                    estado_counts['Cliente'] += cnt
-                else:
-                    estado_counts['Otros'] += cnt
-
-            total_est = max(1, estado_counts['Nuevo'] + estado_counts['En gestión'] + estado_counts['Cliente'] + estado_counts['Otros'])
-            status_breakdown = [
-                {'name': 'Nuevo', 'value': round(estado_counts['Nuevo'] * 100.0 / total_est, 1)},
-                {'name': 'En gestión', 'value': round(estado_counts['En gestión'] * 100.0 / total_est, 1)},
-                {'name': 'Cliente', 'value': round(estado_counts['Cliente'] * 100.0 / total_est, 1)},
-                {'name': 'Otros', 'value': round(estado_counts['Otros'] * 100.0 / total_est, 1)},
-            ]
-            resp['status_breakdown'] = status_breakdown
-            resp['status_counts'] = estado_counts
-        except Exception:
-            pass
-
-        cur.close()
-        return resp
-    finally:
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+    Naive ``from``/``to`` values are local times in ``tz``. If bot.whatsapp stores
+    ``timestamp without time zone``, its values are read as WHATSAPP_TIMESTAMP_TZ (UTC by default).
+    """
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN", "COMERCIAL"):
+        raise HTTPException(status_code=403, detail="No autorizado para ver el dashboard")
 
-@app.get("/api/clientes", response_model=List[ClienteResponse])
-def get_clientes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    clientes = db.query(models.Cliente).offset(skip).limit(limit).all()
+    budget = DBBudget('analytics')
+    try:
+        result = await run_cancellable(request, budget, _load_conversation_analytics, budget, start, end, granularity, tz)
+    except AnalyticsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (BudgetExceeded, psycopg2.errors.QueryCanceled):
+        raise HTTPException(status_code=503, detail="La consulta excedió el tiempo límite")
+    return FastJSONResponse(result)
+
+
+@router.get("/api/export/{source}")
+async def export_table(source: str, format: str = 'parquet', start: Optional[datetime] = Query(None, alias="from"), end: Optional[datetime] = Query(None, alias="to"),
+                       since: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Stream whatsapp / n8n_chat_histories / clientes as Parquet or Arrow IPC.
+
+    X-Export-Watermark (an id) feeds the next ``since``. Incremental exports
+    overlap by EXPORT_WATERMARK_LAG ids to pick up late commits; dedupe on ``id``.
+    """
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN", "COMERCIAL"):
+        raise HTTPException(status_code=403, detail="No autorizado para exportar datos")
+    if not PYARROW_AVAILABLE:
+        raise HTTPException(status_code=501, detail="Exportación no disponible: falta el paquete pyarrow")
+    try:
+        export = await run_in_threadpool(Export, source, format, start, end, since)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"Content-Disposition": f'attachment; filename="{source}.{format}"'}
+    if export.watermark is not None:
+        headers["X-Export-Watermark"] = str(export.watermark)
+    # chunks() closes the export when streamed to the end; the task covers a response that never starts.
+    return StreamingResponse(export.chunks(), media_type=export.media_type, headers=headers, background=BackgroundTask(export.close))
+
+
+CLIENTE_SORT_COLUMNS = {
+    "id": models.Cliente.id,
+    "nombre": models.Cliente.nombre,
+    "fecha_registro": models.Cliente.fecha_registro,
+    "tasa_conversion": models.Cliente.tasa_conversion,
+    "mensajes_total": models.ClienteMetricas.mensajes_total,
+    "conversaciones_total": models.ClienteMetricas.conversaciones_total,
+    "tiempo_respuesta_promedio": models.ClienteMetricas.tiempo_respuesta_promedio,
+    "ultima_actividad": models.ClienteMetricas.ultima_actividad,
+}
+
+
+@router.get("/api/clientes", response_model=List[ClienteResponse])
+def get_clientes(skip: int = 0, limit: int = 100, sort: Optional[str] = None, order: str = 'desc', db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    query = db.query(models.Cliente, models.ClienteMetricas).outerjoin(models.ClienteMetricas, models.ClienteMetricas.cliente_id == models.Cliente.id)
+    if sort:
+        column = CLIENTE_SORT_COLUMNS.get(sort)
+        if column is None:
+            raise HTTPException(status_code=400, detail=f"sort debe ser uno de: {', '.join(CLIENTE_SORT_COLUMNS)}")
+        ordering = column.asc() if order.lower() == 'asc' else column.desc()
+        query = query.order_by(ordering.nulls_last(), models.Cliente.id)
+    clientes = []
+    for cliente, metricas in query.offset(skip).limit(limit).all():
+        item = ClienteResponse.model_validate(cliente)
+        if metricas is not None:
+            item = item.model_copy(update={
+                "mensajes_total": metricas.mensajes_total,
+                "conversaciones_total": metricas.conversaciones_total,
+                "tiempo_respuesta_promedio": metricas.tiempo_respuesta_promedio,
+                "ultima_actividad": metricas.ultima_actividad,
+            })
+        clientes.append(item)
     return clientes
 
-@app.post("/api/clientes", response_model=ClienteResponse)
+@router.post("/api/clientes", response_model=ClienteResponse)
 def create_cliente(cliente: ClienteCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     db_cliente = models.Cliente(**cliente.dict())
     db.add(db_cliente)
     db.commit()
     db.refresh(db_cliente)
+    try:
+        request_run(db, name='dashboard_charts')
+        db.commit()
+    except Exception as e:
+        # The cliente is already saved; the charts catch up on their next scheduled run.
+        db.rollback()
+        print(f"create_cliente: could not re-queue dashboard_charts: {e}")
     return db_cliente
 
-@app.get("/api/clientes/{cliente_id}", response_model=ClienteResponse)
+@router.get("/api/clientes/{cliente_id}", response_model=ClienteResponse)
 def get_cliente(cliente_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
     cliente = db.query(models.Cliente).filter(models.Cliente.id == cliente_id).first()
     if cliente is None:
@@ -562,64 +533,84 @@ def get_cliente(cliente_id: int, db: Session = Depends(get_db), current_user: di
     return cliente
 
 
-@app.get("/api/whatsapp")
+@router.get("/api/clientes/{cliente_id}/metrics", response_model=ClienteMetricsResponse)
+def get_cliente_metrics(cliente_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    metrics = client_metrics(db, cliente_id)
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return metrics
+
+
+@router.post("/api/clientes/metrics/refresh")
+def refresh_clientes_metrics(full: bool = False, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN"):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return {"updated": refresh_client_metrics(db, full=full)}
+
+
+@router.get("/api/whatsapp")
 def get_whatsapp(limit: int = 100, current_user: dict = Depends(get_current_user)):
     """Return rows from bot.whatsapp as a list of dicts."""
-    return load_whatsapp_messages(limit=limit)
+    return FastJSONResponse(load_whatsapp_messages(limit=limit))
 
 
-@app.get("/api/chats/{session_id}")
-def get_chat_history(session_id: str, limit: int = 100, current_user: dict = Depends(get_current_user)):
-    """Return chat history rows for a given session_id from n8n_chat_histories."""
-    return load_chat_history_by_session(session_id=session_id, limit=limit)
+def _chat_history_body(budget: DBBudget, session_id: str, limit: int, fields: tuple | None, preview_chars: int | None) -> bytes:
+    return dumps(load_chat_history_by_session(session_id, limit, budget, fields, preview_chars))
 
 
-@app.get("/api/n8n_chats")
-def list_n8n_sessions(limit: int = 200, current_user: dict = Depends(get_current_user)):
-    from database import connect_postgres
-    import json
-    conn = None
+def _n8n_sessions_body(budget: DBBudget, limit: int, fields: tuple | None, preview_chars: int | None) -> bytes:
+    return dumps(load_n8n_sessions(limit, budget, fields, preview_chars))
+
+
+def _message_projection_args(fields: Optional[str]) -> tuple | None:
     try:
-        conn = connect_postgres()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT t.session_id, t.id AS last_id, t.message
-            FROM public.n8n_chat_histories t
-            WHERE t.id IN (
-                SELECT MAX(id) FROM public.n8n_chat_histories GROUP BY session_id
-            )
-            ORDER BY last_id DESC
-            LIMIT %s
-        """, (limit,))
-        rows = cur.fetchall()
-        sessions = []
-        for r in rows:
-            sid = r[0]
-            last_id = r[1]
-            msg = r[2]
-            last_msg = msg
-            if isinstance(msg, str):
-                try:
-                    last_msg = json.loads(msg)
-                except Exception:
-                    last_msg = msg
-
-            cur2 = conn.cursor()
-            cur2.execute("SELECT COUNT(*) FROM public.n8n_chat_histories WHERE session_id = %s", (sid,))
-            cnt = cur2.fetchone()[0]
-            cur2.close()
-            sessions.append({"session_id": sid, "last_id": last_id, "last_message": last_msg, "count": cnt})
-        cur.close()
-        return sessions
-    finally:
-        try:
-            if conn:
-                conn.close()
-        except Exception:
-            pass
+        return parse_message_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post('/api/auth/refresh')
+@router.get("/api/chats/{session_id}")
+async def get_chat_history(session_id: str, request: Request, limit: int = 100, fields: Optional[str] = None, preview_chars: Optional[int] = Query(None, ge=0, le=100000),
+                           current_user: dict = Depends(get_current_user)):
+    """Return chat history rows for a given session_id from n8n_chat_histories.
+
+    ``fields=type,content`` and ``preview_chars=N`` return only those message keys, truncated in the database.
+    """
+    projection = _message_projection_args(fields)
+    try:
+        max_id, count = await run_in_threadpool(chat_history_version, session_id)
+        etag = make_etag('chat', session_id, limit, projection, preview_chars, max_id, count)
+    except Exception as e:
+        print(f"get_chat_history: validator query failed: {e}")
+        etag = None
+    if etag and is_not_modified(request, etag):
+        return not_modified(etag)
+    # Concurrent viewers of the same session version share one query and body.
+    key = coalesce_key(request, (current_user.get("area") or "").upper()) + (etag,)
+    try:
+        body = await coalescer.run(key, request, 'chat_history', _chat_history_body, session_id, limit, projection, preview_chars)
+    except (BudgetExceeded, psycopg2.errors.QueryCanceled):
+        raise HTTPException(status_code=503, detail="La consulta excedió el tiempo límite")
+    resp = Response(content=body, media_type="application/json")
+    if etag:
+        resp.headers.update(validator_headers(etag))
+    return resp
+
+
+@router.get("/api/n8n_chats")
+async def list_n8n_sessions(request: Request, limit: int = 200, fields: Optional[str] = None, preview_chars: Optional[int] = Query(None, ge=0, le=100000),
+                            current_user: dict = Depends(get_current_user)):
+    projection = _message_projection_args(fields)
+    key = coalesce_key(request, (current_user.get("area") or "").upper())
+    try:
+        body = await coalescer.run(key, request, 'n8n_chats', _n8n_sessions_body, limit, projection, preview_chars)
+    except (BudgetExceeded, psycopg2.errors.QueryCanceled):
+        raise HTTPException(status_code=503, detail="La consulta excedió el tiempo límite")
+    return Response(content=body, media_type="application/json")
+
+
+@router.post('/api/auth/refresh')
 async def refresh_token(request: Request):
     token = request.cookies.get('refresh_token')
     if not token:
@@ -663,7 +654,7 @@ async def refresh_token(request: Request):
         pass
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, get_settings().SECRET_KEY, algorithms=[get_settings().JWT_ALGORITHM])
         if payload.get('type') != 'refresh' and payload.get('type') is not None:
             print('refresh_token: token present but invalid type', payload.get('type'))
             raise HTTPException(status_code=401, detail='Invalid token type')
@@ -676,7 +667,7 @@ async def refresh_token(request: Request):
     if not user:
         raise HTTPException(status_code=401, detail='User not found')
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token_expires = timedelta(minutes=get_settings().ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.get("correo"), "area": user.get("area"), "user_id": user.get("id")},
         expires_delta=access_token_expires,
@@ -684,7 +675,7 @@ async def refresh_token(request: Request):
     return {"access_token": access_token, "token_type": "bearer", "user": {"nombre": user.get("nombre"), "correo": user.get("correo"), "area": user.get("area")}}
 
 
-@app.post('/api/auth/logout')
+@router.post('/api/auth/logout')
 def logout(response: Response):
 
     response.delete_cookie('refresh_token', path='/')
@@ -692,28 +683,101 @@ def logout(response: Response):
 
 
 
-@app.get('/api/debug/dbinfo')
+@router.get('/api/debug/dbinfo')
 def debug_dbinfo():
-    from database import db_username, db_password, db_host, db_port, db_name, DATABASE_URL
-    masked = DATABASE_URL
+    settings = get_settings()
+    masked = settings.DATABASE_URL
     try:
 
-        if db_password:
-            masked = masked.replace(db_password, '***')
+        if settings.db_password:
+            masked = masked.replace(settings.db_password, '***')
     except Exception:
         pass
-    return {"db_user": db_username, "db_host": db_host, "db_port": db_port, "db_name": db_name, "database_url": masked}
+    return {"db_user": settings.db_username, "db_host": settings.db_host, "db_port": settings.db_port, "db_name": settings.db_name, "database_url": masked}
+
 
+@router.get('/api/debug/coalescing')
+def debug_coalescing(current_user: dict = Depends(get_current_user)):
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN"):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return coalescer.stats()
 
-@app.get('/api/debug/user')
+
+@router.get('/api/debug/profiles')
+def debug_profiles(current_user: dict = Depends(get_current_user)):
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN"):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return get_profile_store().summaries()
+
+
+@router.get('/api/debug/profiles/{capture_id}')
+def debug_profile(capture_id: int, format: str = 'json', current_user: dict = Depends(get_current_user)):
+    """One capture as JSON, or its sampled stacks in collapsed format (format=collapsed)."""
+    user_area = (current_user.get("area") or "").upper()
+    if user_area not in ("TI", "ADMIN"):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    trace = get_profile_store().get(capture_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Captura no encontrada")
+    filename = f"profile-{capture_id}"
+    if format == 'collapsed':
+        return Response(content=collapsed_stacks(trace.stacks), media_type="text/plain", headers={"Content-Disposition": f'attachment; filename="{filename}.txt"'})
+    return FastJSONResponse(trace.to_dict(), headers={"Content-Disposition": f'attachment; filename="{filename}.json"'})
+
+
+@router.get('/api/debug/user')
 def debug_user(correo: str):
-    user = get_user_by_correo(correo)
+    user = get_user_by_correo(correo, fresh=True)
     if not user:
         return {"found": False}
 
     return {"found": True, "id": user.get("id"), "nombre": user.get("nombre"), "correo": user.get("correo"), "password_hash": user.get("password_hash"), "contrasena": user.get("contrasena"), "area": user.get("area")}
 
 
-@app.post("/api/auth/microsoft")
+@router.post("/api/auth/microsoft")
 def microsoft_auth(token: str):
-    return {"status": "success", "user": "user@example.com"}
\ No newline at end of file
+    return {"status": "success", "user": "user@example.com"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync handlers run in this threadpool; the DB pools are sized from the same setting.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = get_settings().THREADPOOL_SIZE
+    runner = runner_from_env() if int(os.getenv("JOBS_WORKERS") or "2") > 0 else None
+    if runner:
+        runner.start()
+    yield
+    if runner:
+        runner.stop()
+    dispose_engines()
+
+
+def create_app() -> FastAPI:
+    get_settings()  # loads .env before the middleware settings below are read
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"], 
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE") or "1024"))
+    app.add_middleware(ProfilingMiddleware, store=get_profile_store(), token=os.getenv("PROFILING_TOKEN") or None)
+    app.include_router(router)
+    return app
+
+
+_app = None
+
+
+def __getattr__(name):
+    # `uvicorn main:app` resolves the attribute, building the app on first access.
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
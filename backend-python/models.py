@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Float, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Float, Enum, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import DBBase
 from datetime import datetime
@@ -57,4 +58,41 @@ class Mensaje(DBBase):
     es_del_cliente = Column(Boolean, default=True)
     fecha_envio = Column(DateTime, default=datetime.utcnow)
     
-    conversacion = relationship("Conversacion", back_populates="mensajes")
\ No newline at end of file
+    conversacion = relationship("Conversacion", back_populates="mensajes")
+
+class ClienteMetricas(DBBase):
+    """Per-client aggregates over Conversacion/Mensaje, maintained by client_metrics.py."""
+    __tablename__ = "cliente_metricas"
+
+    cliente_id = Column(Integer, ForeignKey("clientes.id"), primary_key=True)
+    conversaciones_total = Column(Integer, default=0)
+    conversaciones_resueltas = Column(Integer, default=0)
+    mensajes_total = Column(Integer, default=0)
+    mensajes_cliente = Column(Integer, default=0)
+    mensajes_agente = Column(Integer, default=0)
+    tiempo_respuesta_promedio = Column(Float, nullable=True) # seconds, agent reply after a client message
+    ultima_actividad = Column(DateTime, nullable=True)
+    ultimo_mensaje_id = Column(Integer, default=0) # watermark for incremental refresh
+    actualizado = Column(DateTime, default=datetime.utcnow)
+
+class Job(DBBase):
+    """Background job and its latest result; one row per key, see jobs.py."""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, nullable=False) # name + canonical JSON params
+    name = Column(String, nullable=False)
+    params = Column(JSONB, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="pending") # pending, running, done, failed
+    run_at = Column(DateTime(timezone=True), nullable=False)
+    interval_seconds = Column(Integer, nullable=True) # periodic jobs re-arm after each run
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    result = Column(JSONB, nullable=True)
+    result_at = Column(DateTime(timezone=True), nullable=True)
+    error = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
@@ -0,0 +1,271 @@
+"""Monthly range partitions for bot.whatsapp and public.n8n_chat_histories.
+
+    python partitions.py ensure [--months-ahead 3]            # pre-create future partitions
+    python partitions.py archive --keep-months 12 [--compress] # detach old partitions into the archive schema
+                                 [--include-undated]
+    python partitions.py explain                               # partitions touched by the hot queries
+
+The tables are converted by the Alembic migration 0004_partition_messages.
+n8n_chat_histories rows older than that migration have no timestamp; they
+live in ``n8n_chat_histories_undated`` and are only archived on request.
+"""
+import argparse
+import json
+import re
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+from database import N8N_RECENT_WINDOW_DAYS, get_engine, n8n_sessions_sql
+
+
+ARCHIVE_SCHEMA = 'archive'
+
+
+class PartitionedTable:
+    """A table partitioned by month on ``key``.
+
+    ``key=None`` means the column is discovered at runtime (bot.whatsapp has
+    either ``timestamp`` or ``fecha_hora``).
+    """
+
+    def __init__(self, schema: str, name: str, key: str | None):
+        self.schema = schema
+        self.name = name
+        self.key = key
+
+    @property
+    def qualified(self) -> str:
+        return f'{self.schema}."{self.name}"'
+
+
+WHATSAPP = PartitionedTable('bot', 'whatsapp', None)
+N8N_CHAT_HISTORIES = PartitionedTable('public', 'n8n_chat_histories', 'created_at')
+TABLES = {t.name: t for t in (WHATSAPP, N8N_CHAT_HISTORIES)}
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: PartitionedTable, month: date) -> str:
+    return f"{table.name}_p{month:%Y%m}"
+
+
+def undated_name(table: PartitionedTable) -> str:
+    return f"{table.name}_undated"
+
+
+# DDL built with these literals goes through exec_driver_sql(): text() would
+# read the ':' of '00:00:00' as bind parameters.
+def bound_literal(month: date, tz_aware: bool) -> str:
+    return f"'{month:%Y-%m-%d} 00:00:00{'+00' if tz_aware else ''}'"
+
+
+_UPPER_BOUND = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+
+
+def upper_bound(bound_expr: str) -> date | None:
+    """Upper bound month of a ``pg_get_expr(relpartbound)`` string; None for DEFAULT."""
+    match = _UPPER_BOUND.search(bound_expr or '')
+    return date.fromisoformat(match.group(1)) if match else None
+
+
+def _utc_naive(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+def table_exists(conn, table: PartitionedTable) -> bool:
+    return conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": table.qualified}).scalar()
+
+
+def is_partitioned(conn, table: PartitionedTable) -> bool:
+    return conn.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table.qualified}).scalar() or False
+
+
+def resolve_key(conn, table: PartitionedTable) -> tuple:
+    """(key column, whether it is timestamptz); None column if it is missing."""
+    rows = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = :s AND table_name = :n
+    """), {"s": table.schema, "n": table.name}).all()
+    types = {name: data_type for name, data_type in rows}
+    candidates = (table.key,) if table.key else ('timestamp', 'fecha_hora')
+    for column in candidates:
+        if column in types:
+            return column, types[column] == 'timestamp with time zone'
+    return None, False
+
+
+def list_partitions(conn, table: PartitionedTable) -> list:
+    """[(schema, name, upper bound month or None for DEFAULT)] of the attached partitions."""
+    rows = conn.execute(text("""
+        SELECT n.nspname, c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE i.inhparent = to_regclass(:t)
+        ORDER BY c.relname
+    """), {"t": table.qualified}).all()
+    return [(schema, name, upper_bound(bound)) for schema, name, bound in rows]
+
+
+def ensure_partitions(conn, table: PartitionedTable, months_ahead: int = 3, now: datetime | None = None) -> list:
+    """Create monthly partitions up to ``months_ahead`` past the current month, plus DEFAULT."""
+    if not is_partitioned(conn, table):
+        return []
+    key, tz_aware = resolve_key(conn, table)
+    now = _utc_naive(now or datetime.now(timezone.utc))
+    partitions = list_partitions(conn, table)
+    bounds = [upper for _, _, upper in partitions if upper is not None]
+    month = max(bounds) if bounds else month_start(now)
+    last = add_months(month_start(now), months_ahead + 1)
+    created = []
+    while month < last:
+        following = add_months(month, 1)
+        name = partition_name(table, month)
+        conn.exec_driver_sql(f"""
+            CREATE TABLE IF NOT EXISTS {table.schema}."{name}" PARTITION OF {table.qualified}
+            FOR VALUES FROM ({bound_literal(month, tz_aware)}) TO ({bound_literal(following, tz_aware)})
+        """)
+        created.append(name)
+        month = following
+    if not any(upper is None for _, _, upper in partitions):
+        name = f"{table.name}_default"
+        conn.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS {table.schema}."{name}" PARTITION OF {table.qualified} DEFAULT')
+        created.append(name)
+    return created
+
+
+_RECOMPRESS = {
+    'jsonb': '("{c}"::text)::jsonb',
+    'json': '("{c}"::text)::json',
+    'text': '("{c}" || \'\')',
+    'character varying': '("{c}" || \'\')',
+}
+
+
+def _compress_into_archive(conn, schema: str, name: str):
+    """Rewrite a detached partition into the archive schema with lz4 TOAST compression (PostgreSQL 14+).
+
+    Large values are rebuilt through a cast so they are recompressed instead
+    of copied with their original pglz compression.
+    """
+    columns = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = :s AND table_name = :n ORDER BY ordinal_position
+    """), {"s": schema, "n": name}).all()
+    target = f'{ARCHIVE_SCHEMA}."{name}"'
+    conn.exec_driver_sql(f'CREATE TABLE {target} (LIKE {schema}."{name}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES) WITH (fillfactor = 100)')
+    exprs = []
+    for column, data_type in columns:
+        if data_type in _RECOMPRESS:
+            conn.exec_driver_sql(f'ALTER TABLE {target} ALTER COLUMN "{column}" SET COMPRESSION lz4')
+            exprs.append(_RECOMPRESS[data_type].format(c=column))
+        else:
+            exprs.append(f'"{column}"')
+    conn.exec_driver_sql(f'INSERT INTO {target} SELECT {", ".join(exprs)} FROM {schema}."{name}"')
+    conn.exec_driver_sql(f'DROP TABLE {schema}."{name}"')
+
+
+def archive_partitions(conn, table: PartitionedTable, keep_months: int, compress: bool = False,
+                       include_undated: bool = False, now: datetime | None = None) -> list:
+    """Detach partitions entirely older than ``keep_months`` and move them to the archive schema.
+
+    Archived rows no longer appear in the application's queries. The undated
+    partition holds live pre-migration history whatever its bound says, so it
+    is skipped unless ``include_undated``.
+    """
+    if not is_partitioned(conn, table):
+        return []
+    now = _utc_naive(now or datetime.now(timezone.utc))
+    cutoff = add_months(month_start(now), -keep_months)
+    conn.exec_driver_sql(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}")
+    archived = []
+    for schema, name, upper in list_partitions(conn, table):
+        if upper is None or upper > cutoff:
+            continue
+        if name == undated_name(table) and not include_undated:
+            continue
+        conn.exec_driver_sql(f'ALTER TABLE {table.qualified} DETACH PARTITION {schema}."{name}"')
+        if compress:
+            _compress_into_archive(conn, schema, name)
+        else:
+            conn.exec_driver_sql(f'ALTER TABLE {schema}."{name}" SET SCHEMA {ARCHIVE_SCHEMA}')
+        archived.append(name)
+    return archived
+
+
+def explain_queries(key: str) -> list:
+    """(table, label, sql) of the request-path queries that should prune partitions."""
+    n8n_sql = n8n_sessions_sql(window=True).replace('%(days)s', str(N8N_RECENT_WINDOW_DAYS)).replace('%(limit)s', '200')
+    return [
+        (WHATSAPP, 'dashboard conversations_by_day', f"SELECT COUNT(*) FROM bot.whatsapp WHERE \"{key}\" >= now() - interval '7 days'"),
+        (WHATSAPP, 'dashboard sentiment (latest 1000)', f'SELECT message FROM bot.whatsapp ORDER BY "{key}" DESC LIMIT 1000'),
+        (N8N_CHAT_HISTORIES, 'n8n_chats recent sessions', n8n_sql),
+    ]
+
+
+def _touched_relations(plan: dict, found: set):
+    if plan.get('Relation Name') and plan.get('Actual Loops', 0) > 0:
+        found.add(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        _touched_relations(child, found)
+
+
+def explain_pruning(conn) -> list:
+    """Run the hot queries under EXPLAIN ANALYZE and report which partitions were read."""
+    key, _ = resolve_key(conn, WHATSAPP)
+    report = []
+    for table, label, sql in explain_queries(key or 'timestamp'):
+        if not is_partitioned(conn, table):
+            report.append({"query": label, "partitioned": False})
+            continue
+        partitions = {name for _, name, _ in list_partitions(conn, table)}
+        plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}").scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        touched = set()
+        _touched_relations(plan[0]['Plan'], touched)
+        report.append({
+            "query": label,
+            "partitioned": True,
+            "partitions_total": len(partitions),
+            "partitions_read": sorted(touched & partitions),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ensure = commands.add_parser('ensure', help='pre-create future monthly partitions')
+    ensure.add_argument('--months-ahead', type=int, default=3)
+    archive = commands.add_parser('archive', help=f'detach old partitions into the {ARCHIVE_SCHEMA} schema')
+    archive.add_argument('--keep-months', type=int, required=True)
+    archive.add_argument('--compress', action='store_true', help='rewrite archived partitions with lz4 compression')
+    archive.add_argument('--include-undated', action='store_true', help='also archive the rows older than the partitioning migration')
+    commands.add_parser('explain', help='verify partition pruning of the request-path queries')
+    args = parser.parse_args()
+
+    engine = get_engine()
+    if args.command == 'explain':
+        with engine.connect() as conn:
+            for entry in explain_pruning(conn):
+                print(json.dumps(entry))
+        return
+    for table in TABLES.values():
+        with engine.begin() as conn:
+            if args.command == 'ensure':
+                done = ensure_partitions(conn, table, args.months_ahead)
+            else:
+                done = archive_partitions(conn, table, args.keep_months, compress=args.compress, include_undated=args.include_undated)
+        print(f"partitions {args.command}: {table.qualified}: {', '.join(done) or 'nothing to do'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Request profiling: slow-request capture and header-triggered sampling.
+
+Every HTTP request gets a lightweight trace (SQL statements and timings, the
+threads doing its work). Requests slower than ``slow_ms`` are kept in a bounded
+ring buffer together with stack samples taken while they were running. A
+request carrying ``X-Profile: <PROFILING_TOKEN>`` is additionally sampled every
+few milliseconds into collapsed stacks (flamegraph.pl / speedscope format).
+"""
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+
+MAX_STATEMENTS = 200
+MAX_SLOW_SAMPLES = 5
+PROFILE_INTERVAL_SECONDS = 0.005
+
+_current_trace = ContextVar('profiling_trace', default=None)
+
+
+class RequestTrace:
+    def __init__(self, trace_id: int, method: str, path: str, query: str, profile: bool):
+        self.id = trace_id
+        self.method = method
+        self.path = path
+        self.query = query
+        self.profile = profile
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.status = None
+        self.duration_ms = None
+        self.statements = []
+        self.dropped_statements = 0
+        self.threads = {threading.get_ident()}
+        self._thread_refs = Counter()
+        self._threads_lock = threading.Lock()
+        self.slow_samples = []
+        self.stacks = Counter()
+
+    def enter_thread(self) -> int:
+        """Sample the calling thread until the matching leave_thread(); sections may nest."""
+        ident = threading.get_ident()
+        with self._threads_lock:
+            self._thread_refs[ident] += 1
+            self.threads.add(ident)
+        return ident
+
+    def leave_thread(self, ident: int):
+        with self._threads_lock:
+            self._thread_refs[ident] -= 1
+            if self._thread_refs[ident] <= 0:
+                del self._thread_refs[ident]
+                # A pooled worker thread moves on to other requests' work.
+                self.threads.discard(ident)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000.0
+
+    def record_sql(self, statement, duration_ms: float):
+        if len(self.statements) >= MAX_STATEMENTS:
+            self.dropped_statements += 1
+            return
+        self.statements.append({"sql": _statement_text(statement), "ms": round(duration_ms, 3), "at_ms": round(self.elapsed_ms() - duration_ms, 3)})
+
+    def to_dict(self, full: bool = True) -> dict:
+        data = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "profiled": self.profile,
+            "sql_count": len(self.statements) + self.dropped_statements,
+            "sql_ms": round(sum(s["ms"] for s in self.statements), 3),
+        }
+        if full:
+            data["statements"] = self.statements
+            data["dropped_statements"] = self.dropped_statements
+            data["slow_samples"] = self.slow_samples
+            data["stacks"] = collapsed_stacks(self.stacks)
+        return data
+
+
+def _statement_text(statement) -> str:
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8', errors='replace')
+    return ' '.join(str(statement).split())[:2000]
+
+
+def _frame_stack(frame) -> list:
+    return [f"{f.name} ({os.path.basename(f.filename)}:{f.lineno})" for f in traceback.extract_stack(frame)]
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+class TracedCursor:
+    """DB-API cursor proxy timing execute()/executemany() into a RequestTrace."""
+
+    def __init__(self, cursor, trace: RequestTrace):
+        self._cursor = cursor
+        self._trace = trace
+
+    def execute(self, statement, params=None):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(statement, params)
+        finally:
+            self._trace.record_sql(statement, (time.perf_counter() - start) * 1000.0)
+
+    def executemany(self, statement, seq):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(statement, seq)
+        finally:
+            self._trace.record_sql(statement, (time.perf_counter() - start) * 1000.0)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # itersize, arraysize, ... must reach the real cursor.
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+
+class TracedConnection:
+    """Connection proxy; the opening thread is sampled until close()."""
+
+    def __init__(self, conn, trace: RequestTrace):
+        self._conn = conn
+        self._trace = trace
+        self._thread = trace.enter_thread()
+
+    def cursor(self, *args, **kwargs):
+        return TracedCursor(self._conn.cursor(*args, **kwargs), self._trace)
+
+    def close(self):
+        try:
+            self._conn.close()
+        finally:
+            if self._thread is not None:
+                self._trace.leave_thread(self._thread)
+                self._thread = None
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def trace_connection(conn):
+    """Wrap a raw DB-API connection so its statements are recorded; unchanged outside a request.
+
+    Close the returned object (not ``conn``) so the thread stops being sampled.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return conn
+    return TracedConnection(conn, trace)
+
+
+def instrument_engine(engine):
+    """Record the statements of SQLAlchemy sessions/connections of ``engine``.
+
+    A thread holding a pooled connection (ORM sessions included) is sampled
+    from checkout to checkin.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        trace = _current_trace.get()
+        if trace is not None:
+            connection_record.info['profiling_thread'] = (trace, trace.enter_thread())
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        held = connection_record.info.pop('profiling_thread', None)
+        if held is not None:
+            held[0].leave_thread(held[1])
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            conn.info.setdefault('profiling_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        starts = conn.info.get('profiling_start')
+        if trace is not None and starts:
+            trace.record_sql(statement, (time.perf_counter() - starts.pop()) * 1000.0)
+
+
+class ProfileStore:
+    """Active traces plus a ring buffer of finished slow/profiled requests.
+
+    A daemon watchdog samples the stacks of active requests once they pass
+    ``slow_ms``; profiled requests get their own sampler thread.
+    """
+
+    def __init__(self, slow_ms: float = 1000.0, capacity: int = 50):
+        self.slow_ms = slow_ms
+        self.captures = deque(maxlen=capacity)
+        self._active = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def start(self, method: str, path: str, query: str, profile: bool) -> RequestTrace:
+        trace = RequestTrace(next(self._ids), method, path, query, profile)
+        with self._lock:
+            self._active[trace.id] = trace
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch, name='profiling-watchdog', daemon=True)
+                self._watchdog.start()
+        if profile:
+            threading.Thread(target=self._sample, args=(trace,), name=f'profiling-sampler-{trace.id}', daemon=True).start()
+        return trace
+
+    def finish(self, trace: RequestTrace, status: int | None):
+        trace.status = status
+        trace.duration_ms = round(trace.elapsed_ms(), 3)
+        with self._lock:
+            self._active.pop(trace.id, None)
+            if trace.profile or trace.duration_ms >= self.slow_ms:
+                self.captures.append(trace)
+        if trace.duration_ms >= self.slow_ms:
+            print(f"profiling: slow request {trace.method} {trace.path} {trace.duration_ms:.0f}ms, {len(trace.statements)} SQL statements (capture {trace.id})")
+
+    def _watch(self):
+        interval = max(0.05, self.slow_ms / 2000.0)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                overdue = [t for t in self._active.values() if t.elapsed_ms() >= self.slow_ms and len(t.slow_samples) < MAX_SLOW_SAMPLES]
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            for trace in overdue:
+                sample = {"at_ms": round(trace.elapsed_ms(), 3), "threads": {}}
+                for thread_id in list(trace.threads):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        sample["threads"][str(thread_id)] = _frame_stack(frame)
+                trace.slow_samples.append(sample)
+
+    def _sample(self, trace: RequestTrace):
+        own = threading.get_ident()
+        while trace.duration_ms is None:
+            frames = sys._current_frames()
+            for thread_id in list(trace.threads):
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own:
+                    trace.stacks[';'.join(_frame_stack(frame))] += 1
+            time.sleep(PROFILE_INTERVAL_SECONDS)
+
+    def summaries(self) -> list:
+        with self._lock:
+            return [t.to_dict(full=False) for t in reversed(self.captures)]
+
+    def get(self, trace_id: int) -> RequestTrace | None:
+        with self._lock:
+            return next((t for t in self.captures if t.id == trace_id), None)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware opening a RequestTrace per HTTP request."""
+
+    def __init__(self, app, store: ProfileStore, token: str | None = None):
+        self.app = app
+        self.store = store
+        self.token = token
+
+    def _wants_profile(self, scope) -> bool:
+        if not self.token:
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile":
+                return hmac.compare_digest(value.decode('latin-1'), self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = self.store.start(scope.get("method", ""), scope.get("path", ""), scope.get("query_string", b"").decode('latin-1'), self._wants_profile(scope))
+        token = _current_trace.set(trace)
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace.profile:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile-id", str(trace.id).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            self.store.finish(trace, status)
+
+
+def store_from_env() -> ProfileStore:
+    return ProfileStore(slow_ms=float(os.getenv("SLOW_REQUEST_MS") or "1000"), capacity=int(os.getenv("PROFILING_CAPACITY") or "50"))
+
+
+_profile_store = None
+_profile_store_lock = threading.Lock()
+
+
+def get_profile_store() -> ProfileStore:
+    global _profile_store
+    if _profile_store is None:
+        with _profile_store_lock:
+            if _profile_store is None:
+                _profile_store = store_from_env()
+    return _profile_store
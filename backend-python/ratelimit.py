@@ -0,0 +1,290 @@
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryRateLimitBackend:
+    """Token buckets and sliding-window counters for a single worker process.
+
+    State lives in two LRU-ordered dicts of small lists; once ``max_keys`` is
+    exceeded the least recently used keys are evicted, so a flood of distinct
+    IPs/correos cannot grow memory without bound.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> [tokens, updated_at]
+        self._windows = OrderedDict()  # key -> [window_start, current, previous]
+        self._lock = threading.Lock()
+
+    def _evict(self, table: OrderedDict):
+        while len(table) > self.max_keys:
+            table.popitem(last=False)
+
+    def take(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        """Consume one token; return 0 when allowed, else seconds until a token is available."""
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                state = [capacity, now]
+                self._buckets[key] = state
+                self._evict(self._buckets)
+            else:
+                self._buckets.move_to_end(key)
+                state[0] = min(capacity, state[0] + (now - state[1]) * refill_per_second)
+                state[1] = now
+            if state[0] >= 1.0:
+                state[0] -= 1.0
+                return 0.0
+            return (1.0 - state[0]) / refill_per_second if refill_per_second > 0 else float('inf')
+
+    def reset(self, key: str):
+        with self._lock:
+            self._buckets.pop(key, None)
+            self._windows.pop(key, None)
+
+    def _roll(self, state: list, window: float, now: float):
+        start = now - (now % window)
+        if start == state[0]:
+            return
+        state[2] = state[1] if start - state[0] == window else 0
+        state[1] = 0
+        state[0] = start
+
+    def hit(self, key: str, window: float, now: float) -> float:
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                state = [now - (now % window), 0, 0]
+                self._windows[key] = state
+                self._evict(self._windows)
+            else:
+                self._windows.move_to_end(key)
+                self._roll(state, window, now)
+            state[1] += 1
+            return _sliding_estimate(state, window, now)
+
+    def count(self, key: str, window: float, now: float) -> float:
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None:
+                return 0.0
+            self._roll(state, window, now)
+            return _sliding_estimate(state, window, now)
+
+
+def _sliding_estimate(state, window: float, now: float) -> float:
+    elapsed = (now - state[0]) / window
+    return state[2] * (1.0 - elapsed) + state[1]
+
+
+def default_sqlite_path() -> str:
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'dashboard_ratelimit.sqlite3')
+
+
+class SQLiteRateLimitBackend:
+    """Rate-limit state shared by every uvicorn worker on the host.
+
+    Same interface as MemoryRateLimitBackend, stored in a WAL-mode SQLite file
+    (on tmpfs by default). Each operation is one ``BEGIN IMMEDIATE`` transaction;
+    idle keys are purged every ``purge_every`` operations.
+    """
+
+    def __init__(self, path: str | None = None, idle_seconds: float = 3600.0, purge_every: int = 1000):
+        self.path = path or default_sqlite_path()
+        self.idle_seconds = idle_seconds
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._ops = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS windows (key TEXT PRIMARY KEY, window_start REAL NOT NULL, current INTEGER NOT NULL, previous INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            try:
+                os.chmod(self.path, 0o600)
+            except OSError:
+                pass
+            self._local.conn = conn
+        return conn
+
+    def _maybe_purge(self, conn, now: float):
+        self._ops += 1
+        if self._ops % self.purge_every:
+            return
+        cutoff = now - self.idle_seconds
+        conn.execute("DELETE FROM buckets WHERE updated_at < ?", (cutoff,))
+        conn.execute("DELETE FROM windows WHERE window_start < ?", (cutoff,))
+
+    def take(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_per_second)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+            self._maybe_purge(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if allowed:
+            return 0.0
+        return (1.0 - tokens) / refill_per_second if refill_per_second > 0 else float('inf')
+
+    def _load_window(self, conn, key: str, window: float, now: float) -> list | None:
+        row = conn.execute("SELECT window_start, current, previous FROM windows WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        state = list(row)
+        start = now - (now % window)
+        if start != state[0]:
+            state = [start, 0, state[1] if start - state[0] == window else 0]
+        return state
+
+    def hit(self, key: str, window: float, now: float) -> float:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._load_window(conn, key, window, now) or [now - (now % window), 0, 0]
+            state[1] += 1
+            conn.execute("INSERT OR REPLACE INTO windows (key, window_start, current, previous) VALUES (?, ?, ?, ?)", (key, *state))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return _sliding_estimate(state, window, now)
+
+    def count(self, key: str, window: float, now: float) -> float:
+        state = self._load_window(self._conn(), key, window, now)
+        return 0.0 if state is None else _sliding_estimate(state, window, now)
+
+    def reset(self, key: str):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM buckets WHERE key = ?", (key,))
+            conn.execute("DELETE FROM windows WHERE key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class LoginRateLimiter:
+    """Login throttling: token buckets per IP and per correo, plus sliding-window
+    failure counters that shed credential-stuffing sources entirely.
+
+    The correo bucket and failure counter are keyed on (ip, correo): failures
+    lock out an IP, or one correo from one IP, and nobody can lock a known
+    account out for everyone. A successful login clears that pair's counters.
+    """
+
+    def __init__(self, backend, ip_burst: float = 20, ip_per_minute: float = 20, correo_burst: float = 5, correo_per_minute: float = 2,
+                 failure_window: float = 900, max_failures_ip: int = 30, max_failures_correo: int = 10):
+        if ip_per_minute <= 0 or correo_per_minute <= 0:
+            raise ValueError("login rate limits must refill at a positive rate per minute")
+        self.backend = backend
+        self.ip_burst = ip_burst
+        self.ip_rate = ip_per_minute / 60.0
+        self.correo_burst = correo_burst
+        self.correo_rate = correo_per_minute / 60.0
+        self.failure_window = failure_window
+        self.max_failures_ip = max_failures_ip
+        self.max_failures_correo = max_failures_correo
+
+    def check(self, ip: str, correo: str, now: float | None = None) -> int:
+        """Return 0 if the attempt may proceed, else the Retry-After in seconds."""
+        now = time.time() if now is None else now
+        correo = (correo or '').strip().lower()
+        if self.backend.count(f"fail:ip:{ip}", self.failure_window, now) >= self.max_failures_ip:
+            return int(self.failure_window)
+        if correo and self.backend.count(f"fail:ip_correo:{ip}:{correo}", self.failure_window, now) >= self.max_failures_correo:
+            return int(self.failure_window)
+        wait = self.backend.take(f"ip:{ip}", self.ip_burst, self.ip_rate, now)
+        if not wait and correo:
+            wait = self.backend.take(f"correo:{ip}:{correo}", self.correo_burst, self.correo_rate, now)
+        # Backends built with a zero rate report an infinite wait.
+        return int(math.ceil(min(wait, self.failure_window))) if wait else 0
+
+    def record_failure(self, ip: str, correo: str, now: float | None = None):
+        now = time.time() if now is None else now
+        correo = (correo or '').strip().lower()
+        self.backend.hit(f"fail:ip:{ip}", self.failure_window, now)
+        if correo:
+            self.backend.hit(f"fail:ip_correo:{ip}:{correo}", self.failure_window, now)
+
+    def record_success(self, ip: str, correo: str):
+        """Clear the failures and the bucket of this (ip, correo) pair.
+
+        The per-IP failure counter is kept, so one valid account cannot be used
+        to launder a credential-stuffing run from the same address.
+        """
+        correo = (correo or '').strip().lower()
+        if correo:
+            self.backend.reset(f"fail:ip_correo:{ip}:{correo}")
+            self.backend.reset(f"correo:{ip}:{correo}")
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def login_limiter_from_env() -> LoginRateLimiter:
+    backend_name = (os.getenv("RATE_LIMIT_BACKEND") or "memory").lower()
+    if backend_name == "sqlite":
+        backend = SQLiteRateLimitBackend(os.getenv("RATE_LIMIT_SQLITE_PATH") or None)
+    else:
+        backend = MemoryRateLimitBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS") or "100000"))
+    return LoginRateLimiter(
+        backend,
+        ip_burst=_env_float("LOGIN_RATE_IP_BURST", 20),
+        ip_per_minute=_env_float("LOGIN_RATE_IP_PER_MINUTE", 20),
+        correo_burst=_env_float("LOGIN_RATE_CORREO_BURST", 5),
+        correo_per_minute=_env_float("LOGIN_RATE_CORREO_PER_MINUTE", 2),
+        failure_window=_env_float("LOGIN_FAILURE_WINDOW_SECONDS", 900),
+        max_failures_ip=int(_env_float("LOGIN_MAX_FAILURES_IP", 30)),
+        max_failures_correo=int(_env_float("LOGIN_MAX_FAILURES_CORREO", 10)),
+    )
+
+
+_login_limiter = None
+_login_limiter_lock = threading.Lock()
+
+
+def get_login_limiter() -> LoginRateLimiter:
+    global _login_limiter
+    if _login_limiter is None:
+        with _login_limiter_lock:
+            if _login_limiter is None:
+                _login_limiter = login_limiter_from_env()
+    return _login_limiter
+
+
+def client_ip(request) -> str:
+    """Peer address, or with TRUST_PROXY_HEADERS the X-Forwarded-For entry added by our proxies.
+
+    Entries left of the ones appended by the TRUSTED_PROXY_HOPS trusted proxies
+    (default 1) come from the client and are ignored.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if os.getenv("TRUST_PROXY_HEADERS", "0") in ("1", "true", "True"):
+        forwarded = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        hops = max(1, int(os.getenv("TRUSTED_PROXY_HOPS") or "1"))
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return peer
@@ -0,0 +1,38 @@
+import datetime
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Fallback for types orjson does not serialize natively (psycopg2 row values)."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode('utf-8', errors='replace')
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson.
+
+    Return it directly from a route (instead of plain dicts/lists) so FastAPI
+    skips ``jsonable_encoder`` for rows that are already plain Python values.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,96 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import analytics
+import database
+from analytics import AnalyticsError, bucket_starts, conversation_buckets, truncate
+
+
+class FakeCursor:
+    """Answers the catalog probe and the bucket query from an in-memory series."""
+
+    def __init__(self, counts, data_type='timestamp with time zone'):
+        self.counts = counts
+        self.data_type = data_type
+        self.bucket_queries = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if 'generate_series' in sql:
+            self.bucket_queries.append(params)
+            self._rows = [(b, c) for b, c in sorted(self.counts.items()) if params['first'] <= b <= params['last']]
+        else:
+            self._rows = [(self.data_type,)]
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(analytics, 'closed_buckets', analytics.ClosedBucketCache())
+    monkeypatch.setattr(analytics, '_ts_is_naive', None)
+    monkeypatch.setattr(database, '_whatsapp_ts_column', 'timestamp')
+
+
+def test_truncate():
+    dt = datetime(2025, 3, 13, 15, 42, 7)
+    assert truncate(dt, 'hour') == datetime(2025, 3, 13, 15)
+    assert truncate(dt, 'day') == datetime(2025, 3, 13)
+    assert truncate(dt, 'week') == datetime(2025, 3, 10)
+    assert truncate(dt, 'month') == datetime(2025, 3, 1)
+
+def test_bucket_starts_rounds_range_to_buckets():
+    buckets = bucket_starts(datetime(2024, 11, 15), datetime(2025, 2, 2), 'month')
+    assert buckets == [datetime(2024, 11, 1), datetime(2024, 12, 1), datetime(2025, 1, 1), datetime(2025, 2, 1)]
+
+def test_closed_buckets_are_served_from_cache():
+    counts = {datetime(2025, 3, d): d for d in range(1, 11)}
+    cur = FakeCursor(counts)
+    now = datetime(2025, 3, 5, 12, tzinfo=timezone.utc)
+    start, end = datetime(2025, 3, 1, tzinfo=timezone.utc), datetime(2025, 3, 8, tzinfo=timezone.utc)
+
+    first = conversation_buckets(cur, start, end, 'day', 'UTC', now=now, settle_seconds=60, column_tz_name='UTC')
+    assert [b['count'] for b in first['buckets']] == [1, 2, 3, 4, 5, 6, 7]
+    assert cur.bucket_queries[0]['first'] == datetime(2025, 3, 1)
+
+    second = conversation_buckets(cur, start, end, 'day', 'UTC', now=now, settle_seconds=60, column_tz_name='UTC')
+    assert second['buckets'] == first['buckets']
+    # Only the open bucket (March 5th) onwards is recomputed.
+    assert cur.bucket_queries[1]['first'] == datetime(2025, 3, 5)
+
+def test_buckets_within_replica_lag_are_not_cached():
+    counts = {datetime(2025, 3, d): d for d in range(1, 6)}
+    cur = FakeCursor(counts)
+    start, end = datetime(2025, 3, 1, tzinfo=timezone.utc), datetime(2025, 3, 6, tzinfo=timezone.utc)
+    # March 4th closed 30s ago: a replica may not have all of its rows yet.
+    now = datetime(2025, 3, 5, tzinfo=timezone.utc) + timedelta(seconds=30)
+    conversation_buckets(cur, start, end, 'day', 'UTC', now=now, settle_seconds=60, column_tz_name='UTC')
+    conversation_buckets(cur, start, end, 'day', 'UTC', now=now, settle_seconds=60, column_tz_name='UTC')
+    assert cur.bucket_queries[1]['first'] == datetime(2025, 3, 4)
+
+def test_naive_column_time_zone_is_configurable():
+    cur = FakeCursor({}, data_type='timestamp without time zone')
+    start, end = datetime(2025, 3, 1), datetime(2025, 3, 2)
+    now = datetime(2025, 3, 10, tzinfo=timezone.utc)
+    conversation_buckets(cur, start, end, 'day', 'UTC', now=now, settle_seconds=60, column_tz_name='America/Lima')
+    params = cur.bucket_queries[0]
+    assert params['column_tz'] == 'America/Lima'
+    assert params['lo'] == datetime(2025, 2, 28, 19)
+
+def test_invalid_arguments():
+    cur = FakeCursor({})
+    start, end = datetime(2025, 3, 1), datetime(2025, 3, 2)
+    with pytest.raises(AnalyticsError):
+        conversation_buckets(cur, start, end, 'minute')
+    with pytest.raises(AnalyticsError):
+        conversation_buckets(cur, start, end, 'day', 'Mars/Olympus')
+    with pytest.raises(AnalyticsError):
+        conversation_buckets(cur, end, start, 'day')
@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+import time
+
+import pytest
+
+from budgets import DBBudget, BudgetExceeded
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a local Postgres")
+
+
+@pytest.fixture
+def conn():
+    import psycopg2
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def _sleep(seconds):
+    def run(cur):
+        cur.execute("SELECT pg_sleep(%s)", (seconds,))
+        cur.fetchone()
+        return "done"
+    return run
+
+
+def _one(cur):
+    cur.execute("SELECT 1")
+    return cur.fetchone()[0]
+
+
+def test_statement_timeout_degrades_section(conn):
+    budget = DBBudget("test", ms=300)
+    budget.attach(conn)
+    cur = conn.cursor()
+    t0 = time.monotonic()
+    assert budget.section(cur, "slow", _sleep(5), default="partial") == "partial"
+    assert time.monotonic() - t0 < 2
+    assert budget.degraded
+    assert budget.degraded_sections == ["slow"]
+
+def test_later_sections_run_after_timeout(conn):
+    budget = DBBudget("test", ms=2000)
+    budget.attach(conn)
+    cur = conn.cursor()
+
+    def slow(cur):
+        cur.execute("SET LOCAL statement_timeout = 200")
+        return _sleep(1)(cur)
+
+    assert budget.section(cur, "slow", slow, default=None) is None
+    assert budget.section(cur, "fast", _one, default=None) == 1
+    assert budget.degraded_sections == ["slow"]
+
+def test_failing_section_is_degraded(conn):
+    budget = DBBudget("test", ms=5000)
+    cur = conn.cursor()
+
+    def broken(cur):
+        cur.execute("SELECT 1 / 0")
+
+    assert budget.section(cur, "broken", broken, default="partial") == "partial"
+    assert budget.degraded_sections == ["broken"]
+    assert budget.section(cur, "fast", _one, default=None) == 1
+
+def test_exhausted_budget_skips_queries(conn):
+    budget = DBBudget("test", ms=0)
+    cur = conn.cursor()
+    assert budget.section(cur, "skipped", _one, default=0) == 0
+    with pytest.raises(BudgetExceeded):
+        budget.apply(cur)
+
+def test_cancel_from_another_thread(conn):
+    budget = DBBudget("test", ms=10000)
+    budget.attach(conn)
+    cur = conn.cursor()
+    threading.Timer(0.3, budget.cancel).start()
+    t0 = time.monotonic()
+    assert budget.section(cur, "cancelled", _sleep(5), default="cancelled") == "cancelled"
+    assert time.monotonic() - t0 < 2
+    assert budget.section(cur, "after_cancel", _one, default="skipped") == "skipped"
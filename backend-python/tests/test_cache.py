@@ -0,0 +1,94 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import subprocess
+import threading
+import time
+
+from cache import Cache, MemoryCacheBackend, SQLiteCacheBackend
+
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _run_worker(db_path: str, script: str) -> subprocess.Popen:
+    """Start another Python process sharing the SQLite cache at ``db_path``."""
+    prelude = f"import sys, time; sys.path.insert(0, {BACKEND_DIR!r})\nfrom cache import Cache, SQLiteCacheBackend\ncache = Cache(SQLiteCacheBackend({db_path!r}))\n"
+    return subprocess.Popen([sys.executable, '-c', prelude + script], stdout=subprocess.PIPE, text=True)
+
+
+def test_ttl_and_namespace_invalidation():
+    cache = Cache(MemoryCacheBackend())
+    cache.set('users', 'ana', {'id': 1}, ttl=60)
+    cache.set('dashboard', 'etag', {'total_clients': 3}, ttl=0.05)
+    assert cache.get('users', 'ana') == {'id': 1}
+    time.sleep(0.06)
+    assert cache.get('dashboard', 'etag') is None
+    cache.invalidate('users')
+    assert cache.get('users', 'ana') is None
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set('a', b'1', 60)
+    backend.set('b', b'2', 60)
+    backend.get('a')
+    backend.set('c', b'3', 60)
+    assert list(backend._entries) == ['a', 'c']
+
+def test_sqlite_backend_bounded(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'), max_entries=5, purge_every=10)
+    for i in range(30):
+        backend.set(f'k{i}', b'x', 60 + i)
+    count = backend._conn().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    assert count <= 5 + 10
+    assert backend.get('k29') == b'x'
+
+def test_get_or_set_single_flight_threads():
+    cache = Cache(MemoryCacheBackend())
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.1)
+        return {'n': len(calls)}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_set('ns', 'k', loader, 60))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{'n': 1}] * 8
+
+def test_uncacheable_values_are_not_stored():
+    cache = Cache(MemoryCacheBackend())
+    cache.get_or_set('dashboard', 'etag', lambda: {'degraded': True}, 60, cacheable=lambda p: not p['degraded'])
+    assert cache.get('dashboard', 'etag') is None
+    assert cache.get_or_set('users', 'nadie', lambda: None, 60) is None
+
+def test_sqlite_cache_is_coherent_across_processes(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = Cache(SQLiteCacheBackend(path))
+    cache.set('users', 'ana', {'area': 'TI'}, ttl=60)
+
+    reader = _run_worker(path, "print(cache.get('users', 'ana')['area'])")
+    assert reader.communicate(timeout=30)[0].strip() == 'TI'
+
+    invalidator = _run_worker(path, "cache.invalidate('users')")
+    invalidator.communicate(timeout=30)
+    assert cache.get('users', 'ana') is None
+
+def test_sqlite_single_flight_across_processes(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    script = (
+        "def loader():\n"
+        "    cache.backend.incr('loads')\n"
+        "    time.sleep(0.5)\n"
+        "    return {'ok': True}\n"
+        "print(cache.get_or_set('dashboard', 'etag', loader, 60)['ok'])\n"
+    )
+    workers = [_run_worker(path, script) for _ in range(4)]
+    outputs = [w.communicate(timeout=30)[0].strip() for w in workers]
+    assert outputs == ['True'] * 4
+    assert SQLiteCacheBackend(path).counter('loads') == 1
@@ -0,0 +1,74 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from client_metrics import aggregate_select, changed_cliente_ids, refresh_client_metrics
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a local Postgres")
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect())).lower()
+
+def test_aggregates_are_set_based():
+    sql = _sql(aggregate_select())
+    assert "group by conversaciones.cliente_id" in sql
+    assert "lag(mensajes.es_del_cliente) over (partition by mensajes.conversacion_id" in sql
+    assert "filter (where" in sql
+    assert "where clientes.id in" not in sql
+
+def test_incremental_restricts_to_changed_clients():
+    sql = _sql(aggregate_select([1, 2]))
+    assert sql.count("in (__[postcompile_") >= 3
+
+
+@pytest.fixture
+def db():
+    from sqlalchemy import create_engine, delete
+    from sqlalchemy.orm import Session
+    from models import Cliente, ClienteMetricas, Conversacion, DBBase, Mensaje
+    engine = create_engine(TEST_DATABASE_URL)
+    tables = [m.__table__ for m in (Cliente, Conversacion, Mensaje, ClienteMetricas)]
+    DBBase.metadata.create_all(engine, tables=tables)
+    session = Session(engine)
+    yield session
+    session.rollback()
+    session.execute(delete(ClienteMetricas).where(ClienteMetricas.cliente_id >= 900000))
+    for model in (Mensaje, Conversacion, Cliente):
+        session.execute(delete(model).where(model.id >= 900000))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+
+@needs_db
+def test_upsert_and_late_committed_messages(db):
+    from models import Cliente, ClienteMetricas, Conversacion, Mensaje
+    t0 = datetime(2025, 1, 1, 10, 0)
+    db.add_all([Cliente(id=900001, nombre="a", email="a@test.local"), Cliente(id=900002, nombre="b", email="b@test.local")])
+    db.add_all([Conversacion(id=900001, cliente_id=900001, estado="Resuelto"), Conversacion(id=900002, cliente_id=900002, estado="Pendiente")])
+    db.add_all([
+        Mensaje(id=900010, conversacion_id=900001, es_del_cliente=True, fecha_envio=t0),
+        Mensaje(id=900012, conversacion_id=900001, es_del_cliente=False, fecha_envio=t0 + timedelta(seconds=30)),
+    ])
+    db.commit()
+
+    assert refresh_client_metrics(db, full=True) >= 2
+    a = db.get(ClienteMetricas, 900001)
+    assert (a.mensajes_total, a.mensajes_cliente, a.mensajes_agente, a.ultimo_mensaje_id) == (2, 1, 1, 900012)
+    assert a.tiempo_respuesta_promedio == 30
+    assert db.get(Cliente, 900001).tasa_conversion == 1.0
+
+    # Id 900011 was allocated before 900012 but its transaction committed after the refresh.
+    db.add(Mensaje(id=900011, conversacion_id=900002, es_del_cliente=True, fecha_envio=t0))
+    db.commit()
+    assert 900002 in changed_cliente_ids(db)
+    assert 900002 not in changed_cliente_ids(db, lag_ids=0)
+    refresh_client_metrics(db)
+    db.expire_all()
+    assert db.get(ClienteMetricas, 900002).mensajes_total == 1
@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import threading
+import time
+
+from coalesce import RequestCoalescer
+
+
+class FakeRequest:
+    def __init__(self, disconnected: bool = False):
+        self.disconnected = disconnected
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def test_concurrent_identical_requests_share_one_load():
+    coalescer = RequestCoalescer()
+    calls = []
+    lock = threading.Lock()
+
+    def load(budget, session_id):
+        with lock:
+            calls.append(session_id)
+        time.sleep(0.2)
+        return f'[{session_id}]'.encode()
+
+    async def scenario():
+        same = [coalescer.run(('/api/chats/a', (), 'TI'), FakeRequest(), 'chat_history', load, 'a') for _ in range(5)]
+        other = coalescer.run(('/api/chats/b', (), 'TI'), FakeRequest(), 'chat_history', load, 'b')
+        return await asyncio.gather(*same, other)
+
+    results = asyncio.run(scenario())
+    assert results == [b'[a]'] * 5 + [b'[b]']
+    assert sorted(calls) == ['a', 'b']
+    stats = coalescer.stats()
+    assert stats['leaders'] == 2 and stats['coalesced'] == 4 and stats['in_flight'] == 0
+
+def test_sequential_requests_are_not_cached():
+    coalescer = RequestCoalescer()
+    calls = []
+
+    def load(budget):
+        calls.append(1)
+        return b'[]'
+
+    async def scenario():
+        await coalescer.run(('/api/n8n_chats', (), 'TI'), FakeRequest(), 'n8n_chats', load)
+        await coalescer.run(('/api/n8n_chats', (), 'TI'), FakeRequest(), 'n8n_chats', load)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+def test_query_is_cancelled_only_when_every_client_left():
+    coalescer = RequestCoalescer()
+    cancelled = []
+
+    def load(budget):
+        budget.cancel = lambda: cancelled.append(True)
+        time.sleep(0.6)
+        return b'[]'
+
+    async def scenario():
+        gone = FakeRequest()
+        staying = FakeRequest()
+        first = asyncio.ensure_future(coalescer.run(('k',), gone, 'n8n_chats', load))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(coalescer.run(('k',), staying, 'n8n_chats', load))
+        gone.disconnected = True
+        await asyncio.gather(first, second)
+
+    asyncio.run(scenario())
+    assert cancelled == []
+    assert coalescer.stats()['cancelled'] == 0
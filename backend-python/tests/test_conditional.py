@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import datetime, timezone
+
+import pytest
+
+from starlette.requests import Request
+
+from conditional import make_etag, is_not_modified, naive_utc, not_modified, validator_headers
+
+
+def _request(headers: dict) -> Request:
+    raw = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+def test_etag_changes_with_validators():
+    assert make_etag('chat', 'abc', 100, 5, 5) == make_etag('chat', 'abc', 100, 5, 5)
+    assert make_etag('chat', 'abc', 100, 5, 5) != make_etag('chat', 'abc', 100, 6, 6)
+
+def test_if_none_match():
+    etag = make_etag('charts', 1)
+    assert is_not_modified(_request({"If-None-Match": etag}), etag)
+    assert is_not_modified(_request({"If-None-Match": '"other", ' + etag[2:]}), etag)
+    assert not is_not_modified(_request({"If-None-Match": make_etag('charts', 2)}), etag)
+    assert not is_not_modified(_request({}), etag)
+
+def test_if_modified_since():
+    etag = make_etag('stats', 1)
+    last = datetime(2025, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert is_not_modified(_request({"If-Modified-Since": "Sat, 01 Mar 2025 12:00:00 GMT"}), etag, last)
+    assert not is_not_modified(_request({"If-Modified-Since": "Sat, 01 Mar 2025 11:00:00 GMT"}), etag, last)
+
+def test_if_modified_since_without_zone_is_gmt():
+    etag = make_etag('stats', 1)
+    last = datetime(2025, 3, 1, 12, 0, 0, tzinfo=timezone.utc)
+    assert is_not_modified(_request({"If-Modified-Since": "Sat, 01 Mar 2025 12:00:00 -0000"}), etag, last)
+    assert not is_not_modified(_request({"If-Modified-Since": "Sat, 01 Mar 2025 11:00:00 -0000"}), etag, last)
+
+def test_naive_last_modified_must_be_converted():
+    naive = datetime(2025, 3, 1, 12, 0, 0)
+    with pytest.raises(ValueError):
+        validator_headers(make_etag('stats', 1), naive)
+    assert validator_headers(make_etag('stats', 1), naive_utc(naive))["Last-Modified"] == "Sat, 01 Mar 2025 12:00:00 GMT"
+
+def test_not_modified_response():
+    etag = make_etag('chat', 'x')
+    resp = not_modified(etag)
+    assert resp.status_code == 304
+    assert resp.headers["etag"] == etag
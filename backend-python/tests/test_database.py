@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from database import Replica, ReplicaRouter, Settings, message_projection, parse_message_fields
+
+
+class FakeCursor:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return (self.lag,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+
+    def cursor(self):
+        return FakeCursor(self.engine.lag)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.engine.checked_in += 1
+
+    def invalidate(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, lag=0.0, down=False):
+        self.lag = lag
+        self.down = down
+        self.checked_in = 0
+
+    def raw_connection(self):
+        if self.down:
+            raise ConnectionError("replica down")
+        return FakeConnection(self)
+
+
+def _router(*engines, max_lag=10.0):
+    replicas = [Replica(f"postgresql+psycopg2://u:p@replica{i}/db", e) for i, e in enumerate(engines)]
+    return ReplicaRouter(replicas, max_lag=max_lag, eject_seconds=30, lag_check_seconds=0)
+
+
+def test_pool_covers_the_threadpool(monkeypatch):
+    for name in ("DB_POOL_SIZE", "DB_MAX_OVERFLOW", "JOBS_WORKERS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("THREADPOOL_SIZE", "40")
+    settings = Settings()
+    assert settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW >= settings.THREADPOOL_SIZE
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    assert Settings().DB_MAX_OVERFLOW == 0
+
+
+def test_round_robin():
+    router = _router(FakeEngine(), FakeEngine())
+    picked = [router.checkout()[0] for _ in range(4)]
+    assert picked[0] is not picked[1]
+    assert picked[0] is picked[2]
+
+def test_failed_replica_is_ejected():
+    down, up = FakeEngine(down=True), FakeEngine()
+    router = _router(down, up)
+    for _ in range(3):
+        replica, conn = router.checkout()
+        assert replica.engine is up
+    assert router.replicas[0].skip_until > 0
+
+def test_lagging_replica_falls_back_to_primary():
+    router = _router(FakeEngine(lag=60.0), max_lag=10.0)
+    assert router.checkout() == (None, None)
+    assert router.replicas[0].engine.checked_in == 1
+
+
+@pytest.mark.skipif(not os.getenv("TEST_REPLICA_URL"), reason="set TEST_REPLICA_URL to a second local Postgres")
+def test_live_replica_routing():
+    from sqlalchemy import create_engine
+    url = os.environ["TEST_REPLICA_URL"]
+    router = ReplicaRouter([Replica(url, create_engine(url))], max_lag=10.0, eject_seconds=30, lag_check_seconds=5)
+    replica, conn = router.checkout()
+    assert conn is not None
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    assert cur.fetchone()[0] == 1
+    conn.close()
+
+
+def test_message_fields_are_whitelisted():
+    assert parse_message_fields(None) is None
+    assert parse_message_fields("type, content,type") == ("type", "content")
+    with pytest.raises(ValueError):
+        parse_message_fields("content,password")
+
+def test_message_projection_truncates_in_sql():
+    assert message_projection("message", None, None) == ("message", ("message",))
+    select_list, names = message_projection("t.message", None, 80)
+    assert names == ("type", "content", "content_truncated")
+    assert "left((t.message::jsonb)->>'content', 80)" in select_list
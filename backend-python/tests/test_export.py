@@ -0,0 +1,78 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc
+
+from export import Export, ExportError, _ChunkSink, _arrow_type, _batch
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a local Postgres")
+
+
+def test_rows_become_typed_columns():
+    schema = pa.schema([("id", _arrow_type(23)), ("monto", _arrow_type(1700)), ("message", _arrow_type(3802)), ("ts", _arrow_type(1184))])
+    ts = datetime(2025, 3, 1, 12, tzinfo=timezone.utc)
+    batch = _batch(schema, [(1, Decimal("10.50"), {"type": "human", "content": "hola"}, ts), (2, None, None, None)])
+    assert batch.column(0).to_pylist() == [1, 2]
+    assert batch.column(1).to_pylist() == [10.5, None]
+    assert batch.column(2).to_pylist() == ['{"type": "human", "content": "hola"}', None]
+    assert batch.column(3).to_pylist()[0] == ts
+
+def test_chunk_sink_streams_a_readable_ipc_stream():
+    schema = pa.schema([("id", pa.int64())])
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    chunks = []
+    for start in (0, 3):
+        writer.write_batch(_batch(schema, [(i,) for i in range(start, start + 3)]))
+        chunks.append(sink.drain())
+    writer.close()
+    chunks.append(sink.drain())
+    table = pa.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.column("id").to_pylist() == [0, 1, 2, 3, 4, 5]
+
+
+@pytest.fixture
+def clientes(monkeypatch):
+    from sqlalchemy import create_engine, delete
+    from sqlalchemy.orm import Session
+    import database
+    from models import Cliente, DBBase
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    database.dispose_engines()
+    engine = create_engine(TEST_DATABASE_URL)
+    DBBase.metadata.create_all(engine, tables=[Cliente.__table__])
+    session = Session(engine)
+    session.add_all([Cliente(id=900000 + i, nombre=f"c{i}", email=f"c{i}@test.local") for i in (1, 2, 3)])
+    session.commit()
+    yield database
+    session.execute(delete(Cliente).where(Cliente.id >= 900000))
+    session.commit()
+    session.close()
+    engine.dispose()
+    database.dispose_engines()
+
+
+@needs_db
+def test_since_overlaps_the_previous_watermark(clientes):
+    with Export("clientes", "arrow", since="900003", lag_ids=2) as export:
+        data = b"".join(export.chunks())
+    ids = set(pa.ipc.open_stream(data).read_all().column("id").to_pylist())
+    assert {900002, 900003} <= ids and 900001 not in ids
+    assert export.watermark >= 900003
+    with pytest.raises(ExportError):
+        Export("clientes", since="2025-01-01")
+
+@needs_db
+def test_unstreamed_export_releases_its_connection(clientes):
+    export = Export("clientes", "parquet", batch_size=123)
+    assert export._cursor.itersize == 123
+    export.close()
+    export.close()
+    assert clientes.get_engine().pool.checkedout() == 0
@@ -0,0 +1,163 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from jobs import HANDLERS, JobRunner, backoff_seconds, claim, complete, dashboard_params, ensure_job, fail, job_key, precomputed, request_run, store_result
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a local Postgres")
+
+
+def test_job_key_is_canonical():
+    assert job_key('dashboard_charts', {"days": 7, "period": "day"}) == job_key('dashboard_charts', {"period": "day", "days": 7})
+
+def test_dashboard_params_share_keys():
+    assert dashboard_params('day', 0) == dashboard_params('day', 7)
+    assert dashboard_params('month', 30) == dashboard_params('month', 7)
+    assert dashboard_params('month', 7, 13, 2025) == dashboard_params('month')
+
+def test_dashboard_params_are_bounded():
+    assert dashboard_params('x1') == dashboard_params('x2') == dashboard_params('month')
+    assert dashboard_params('day', 8)["days"] == 14
+    assert dashboard_params('day', 99999)["days"] == 365
+    assert dashboard_params('month', 7, 3, 99999) == dashboard_params('month')
+    assert dashboard_params('year', 7, 3, 2025) == {"period": "month", "days": None, "month": 3, "year": 2025}
+
+def test_backoff_is_exponential_and_capped():
+    assert [backoff_seconds(a) for a in (1, 2, 3)] == [5, 10, 20]
+    assert backoff_seconds(30) == 600
+
+
+@pytest.fixture
+def engine():
+    from sqlalchemy import create_engine, delete
+    from models import Job
+    engine = create_engine(TEST_DATABASE_URL)
+    Job.__table__.create(engine, checkfirst=True)
+    yield engine
+    with engine.begin() as conn:
+        conn.execute(delete(Job).where(Job.name.like('test_%')))
+    engine.dispose()
+
+
+@needs_db
+def test_skip_locked_hands_each_job_to_one_worker(engine):
+    with engine.begin() as conn:
+        ensure_job(conn, 'test_a', {})
+        ensure_job(conn, 'test_b', {})
+    first = engine.connect()
+    second = engine.connect()
+    try:
+        a = claim(first, 'w1')
+        b = claim(second, 'w2')
+        assert {a.name, b.name} == {'test_a', 'test_b'}
+    finally:
+        first.rollback()
+        second.rollback()
+        first.close()
+        second.close()
+
+
+@needs_db
+def test_periodic_job_rearms_and_failures_back_off(engine):
+    from sqlalchemy import select
+    from models import Job
+    with engine.begin() as conn:
+        key = ensure_job(conn, 'test_periodic', {"x": 1}, interval_seconds=300, max_attempts=2)
+        claimed = claim(conn, 'w1')
+        complete(conn, claimed, {"ok": True})
+        row = conn.execute(select(Job).where(Job.key == key)).first()
+        assert row.status == 'pending' and row.result == {"ok": True}
+        assert (row.run_at - row.result_at).total_seconds() >= 299
+
+        ensure_job(conn, 'test_once', {}, max_attempts=1)
+        claimed = claim(conn, 'w1')
+        assert claimed.name == 'test_once'
+        fail(conn, claimed, "boom")
+        row = conn.execute(select(Job).where(Job.name == 'test_once')).first()
+        assert row.status == 'failed' and row.error == "boom"
+
+
+@needs_db
+def test_first_request_computes_inline_then_reads_without_writing(engine, monkeypatch):
+    from sqlalchemy import select
+    import database
+    from models import Job
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    database.dispose_engines()
+    calls = []
+    monkeypatch.setitem(HANDLERS, 'test_inline', lambda params: calls.append(params) or {"n": len(calls)})
+    try:
+        result, computed_at = precomputed('test_inline', {"x": 1}, 60)
+        assert result == {"n": 1} and computed_at is not None
+        key = job_key('test_inline', {"x": 1})
+        with engine.connect() as conn:
+            assert conn.execute(select(Job.status).where(Job.key == key)).scalar() == 'done'
+
+        assert precomputed('test_inline', {"x": 1}, 60)[0] == {"n": 1}
+        with engine.connect() as conn:
+            touched = conn.execute(select(Job.updated_at).where(Job.key == key)).scalar()
+        assert precomputed('test_inline', {"x": 1}, 60)[0] == {"n": 1}
+        with engine.connect() as conn:
+            assert conn.execute(select(Job.updated_at).where(Job.key == key)).scalar() == touched
+        assert len(calls) == 1
+    finally:
+        database.dispose_engines()
+
+
+@pytest.fixture
+def primary(engine, monkeypatch):
+    import database
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    database.dispose_engines()
+    yield engine
+    database.dispose_engines()
+
+
+@needs_db
+def test_concurrent_misses_compute_once(primary):
+    import threading
+    import time
+    from sqlalchemy import select
+    from models import Job
+    calls = []
+
+    def slow(params):
+        calls.append(params)
+        time.sleep(0.3)
+        return {"n": len(calls)}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(precomputed('test_flight', {}, 60, slow))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    with primary.connect() as conn:
+        stored_at = conn.execute(select(Job.result_at).where(Job.key == job_key('test_flight', {}))).scalar()
+    assert results == [({"n": 1}, stored_at)] * 4
+
+
+@needs_db
+def test_degraded_results_are_not_stored(primary, monkeypatch):
+    from sqlalchemy import select
+    from models import Job
+    degraded = {"degraded": True, "degraded_sections": ["kpis"]}
+    assert precomputed('test_degraded', {}, 60, lambda params: degraded) == (degraded, None)
+    key = job_key('test_degraded', {})
+    with primary.connect() as conn:
+        row = conn.execute(select(Job.result, Job.status).where(Job.key == key)).first()
+    assert row.result is None and row.status == 'pending'
+
+    # A worker run that degrades keeps the previous result and retries later.
+    with primary.begin() as conn:
+        store_result(conn, key, {"ok": True})
+        request_run(conn, key=key)
+    monkeypatch.setitem(HANDLERS, 'test_degraded', lambda params: degraded)
+    assert JobRunner(workers=0).run_once('w1')
+    with primary.connect() as conn:
+        row = conn.execute(select(Job.result, Job.status, Job.error).where(Job.key == key)).first()
+    assert row.result == {"ok": True} and row.status == 'pending' and "kpis" in row.error
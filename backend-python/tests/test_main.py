@@ -36,3 +36,44 @@ def test_logout():
     response = client.post("/api/auth/logout")
     assert response.status_code == 200
     assert response.json()["status"] == "ok"
+
+def test_cliente_metrics_unauthorized():
+    response = client.get("/api/clientes/1/metrics")
+    assert response.status_code == 401 or response.status_code == 403
+
+def test_export_unauthorized():
+    response = client.get("/api/export/whatsapp")
+    assert response.status_code == 401 or response.status_code == 403
+
+def test_cached_user_has_no_credentials(monkeypatch):
+    import main
+    from cache import Cache, MemoryCacheBackend
+    cache = Cache(MemoryCacheBackend())
+    monkeypatch.setattr(main, "get_cache", lambda: cache)
+    row = {"id": 7, "nombre": "Ana", "correo": "ana@correo.com", "area": "TI", "password_hash": "h", "contrasena": "c"}
+    monkeypatch.setattr(main, "_load_user_by_correo", lambda correo: dict(row))
+    assert main.get_user_by_correo("ana@correo.com", fresh=True)["contrasena"] == "c"
+    cached = cache.get('users', 'ana@correo.com')
+    assert cached == {"id": 7, "nombre": "Ana", "correo": "ana@correo.com", "area": "TI"}
+    assert main.get_user_by_correo("ana@correo.com") == cached
+
+def test_dashboard_charts_go_through_the_shared_cache(monkeypatch):
+    import main
+    from datetime import datetime, timezone
+    from cache import Cache, MemoryCacheBackend
+    cache = Cache(MemoryCacheBackend())
+    monkeypatch.setattr(main, "get_cache", lambda: cache)
+    at = datetime(2025, 3, 1, 12, tzinfo=timezone.utc)
+    calls = []
+
+    def fake_precomputed(name, params, max_age, compute, wait_seconds):
+        calls.append(params)
+        return ({"degraded": True}, None) if params["days"] == 14 else ({"kpis": 1}, at)
+
+    monkeypatch.setattr(main, "precomputed", fake_precomputed)
+    day7, day14 = main.dashboard_params('day', 7), main.dashboard_params('day', 14)
+    assert main._cached_dashboard_charts(day7, 300, None, 5.0) == ({"kpis": 1}, at)
+    assert main._cached_dashboard_charts(day7, 300, None, 5.0) == ({"kpis": 1}, at)
+    main._cached_dashboard_charts(day14, 300, None, 5.0)
+    assert main._cached_dashboard_charts(day14, 300, None, 5.0) == ({"degraded": True}, None)
+    assert calls == [day7, day14, day14]
@@ -0,0 +1,53 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import date, datetime
+
+import pytest
+
+from partitions import (ARCHIVE_SCHEMA, N8N_CHAT_HISTORIES, PartitionedTable, add_months, archive_partitions, bound_literal,
+                        month_start, partition_name, upper_bound)
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+needs_db = pytest.mark.skipif(not TEST_DATABASE_URL, reason="set TEST_DATABASE_URL to a local Postgres")
+
+
+def test_month_arithmetic():
+    assert month_start(date(2025, 3, 17)) == date(2025, 3, 1)
+    assert add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+
+def test_partition_names_and_bounds():
+    assert partition_name(N8N_CHAT_HISTORIES, date(2025, 3, 1)) == 'n8n_chat_histories_p202503'
+    assert bound_literal(date(2025, 3, 1), True) == "'2025-03-01 00:00:00+00'"
+    assert bound_literal(date(2025, 3, 1), False) == "'2025-03-01 00:00:00'"
+
+def test_upper_bound_parsing():
+    assert upper_bound("FOR VALUES FROM (MINVALUE) TO ('2025-04-01 00:00:00+00')") == date(2025, 4, 1)
+    assert upper_bound("FOR VALUES FROM ('2025-04-01 00:00:00') TO ('2025-05-01 00:00:00')") == date(2025, 5, 1)
+    assert upper_bound("DEFAULT") is None
+
+
+@needs_db
+def test_archive_keeps_undated_rows_unless_asked():
+    from sqlalchemy import create_engine
+    engine = create_engine(TEST_DATABASE_URL)
+    table = PartitionedTable('ptest', 'msgs', 'created_at')
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP SCHEMA IF EXISTS ptest CASCADE")
+            conn.exec_driver_sql("CREATE SCHEMA ptest")
+            conn.exec_driver_sql("CREATE TABLE ptest.msgs (id int, created_at timestamptz NOT NULL) PARTITION BY RANGE (created_at)")
+            conn.exec_driver_sql("CREATE TABLE ptest.msgs_undated PARTITION OF ptest.msgs FOR VALUES FROM (MINVALUE) TO ('1970-01-02 00:00:00+00')")
+            conn.exec_driver_sql("CREATE TABLE ptest.msgs_p202501 PARTITION OF ptest.msgs FOR VALUES FROM ('2025-01-01 00:00:00+00') TO ('2025-02-01 00:00:00+00')")
+        now = datetime(2026, 1, 15)
+        with engine.begin() as conn:
+            assert archive_partitions(conn, table, keep_months=6, now=now) == ['msgs_p202501']
+        with engine.begin() as conn:
+            assert archive_partitions(conn, table, keep_months=6, include_undated=True, now=now) == ['msgs_undated']
+    finally:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("DROP SCHEMA IF EXISTS ptest CASCADE")
+            for name in ('msgs_undated', 'msgs_p202501'):
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS {ARCHIVE_SCHEMA}."{name}"')
+        engine.dispose()
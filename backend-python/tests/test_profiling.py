@@ -0,0 +1,133 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import time
+
+import threading
+
+from profiling import ProfileStore, ProfilingMiddleware, RequestTrace, _current_trace, instrument_engine, trace_connection
+
+
+class FakeCursor:
+    itersize = 2000
+
+    def execute(self, sql, params=None):
+        time.sleep(0.01)
+
+    def fetchall(self):
+        return []
+
+
+class FakeConnection:
+    def cursor(self, *args, **kwargs):
+        return FakeCursor()
+
+    def close(self):
+        pass
+
+
+async def app(scope, receive, send):
+    cur = trace_connection(FakeConnection()).cursor()
+    cur.execute("SELECT   1\n FROM bot.whatsapp")
+    await asyncio.sleep(float(scope["query_string"] or b"0"))
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def call(middleware, headers=(), delay=b""):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    scope = {"type": "http", "method": "GET", "path": "/api/n8n_chats", "query_string": delay, "headers": list(headers)}
+    asyncio.run(middleware(scope, receive, send))
+    return sent
+
+
+def test_fast_requests_are_not_captured():
+    store = ProfileStore(slow_ms=500)
+    call(ProfilingMiddleware(app, store))
+    assert store.summaries() == []
+
+def test_slow_request_keeps_sql_and_stack_samples():
+    store = ProfileStore(slow_ms=100)
+    call(ProfilingMiddleware(app, store), delay=b"0.4")
+    [summary] = store.summaries()
+    assert summary["path"] == "/api/n8n_chats" and summary["duration_ms"] >= 400
+    capture = store.get(summary["id"]).to_dict()
+    assert capture["statements"][0]["sql"] == "SELECT 1 FROM bot.whatsapp"
+    assert capture["slow_samples"]
+
+def test_profile_header_requires_token():
+    store = ProfileStore(slow_ms=10_000)
+    middleware = ProfilingMiddleware(app, store, token="secreto")
+    call(middleware, headers=[(b"x-profile", b"otro")])
+    assert store.summaries() == []
+    sent = call(middleware, headers=[(b"x-profile", b"secreto")], delay=b"0.1")
+    [summary] = store.summaries()
+    assert (b"x-profile-id", str(summary["id"]).encode()) in sent[0]["headers"]
+    assert store.get(summary["id"]).stacks
+
+
+def _in_worker(trace, fn):
+    def run():
+        token = _current_trace.set(trace)
+        try:
+            fn()
+        finally:
+            _current_trace.reset(token)
+    worker = threading.Thread(target=run)
+    worker.start()
+    worker.join()
+    return worker.ident
+
+
+def test_worker_thread_is_released_when_the_connection_closes():
+    trace = RequestTrace(1, "GET", "/", "", False)
+    seen = []
+
+    def work():
+        outer = trace_connection(FakeConnection())
+        inner = trace_connection(FakeConnection())
+        inner.close()
+        seen.append(threading.get_ident() in trace.threads)
+        outer.close()
+        seen.append(threading.get_ident() in trace.threads)
+
+    ident = _in_worker(trace, work)
+    assert seen == [True, False]
+    assert ident not in trace.threads and threading.get_ident() in trace.threads
+
+def test_pooled_connections_are_sampled_until_checkin():
+    from sqlalchemy import create_engine, text
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    trace = RequestTrace(1, "GET", "/", "", False)
+    seen = []
+
+    def work():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            seen.append(threading.get_ident() in trace.threads)
+        seen.append(threading.get_ident() in trace.threads)
+
+    _in_worker(trace, work)
+    assert seen == [True, False]
+    assert trace.statements[0]["sql"] == "SELECT 1"
+
+def test_cursor_attributes_reach_the_real_cursor():
+    trace = RequestTrace(1, "GET", "/", "", False)
+    token = _current_trace.set(trace)
+    try:
+        conn = trace_connection(FakeConnection())
+        cur = conn.cursor()
+        cur.itersize = 50
+        assert cur._cursor.itersize == 50
+        conn.close()
+    finally:
+        _current_trace.reset(token)
@@ -0,0 +1,91 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from starlette.requests import Request
+
+from ratelimit import MemoryRateLimitBackend, SQLiteRateLimitBackend, LoginRateLimiter, client_ip
+
+
+def test_token_bucket_burst_and_refill():
+    backend = MemoryRateLimitBackend()
+    assert [backend.take("k", 3, 1.0, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert backend.take("k", 3, 1.0, 100.0) == 1.0
+    assert backend.take("k", 3, 1.0, 101.0) == 0.0
+
+def test_sliding_window_weights_previous_window():
+    backend = MemoryRateLimitBackend()
+    for _ in range(10):
+        backend.hit("k", 60, 30.0)
+    assert backend.count("k", 60, 30.0) == 10
+    # Halfway through the next window, half of the previous window still counts.
+    assert backend.count("k", 60, 90.0) == 5
+    assert backend.count("k", 60, 200.0) == 0
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryRateLimitBackend(max_keys=2)
+    backend.take("a", 1, 0.0, 0.0)
+    backend.take("b", 1, 0.0, 0.0)
+    backend.take("a", 1, 0.0, 0.0)
+    backend.take("c", 1, 0.0, 0.0)
+    assert list(backend._buckets) == ["a", "c"]
+
+def test_login_limiter_per_correo_and_failures():
+    limiter = LoginRateLimiter(MemoryRateLimitBackend(), ip_burst=100, correo_burst=2, correo_per_minute=1, max_failures_ip=3)
+    assert limiter.check("1.1.1.1", "Ana@Correo.com", now=0) == 0
+    assert limiter.check("1.1.1.1", "ana@correo.com", now=0) == 0
+    assert limiter.check("1.1.1.1", "ana@correo.com", now=0) == 60
+    # Another address is not throttled by the first one's attempts.
+    assert limiter.check("3.3.3.3", "ana@correo.com", now=0) == 0
+    for i in range(3):
+        limiter.record_failure("9.9.9.9", f"user{i}@correo.com", now=0)
+    assert limiter.check("9.9.9.9", "otro@correo.com", now=1) > 0
+
+def test_failures_lock_out_the_ip_correo_pair_only():
+    limiter = LoginRateLimiter(MemoryRateLimitBackend(), correo_burst=100, max_failures_correo=2)
+    for _ in range(2):
+        limiter.record_failure("6.6.6.6", "ana@correo.com", now=0)
+    assert limiter.check("6.6.6.6", "ana@correo.com", now=1) == 900
+    assert limiter.check("7.7.7.7", "ana@correo.com", now=1) == 0
+    limiter.record_success("6.6.6.6", "ana@correo.com")
+    assert limiter.check("6.6.6.6", "ana@correo.com", now=2) == 0
+
+def test_zero_refill_rate_is_rejected():
+    with pytest.raises(ValueError):
+        LoginRateLimiter(MemoryRateLimitBackend(), correo_per_minute=0)
+
+def test_infinite_wait_is_clamped():
+    limiter = LoginRateLimiter(MemoryRateLimitBackend(), ip_burst=1)
+    limiter.ip_rate = 0.0
+    assert limiter.check("1.1.1.1", "", now=0) == 0
+    assert limiter.check("1.1.1.1", "", now=0) == 900
+
+def test_sqlite_backend_is_shared(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    worker_a = SQLiteRateLimitBackend(path)
+    worker_b = SQLiteRateLimitBackend(path)
+    assert worker_a.take("ip:1", 2, 0.0, 10.0) == 0.0
+    assert worker_b.take("ip:1", 2, 0.0, 10.0) == 0.0
+    assert worker_a.take("ip:1", 2, 0.0, 10.0) > 0
+    worker_a.hit("fail:ip:1", 60, 10.0)
+    worker_b.hit("fail:ip:1", 60, 11.0)
+    assert worker_a.count("fail:ip:1", 60, 12.0) == 2
+    worker_b.reset("fail:ip:1")
+    assert worker_a.count("fail:ip:1", 60, 12.0) == 0
+
+
+def _request(peer: str, forwarded: str | None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "method": "POST", "path": "/login", "headers": headers, "client": (peer, 1234), "query_string": b""})
+
+def test_client_ip_ignores_spoofed_forwarded_entries(monkeypatch):
+    monkeypatch.delenv("TRUST_PROXY_HEADERS", raising=False)
+    assert client_ip(_request("10.0.0.1", "1.2.3.4")) == "10.0.0.1"
+    monkeypatch.setenv("TRUST_PROXY_HEADERS", "1")
+    monkeypatch.delenv("TRUSTED_PROXY_HOPS", raising=False)
+    assert client_ip(_request("10.0.0.1", "6.6.6.6, 203.0.113.7")) == "203.0.113.7"
+    monkeypatch.setenv("TRUSTED_PROXY_HOPS", "2")
+    assert client_ip(_request("10.0.0.1", "6.6.6.6, 203.0.113.7, 10.0.0.2")) == "203.0.113.7"
+    assert client_ip(_request("10.0.0.1", "203.0.113.7")) == "10.0.0.1"
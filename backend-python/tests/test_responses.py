@@ -0,0 +1,24 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from responses import dumps
+from compression import negotiate_encoding, BROTLI_AVAILABLE
+
+
+def test_dumps_psycopg2_values():
+    row = {"id": 1, "monto": Decimal("10.50"), "timestamp": datetime(2025, 1, 2, 3, 4, 5), "message": {"type": "human"}}
+    assert json.loads(dumps(row)) == {"id": 1, "monto": 10.5, "timestamp": "2025-01-02T03:04:05", "message": {"type": "human"}}
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("") is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    expected = "br" if BROTLI_AVAILABLE else "gzip"
+    assert negotiate_encoding("gzip, deflate, br") == expected
+    assert negotiate_encoding("br;foo=1;q=0, gzip;level=1 ; Q=0") is None
+    assert negotiate_encoding("br;foo=1;q=0, gzip") == "gzip"
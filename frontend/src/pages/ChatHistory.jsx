@@ -19,13 +19,13 @@ const ChatHistory = () => {
         const load = async () => {
             setLoading(true);
             try {
-                const sessionsRes = await fetchWithAuth('/api/n8n_chats?limit=1000');
+                const sessionsRes = await fetchWithAuth('/api/n8n_chats?limit=1000&fields=type,content&preview_chars=120');
                 if (!sessionsRes.ok) throw new Error(`HTTP ${sessionsRes.status}`);
                 const sessionsData = await sessionsRes.json();
                 const rows = [];
                 for (const s of sessionsData) {
                     try {
-                        const r = await fetchWithAuth(`/api/chats/${encodeURIComponent(s.session_id)}?limit=1000`);
+                        const r = await fetchWithAuth(`/api/chats/${encodeURIComponent(s.session_id)}?limit=1000&fields=type,content`);
                         if (!r.ok) continue;
                         const msgs = await r.json();
                         for (const m of msgs) {
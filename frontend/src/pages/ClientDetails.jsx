@@ -14,7 +14,7 @@ const ClientDetails = () => {
         const fetchMessages = async () => {
             try {
                 setLoading(true);
-                const res = await fetchWithAuth(`/api/chats/${encodeURIComponent(id)}`);
+                const res = await fetchWithAuth(`/api/chats/${encodeURIComponent(id)}?fields=type,content`);
                 if (!res.ok) throw new Error(`HTTP ${res.status}`);
                 const data = await res.json();
                 const normalized = (data || []).map((row) => {